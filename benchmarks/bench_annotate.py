@@ -0,0 +1,115 @@
+""" Benchmark of the annotation step as the number of detections per frame
+    grows.
+
+    legacy    - the original per-label loop (string comparisons, duplicated
+                putText/rectangle branches, six prints per label), with
+                stdout going to a log file as it does under Greengrass
+    annotator - Annotator in quiet mode, with new boxes on every frame
+    reused    - Annotator in quiet mode, with the boxes of the previous frame
+                (cached or skipped Rekognition calls), reusing the overlay
+
+    Usage: python benchmarks/bench_annotate.py [--frames 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "labmda function")
+)
+from annotator import Annotator  # noqa: E402
+
+
+def random_labels(count, seed=0):
+    rng = random.Random(seed)
+    labels = []
+    for _ in range(count):
+        width, height = rng.uniform(0.05, 0.3), rng.uniform(0.05, 0.5)
+        labels.append(
+            {
+                "Name": rng.choice(["person", "PPE"]),
+                "Confidence": rng.uniform(50, 100),
+                "Geometry": {
+                    "BoundingBox": {
+                        "Left": rng.uniform(0, 1 - width),
+                        "Top": rng.uniform(0, 1 - height),
+                        "Width": width,
+                        "Height": height,
+                    }
+                },
+            }
+        )
+    return labels
+
+
+def legacy(image, labels):
+    imgHeight, imgWidth, c = image.shape
+    ppe = 0
+    person = 0
+    for elabel in labels:
+        print("Label " + str(elabel["Name"]))
+        print("Confidence " + str(elabel["Confidence"]))
+        if str(elabel["Name"]) == "PPE":
+            ppe = ppe + 1
+        elif str(elabel["Name"]) == "person":
+            person = person + 1
+        if "Geometry" in elabel:
+            box = elabel["Geometry"]["BoundingBox"]
+            left = imgWidth * box["Left"]
+            top = imgHeight * box["Top"]
+            width = imgWidth * box["Width"]
+            height = imgHeight * box["Height"]
+            if str(elabel["Name"]) == "person":
+                colour = (0, 255, 0)
+            else:
+                colour = (255, 0, 0)
+            cv2.putText(image, elabel["Name"], (int(left), int(top)), cv2.FONT_HERSHEY_COMPLEX, 1, colour, 1)
+            print("Left: " + "{0:.0f}".format(left))
+            print("Top: " + "{0:.0f}".format(top))
+            print("Label Width: " + "{0:.0f}".format(width))
+            print("Label Height: " + "{0:.0f}".format(height))
+            cv2.rectangle(image, (int(left), int(top)), (int(left + width), int(top + height)), colour, 2)
+    return person, ppe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    frame = np.full((args.height, args.width, 3), 128, dtype=np.uint8)
+    annotator = Annotator(quiet=True)
+    log = tempfile.TemporaryFile("w")
+    print("frame {}x{}, {} frames per run".format(args.width, args.height, args.frames))
+    print("{:>11}{:>12}{:>12}{:>12}".format("detections", "legacy ms", "annotator", "reused"))
+    for count in (1, 2, 5, 10, 20, 50, 100):
+        labels = [random_labels(count, seed) for seed in range(args.frames)]
+        images = [frame.copy() for _ in range(args.frames)]
+        stdout, sys.stdout = sys.stdout, log
+        start = time.time()
+        for image, frame_labels in zip(images, labels):
+            legacy(image, frame_labels)
+            log.flush()
+        legacy_ms = (time.time() - start) * 1000.0 / args.frames
+        sys.stdout = stdout
+        results = [legacy_ms]
+        for frame_labels in (labels, [labels[0]] * args.frames):
+            images = [frame.copy() for _ in range(args.frames)]
+            start = time.time()
+            for image, labels_ in zip(images, frame_labels):
+                annotator.annotate(image, labels_)
+            results.append((time.time() - start) * 1000.0 / args.frames)
+        print("{:>11}{:>12.3f}{:>12.3f}{:>12.3f}".format(count, *results))
+    log.close()
+
+
+if __name__ == "__main__":
+    main()
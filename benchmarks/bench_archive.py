@@ -0,0 +1,223 @@
+""" Per-frame S3 objects against the time-segmented archive (archive.py).
+
+    Records --minutes of annotated 720p frames at --fps, once as one object
+    per frame as the upload stage did ("frameID: N.jpg", counts in the
+    metadata) and once as segments with their index, with a restart of the
+    lambda half way. Then:
+      - seek: the frame shown at --seeks random timestamps. Per frame
+        objects are found by a binary search on the frame id with HEAD
+        requests (the best case, only possible while the ids did not
+        restart); the archive lists the hour partitions, reads an index
+        and makes one ranged GET.
+      - search: the frames with a violation during a random 10 minutes. Per
+        frame objects need a listing and a HEAD per frame; the archive
+        reads the indexes.
+    Requests are counted on an in-memory S3; the time column adds --rtt per
+    request and the bytes at --mbps.
+
+    Usage:
+        python benchmarks/bench_archive.py --minutes 60 --fps 2
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from frames import synthetic_frame  # noqa: E402
+from archive import ArchiveReader, SegmentArchiver  # noqa: E402
+
+BUCKET = "bench"
+START = 1792335600.0 + 1234.5
+
+
+class DirectUploader(object):
+    """ S3Uploader stand-in uploading on the calling thread. """
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def submit(self, item, callback=None):
+        self.s3.put_object(Bucket=BUCKET, **item)
+        if callback is not None:
+            callback(item)
+
+
+def footage(args):
+    """ Yields (timestamp, jpeg, persons, ppes, violations) for the run. """
+    rng = random.Random(0)
+    jpegs = []
+    for seed in range(8):
+        frame = synthetic_frame(1280, 720, seed)
+        jpegs.append(cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])[1].tobytes())
+    count = int(args.minutes * 60 * args.fps)
+    for index in range(count):
+        persons = rng.randint(0, 4)
+        ppes = rng.randint(0, persons)
+        yield START + index / args.fps, jpegs[index % len(jpegs)], persons, ppes, persons - ppes
+
+
+def cost(s3, before, args):
+    requests = (s3.puts + s3.gets + s3.heads + s3.lists) - before[0]
+    read = s3.bytes_read - before[1]
+    return requests, read, requests * args.rtt + read * 8 / (args.mbps * 1e6)
+
+
+def snapshot(s3):
+    return (s3.puts + s3.gets + s3.heads + s3.lists, s3.bytes_read)
+
+
+def frame_objects(args, frames):
+    s3 = fakes.FakeS3(keep_bodies=True)
+    # The sequence restarts with the lambda, overwriting the first frames
+    restart = len(frames) // 2
+    for index, (timestamp, jpeg, persons, ppes, violations) in enumerate(frames):
+        sequence = index + 1 if index < restart else index - restart + 1
+        s3.put_object(
+            Bucket=BUCKET,
+            Key="frameID: {}.jpg".format(sequence),
+            Body=jpeg,
+            Metadata={"NumberOfPersons": str(persons), "Violations": str(violations)},
+            # Set by S3 on upload
+            LastModified=timestamp,
+        )
+    puts, written = s3.puts, s3.bytes
+    rng = random.Random(1)
+    before = snapshot(s3)
+    last = len(s3.objects)
+    for _ in range(args.seeks):
+        target = rng.uniform(START, frames[-1][0])
+        low, high = 1, last
+        while low < high:
+            middle = (low + high + 1) // 2
+            head = s3.head_object(Bucket=BUCKET, Key="frameID: {}.jpg".format(middle))
+            if head["LastModified"] <= target:
+                low = middle
+            else:
+                high = middle - 1
+        s3.get_object(Bucket=BUCKET, Key="frameID: {}.jpg".format(low))
+    seek = cost(s3, before, args)
+    before = snapshot(s3)
+    for _ in range(args.searches):
+        start = rng.uniform(START, frames[-1][0] - 600)
+        keys, token = [], None
+        while True:
+            page = s3.list_objects_v2(Bucket=BUCKET, Prefix="frameID", ContinuationToken=token)
+            keys.extend(entry["Key"] for entry in page["Contents"])
+            if not page["IsTruncated"]:
+                break
+            token = page["NextContinuationToken"]
+        found = 0
+        for key in keys:
+            head = s3.head_object(Bucket=BUCKET, Key=key)
+            if start <= head["LastModified"] <= start + 600 and head["Metadata"]["Violations"] != "0":
+                found += 1
+    search = cost(s3, before, args)
+    return {
+        "puts": puts,
+        "mbytes_written": round(written / 1e6, 1),
+        "objects_kept": len(s3.objects),
+        "seek": seek,
+        "search": search,
+    }
+
+
+def segments(args, frames):
+    s3 = fakes.FakeS3(keep_bodies=True)
+    restart = len(frames) // 2
+    archiver = None
+    start = time.time()
+    for index, (timestamp, jpeg, persons, ppes, violations) in enumerate(frames):
+        if index in (0, restart):
+            if archiver is not None:
+                archiver.flush()
+            archiver = SegmentArchiver(DirectUploader(s3), segment_seconds=args.segment_seconds)
+        archiver.add(jpeg, timestamp, index + 1, persons, ppes, violations=violations)
+    archiver.flush()
+    add_ms = (time.time() - start) * 1000.0 / len(frames)
+    puts, written = s3.puts, s3.bytes
+    rng = random.Random(1)
+    before = snapshot(s3)
+    checked = 0
+    for _ in range(args.seeks):
+        # A new reader per seek, so the index cache does not help
+        reader = ArchiveReader(s3, BUCKET)
+        target = rng.uniform(START, frames[-1][0])
+        record, jpeg = reader.read(target)
+        position = int((record["timestamp"] - START) * args.fps + 0.5)
+        checked += jpeg == frames[position][1] and record["timestamp"] <= target
+    seek = cost(s3, before, args)
+    before = snapshot(s3)
+    for _ in range(args.searches):
+        reader = ArchiveReader(s3, BUCKET)
+        start = rng.uniform(START, frames[-1][0] - 600)
+        # The violations are in the indexes, no frame is read
+        list(reader.records(start, start + 600))
+    search = cost(s3, before, args)
+    return {
+        "puts": puts,
+        "mbytes_written": round(written / 1e6, 1),
+        "objects_kept": len(s3.objects),
+        "seek": seek,
+        "search": search,
+        "seeks_correct": checked,
+        "add_ms": round(add_ms, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--minutes", type=float, default=60.0)
+    parser.add_argument("--fps", type=float, default=2.0, help="analysed frames per second")
+    parser.add_argument("--segment-seconds", type=float, default=60.0)
+    parser.add_argument("--seeks", type=int, default=50)
+    parser.add_argument("--searches", type=int, default=5)
+    parser.add_argument("--rtt", type=float, default=0.03, help="seconds per request")
+    parser.add_argument("--mbps", type=float, default=20.0, help="download bandwidth")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    frames = list(footage(args))
+    results = {"config": vars(args)}
+    print("{} frames of {} KB".format(len(frames), len(frames[0][1]) // 1024))
+    print(
+        "{:<14} {:>7} {:>8} {:>8} {:>14} {:>11} {:>16} {:>13}".format(
+            "format", "PUTs", "MB", "objects", "requests/seek", "ms/seek", "requests/search", "s/search"
+        )
+    )
+    for name, run in (("frame objects", frame_objects), ("segments", segments)):
+        result = run(args, frames)
+        results[name] = result
+        print(
+            "{:<14} {:>7} {:>8} {:>8} {:>14} {:>11} {:>16} {:>13}".format(
+                name,
+                result["puts"],
+                result["mbytes_written"],
+                result["objects_kept"],
+                round(float(result["seek"][0]) / args.seeks, 1),
+                round(result["seek"][2] * 1000.0 / args.seeks, 1),
+                round(float(result["search"][0]) / args.searches, 1),
+                round(result["search"][2] / args.searches, 2),
+            )
+        )
+    segments_result = results["segments"]
+    print(
+        "archive: {}/{} seeks returned the right frame, {} ms per added frame".format(
+            segments_result["seeks_correct"], args.seeks, segments_result["add_ms"]
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+""" Micro-benchmark of the PPE to person association.
+
+    loop       - containment of every PPE box in every person box computed
+                 pair by pair in Python
+    vectorised - association.associate, one NumPy pass over all the pairs
+
+    Usage: python benchmarks/bench_associate.py [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+from association import associate  # noqa: E402
+
+
+def label(name, left, top, width, height):
+    return {
+        "Name": name,
+        "Confidence": 90.0,
+        "Geometry": {
+            "BoundingBox": {"Left": left, "Top": top, "Width": width, "Height": height}
+        },
+    }
+
+
+def crowd(persons, seed=0):
+    """ persons boxes with a helmet and a vest for most of them, plus loose
+        PPE lying around.
+    """
+    rng = random.Random(seed)
+    labels = []
+    for _ in range(persons):
+        left, top = rng.uniform(0, 0.95), rng.uniform(0, 0.9)
+        width, height = rng.uniform(0.01, 0.05), rng.uniform(0.05, 0.1)
+        labels.append(label("person", left, top, width, height))
+        if rng.random() < 0.8:
+            labels.append(label("PPE", left + width * 0.3, top, width * 0.4, height * 0.15))
+            labels.append(label("PPE", left + width * 0.1, top + height * 0.3, width * 0.8, height * 0.3))
+    for _ in range(persons // 10):
+        labels.append(label("PPE", rng.uniform(0, 0.95), rng.uniform(0, 0.95), 0.01, 0.01))
+    return labels
+
+
+def loop(labels, min_containment=0.5, required=1):
+    def corners(item):
+        box = item["Geometry"]["BoundingBox"]
+        return box["Left"], box["Top"], box["Left"] + box["Width"], box["Top"] + box["Height"]
+
+    persons = [corners(item) for item in labels if item["Name"] == "person"]
+    counts = [0] * len(persons)
+    for item in labels:
+        if item["Name"] != "PPE":
+            continue
+        left, top, right, bottom = corners(item)
+        area = max((right - left) * (bottom - top), 1e-12)
+        best, owner, containment = 0.0, None, 0.0
+        for index, (pl, pt, pr, pb) in enumerate(persons):
+            inter = max(0.0, min(right, pr) - max(left, pl)) * max(0.0, min(bottom, pb) - max(top, pt))
+            union = area + (pr - pl) * (pb - pt) - inter
+            # Same tie break as associate: the closest fitting person
+            score = inter / area + inter / union * 1e-3
+            if score > best:
+                best, owner, containment = score, index, inter / area
+        if owner is not None and containment >= min_containment:
+            counts[owner] += 1
+    return sum(1 for count in counts if count < required)
+
+
+def timed(func, labels, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = func(labels)
+    return (time.time() - start) * 1000.0 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print("{:>8}{:>8}{:>12}{:>14}{:>10}".format("persons", "ppe", "loop ms", "vectorised ms", "speedup"))
+    for persons in (10, 50, 100, 300, 500):
+        labels = crowd(persons)
+        ppe = sum(1 for item in labels if item["Name"] == "PPE")
+        loop_ms, violations = timed(loop, labels, args.repeat)
+        vector_ms, result = timed(associate, labels, args.repeat)
+        if result["violations"] != violations:
+            raise Exception("Association results differ")
+        print(
+            "{:>8}{:>8}{:>12.2f}{:>14.2f}{:>9.1f}x".format(
+                persons, ppe, loop_ms, vector_ms, loop_ms / vector_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+""" Time to first result after a restart: the startup steps of the lambda
+    run one after the other (client creation, model load, first call paying
+    the TLS handshake) against the ColdStart path, where the clients are
+    created and warmed up while the model loads. The model load, client
+    creation and handshake are simulated with the given latencies, the
+    detection loop itself runs against the stand-ins of fakes.py.
+
+    Usage:
+        python benchmarks/bench_cold_start.py --model-load 2 --runs 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from frames import frame_source  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+from s3_uploader import S3Uploader  # noqa: E402
+from startup import ColdStart, warm_up_rekognition, warm_up_s3  # noqa: E402
+
+
+class ColdConnection(object):
+    """ Wraps a stand-in client so the first request pays the connection
+        setup (credentials, DNS, TLS handshake) once.
+    """
+
+    def __init__(self, client, handshake):
+        self.client = client
+        self.handshake = handshake
+        self.connected = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            if not self.connected:
+                time.sleep(self.handshake)
+                self.connected = True
+
+    def detect_custom_labels(self, **kwargs):
+        self._connect()
+        return self.client.detect_custom_labels(**kwargs)
+
+    def put_object(self, **kwargs):
+        self._connect()
+        return self.client.put_object(**kwargs)
+
+    def describe_projects(self, **kwargs):
+        self._connect()
+        return {"ProjectDescriptions": []}
+
+    def head_bucket(self, **kwargs):
+        self._connect()
+        return {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def create_clients(args):
+    time.sleep(args.client_create)
+    rekognition = ColdConnection(
+        fakes.FakeRekognition(latency=fakes.Latency(args.rekognition_latency), seed=1),
+        args.handshake,
+    )
+    s3 = ColdConnection(fakes.FakeS3(latency=fakes.Latency(args.s3_latency), seed=2), args.handshake)
+    return rekognition, s3
+
+
+def load_model(args):
+    time.sleep(args.model_load)
+    return fakes.FakeModel(seed=3)
+
+
+def start(args, overlapped):
+    """ Runs one startup and returns the ColdStart report. """
+    startup = ColdStart()
+    if overlapped:
+
+        def clients_step():
+            rekognition, s3 = create_clients(args)
+            startup.background("warm_up_rekognition", warm_up_rekognition, rekognition)
+            startup.background("warm_up_s3", warm_up_s3, s3, "bench-bucket")
+            return rekognition, s3
+
+        clients = startup.background("clients", clients_step)
+        model = startup.run("model", load_model, args)
+        rekognition, s3 = clients.result()
+    else:
+        rekognition, s3 = startup.run("clients", create_clients, args)
+        model = startup.run("model", load_model, args)
+    camera = fakes.FakeCamera(frame_source(None, (1280, 720)), seed=4)
+    uploader = S3Uploader(s3, "bench-bucket", spool_dir=tempfile.mkdtemp(prefix="bench_spool_"))
+    uploader.start()
+    stages = DetectionStages(
+        camera.getLastFrame,
+        model,
+        rekognition,
+        uploader,
+        fakes.FakeIoTClient(),
+        "bench/infer",
+        fakes.FakeDisplay(),
+        "arn:bench",
+        startup=startup,
+    )
+    errors = []
+    pipeline = Pipeline(stages.stage_list(), on_error=lambda name, ex: errors.append((name, str(ex))))
+    pipeline.start()
+    deadline = time.time() + 30
+    while startup.time_to_first_result() is None and time.time() < deadline:
+        time.sleep(0.005)
+    pipeline.join()
+    uploader.join()
+    startup.close()
+    if errors:
+        print("stage errors: {}".format(errors[:3]))
+    return startup.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model-load", type=float, default=2.0, help="seconds")
+    parser.add_argument("--client-create", type=float, default=0.5, help="seconds")
+    parser.add_argument("--handshake", type=float, default=0.4, help="seconds")
+    parser.add_argument("--rekognition-latency", type=float, default=0.15)
+    parser.add_argument("--s3-latency", type=float, default=0.05)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    results = {"config": vars(args)}
+    print("{:<12} {:>16} {:>12} {:>18}".format("startup", "first result ms", "model ms", "first call ms"))
+    for name, overlapped in (("sequential", False), ("overlapped", True)):
+        runs = [start(args, overlapped) for _ in range(args.runs)]
+        best = min(runs, key=lambda run: run["time_to_first_result_ms"] or float("inf"))
+        results[name] = runs
+        print(
+            "{:<12} {:>16} {:>12} {:>18}".format(
+                name,
+                best["time_to_first_result_ms"],
+                best["steps_ms"].get("model"),
+                best["steps_ms"].get("first_rekognition"),
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
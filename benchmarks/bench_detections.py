@@ -0,0 +1,220 @@
+""" Benchmark of the compact detection records (detections.py) against the
+    raw response dicts they replace.
+
+    1. Rekognition: per frame, the reads the annotate and upload stages make
+       of the labels (counts per name, pixel boxes to draw, person and PPE
+       boxes to associate, the history rows, the published compact labels),
+       once walking the CustomLabels dicts as before and once parsing them
+       into Detections first.
+    2. SSD: the person boxes, scores and gate check of the infer and
+       analyse stages, from the parseResult dicts as before and through
+       Detections.from_ssd.
+    3. Memory of --keep frames of labels held as response dicts, as lists
+       of Detection records and as Detections batches.
+
+    Usage:
+        python benchmarks/bench_detections.py --frames 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from detections import PERSON, PPE, SSD_LABELS, Detections  # noqa: E402
+from iot_publisher import compact_labels  # noqa: E402
+
+SHAPE = (720, 1280, 3)
+
+
+def rekognition_labels(count, rng):
+    """ A CustomLabels list as returned by boto3. """
+    labels = []
+    for _ in range(count):
+        left, top = rng.uniform(0, 0.8), rng.uniform(0, 0.6)
+        labels.append(
+            {
+                "Name": rng.choice((PERSON, PPE)),
+                "Confidence": rng.uniform(50, 100),
+                "Geometry": {
+                    "BoundingBox": {
+                        "Width": rng.uniform(0.02, 0.2),
+                        "Height": rng.uniform(0.05, 0.4),
+                        "Left": left,
+                        "Top": top,
+                    }
+                },
+            }
+        )
+    # A fresh copy, like every parsed response
+    return json.loads(json.dumps(labels))
+
+
+def ssd_results(count, rng):
+    return [
+        {
+            "label": rng.choice((15, 15, 7, 9, 12)),
+            "prob": rng.random(),
+            "xmin": rng.uniform(0, 200),
+            "ymin": rng.uniform(0, 200),
+            "xmax": rng.uniform(200, 300),
+            "ymax": rng.uniform(200, 300),
+        }
+        for _ in range(count)
+    ]
+
+
+def dict_reads(labels):
+    """ What the stages read from the dicts before, see the git history of
+        annotator.py, association.py, detection_history.py and
+        iot_publisher.py.
+    """
+    counts = Counter(str(elabel["Name"]) for elabel in labels)
+    names, boxes = [], []
+    for elabel in labels:
+        if "Geometry" in elabel:
+            box = elabel["Geometry"]["BoundingBox"]
+            names.append(elabel["Name"])
+            boxes.append((box["Left"], box["Top"], box["Width"], box["Height"]))
+    height, width = SHAPE[:2]
+    pixels = np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * (width, height, width, height)
+    pixels[:, 2:] += pixels[:, :2]
+    for name in (PERSON, PPE):
+        selected = [
+            label["Geometry"]["BoundingBox"]
+            for label in labels
+            if label["Name"] == name and "Geometry" in label
+        ]
+        array = np.empty((len(selected), 4), dtype=np.float64)
+        for index, box in enumerate(selected):
+            array[index] = (
+                box["Left"],
+                box["Top"],
+                box["Left"] + box["Width"],
+                box["Top"] + box["Height"],
+            )
+    persons = sum(1 for elabel in labels if elabel["Name"] == "person")
+    ppes = sum(1 for elabel in labels if elabel["Name"] == "PPE")
+    label_names = [elabel["Name"] for elabel in labels]
+    confidences = [elabel["Confidence"] for elabel in labels]
+    rows = [
+        [elabel["Geometry"]["BoundingBox"][key] for elabel in labels]
+        for key in ("Left", "Top", "Width", "Height")
+    ]
+    compact = []
+    for label in labels:
+        box = label["Geometry"]["BoundingBox"]
+        compact.append(
+            [
+                label["Name"],
+                round(label["Confidence"], 1),
+                round(box["Left"], 3),
+                round(box["Top"], 3),
+                round(box["Width"], 3),
+                round(box["Height"], 3),
+            ]
+        )
+    return counts, pixels, persons, ppes, label_names, confidences, rows, compact
+
+
+def compact_reads(labels):
+    """ The same reads through Detections. """
+    detections = Detections.from_rekognition(labels)
+    counts = detections.counts()
+    pixels = detections.pixel_corners(SHAPE)
+    persons_boxes = detections.corners(PERSON)
+    ppe_boxes = detections.corners(PPE)
+    names = detections.names()
+    return counts, pixels, persons_boxes, ppe_boxes, names, compact_labels(detections)
+
+
+def dict_ssd(results, threshold):
+    boxes = [
+        (4.26 * obj["xmin"], 2.4 * obj["ymin"], 4.26 * obj["xmax"], 2.4 * obj["ymax"])
+        for obj in results
+        if obj["label"] == 15 and obj["prob"] > threshold
+    ]
+    scores = [obj["prob"] for obj in results if obj["label"] == 15 and obj["prob"] > threshold]
+    gate = [obj for obj in results if obj["label"] == 15 and obj["prob"] > threshold]
+    return boxes, scores, len(gate) > 0
+
+
+def compact_ssd(results, threshold):
+    ssd = Detections.from_ssd(results, 300, 300, threshold, classes=SSD_LABELS)
+    persons = ssd.select(PERSON)
+    boxes = [tuple(box) for box in persons.pixel_corners(SHAPE).tolist()]
+    return boxes, (persons.confidences / 100).tolist(), len(persons) > 0
+
+
+def timed(func, inputs, *args):
+    start = time.perf_counter()
+    for item in inputs:
+        func(item, *args)
+    return (time.perf_counter() - start) * 1e6 / len(inputs)
+
+
+def held_bytes(build):
+    tracemalloc.start()
+    held = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--labels", default="2,8,32", help="labels per frame")
+    parser.add_argument("--ssd-objects", type=int, default=100)
+    parser.add_argument("--keep", type=int, default=1000, help="frames held for the memory test")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    results = {"config": vars(args), "rekognition": {}, "memory": {}}
+
+    print("{:<8} {:>14} {:>16} {:>8}".format("labels", "dicts us/frame", "compact us/frame", "speedup"))
+    for count in [int(value) for value in args.labels.split(",")]:
+        frames = [rekognition_labels(count, rng) for _ in range(args.frames)]
+        dicts = timed(dict_reads, frames)
+        compact = timed(compact_reads, frames)
+        results["rekognition"][count] = {"dicts_us": round(dicts, 1), "compact_us": round(compact, 1)}
+        print("{:<8} {:>14.1f} {:>16.1f} {:>7.2f}x".format(count, dicts, compact, dicts / compact))
+
+    outputs = [ssd_results(args.ssd_objects, rng) for _ in range(args.frames)]
+    dicts = timed(dict_ssd, outputs, 0.25)
+    compact = timed(compact_ssd, outputs, 0.25)
+    results["ssd"] = {"dicts_us": round(dicts, 1), "compact_us": round(compact, 1)}
+    print(
+        "ssd {:<4} {:>14.1f} {:>16.1f} {:>7.2f}x".format(
+            args.ssd_objects, dicts, compact, dicts / compact
+        )
+    )
+
+    print()
+    print("{:<8} {:>12} {:>12} {:>12}".format("labels", "dicts KB", "records KB", "batch KB"))
+    for count in [int(value) for value in args.labels.split(",")]:
+        frames = [rekognition_labels(count, rng) for _ in range(args.keep)]
+        sizes = (
+            held_bytes(lambda: [json.loads(json.dumps(labels)) for labels in frames]),
+            held_bytes(lambda: [list(Detections.from_rekognition(labels)) for labels in frames]),
+            held_bytes(lambda: [Detections.from_rekognition(labels) for labels in frames]),
+        )
+        results["memory"][count] = [round(size / 1024.0) for size in sizes]
+        print("{:<8} {:>12} {:>12} {:>12}".format(count, *results["memory"][count]))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
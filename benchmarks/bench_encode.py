@@ -0,0 +1,79 @@
+""" Micro-benchmark of the JPEG encodes done for every frame.
+
+    legacy  - the original loop: a full resolution encode for Rekognition,
+              a second encode of the annotated frame for S3 and a resize and
+              third encode in LocalDisplay.set_frame_data
+    encoder - FrameEncoder: a downscaled, budgeted encode for Rekognition,
+              one annotated encode for S3 and the stream server, and the
+              480p encode of LocalDisplay, made only while a reader is
+              connected (counted here as if one always was)
+
+    Usage: python benchmarks/bench_encode.py [--image frame.jpg] [--frames 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from frame_encoder import FrameEncoder  # noqa: E402
+from local_display import LocalDisplay  # noqa: E402
+from frames import synthetic_frame  # noqa: E402
+
+
+def timed(func, frames):
+    sizes = []
+    start = time.time()
+    for frame in frames:
+        sizes.append(func(frame))
+    elapsed = time.time() - start
+    return elapsed * 1000.0 / len(frames), float(sum(sizes)) / len(frames)
+
+
+def legacy(frame):
+    analysis = cv2.imencode(".jpg", frame)[1].tobytes()
+    upload = cv2.imencode(".jpg", frame)[1].tobytes()
+    display = cv2.imencode(".jpg", cv2.resize(frame, (858, 480)))[1]
+    return len(analysis) + len(upload) + display.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--image", help="Frame to encode instead of a synthetic one")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--analysis-width", type=int, default=1280)
+    parser.add_argument("--byte-budget", type=int, default=200000)
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image) if args.image else synthetic_frame()
+    frames = [frame] * args.frames
+    encoder = FrameEncoder(analysis_width=args.analysis_width, byte_budget=args.byte_budget)
+    display = LocalDisplay("480p")
+
+    def shared(frame):
+        analysis = encoder.encode_for_analysis(frame)
+        annotated = encoder.encode_annotated(frame)
+        return analysis.nbytes + annotated.nbytes + display.encode(frame).nbytes
+
+    print("frame {}x{}, {} frames".format(frame.shape[1], frame.shape[0], args.frames))
+    print("{:<10}{:>12}{:>16}".format("path", "ms/frame", "bytes/frame"))
+    for name, func in (("legacy", legacy), ("encoder", shared)):
+        ms, size = timed(func, frames)
+        print("{:<10}{:>12.2f}{:>16.0f}".format(name, ms, size))
+    for path, entry in sorted(encoder.stats().items()):
+        if isinstance(entry, dict):
+            print(
+                "  {:<10}{:>10.2f} ms{:>14.0f} bytes".format(
+                    path, entry["ms_per_frame"], entry["bytes_per_frame"]
+                )
+            )
+    print("  final analysis quality: {}".format(encoder.quality))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+""" Benchmark of the local fallback detector (fallback.py).
+
+    1. CPU throughput and accuracy of LocalPPEDetector on synthetic scenes
+       at 480p, 720p and 1080p, where a random half of the persons wear a
+       yellow, orange or blue hard hat.
+    2. The detection loop through a Rekognition outage: Rekognition fails
+       (--mode down) or answers after --slow-latency seconds (--mode slow,
+       calls longer than --timeout fail like a client read timeout) during
+       the middle of the run, with and without the fallback. Reports the
+       frames completed and the source of their results.
+
+    Usage:
+        python benchmarks/bench_fallback.py --frames 200 --duration 16
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from frames import frame_source  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+from s3_uploader import S3Uploader  # noqa: E402
+from fallback import CircuitBreaker, LocalPPEDetector  # noqa: E402
+
+RESOLUTIONS = {"480p": (858, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+HAT_COLOURS = [(0, 220, 240), (0, 140, 255), (200, 90, 20)]
+
+
+def scene(width, height, persons, rng):
+    """ Returns a frame, the person boxes and whether each wears a hat. """
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    frame += rng.randint(0, 20, size=frame.shape, dtype=np.uint8)
+    boxes, hats = [], []
+    person_width = width // (persons * 2)
+    for index in range(persons):
+        xmin = index * 2 * person_width + person_width // 2
+        ymin = height // 6
+        xmax, ymax = xmin + person_width, height - height // 10
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (60, 50, 40), -1)
+        head = (ymax - ymin) // 8
+        cx = (xmin + xmax) // 2
+        cv2.circle(frame, (cx, ymin + head), head // 2 + 2, (120, 150, 190), -1)
+        hat = bool(rng.randint(0, 2))
+        if hat:
+            colour = HAT_COLOURS[rng.randint(0, len(HAT_COLOURS))]
+            axes = (head * 7 // 10, head * 6 // 10)
+            cv2.ellipse(frame, (cx, ymin + head // 2 + 2), axes, 0, 180, 360, colour, -1)
+        boxes.append((xmin, ymin, xmax, ymax))
+        hats.append(hat)
+    return frame, boxes, hats
+
+
+def bench_detector(args):
+    detector = LocalPPEDetector()
+    results = {}
+    print("{:<8} {:>10} {:>10} {:>10}".format("size", "ms/frame", "fps", "accuracy"))
+    for name, (width, height) in RESOLUTIONS.items():
+        rng = np.random.RandomState(1)
+        scenes = [scene(width, height, args.persons, rng) for _ in range(20)]
+        correct = total = 0
+        start = time.time()
+        for index in range(args.frames):
+            frame, boxes, hats = scenes[index % len(scenes)]
+            labels = detector.detect(frame, boxes)["CustomLabels"]
+            if index < len(scenes):
+                found = [False] * len(boxes)
+                for label in labels:
+                    if label["Name"] == "PPE":
+                        left = label["Geometry"]["BoundingBox"]["Left"] * width
+                        owner = min(range(len(boxes)), key=lambda i: abs(boxes[i][0] - left))
+                        found[owner] = True
+                correct += sum(1 for hat, seen in zip(hats, found) if hat == seen)
+                total += len(boxes)
+        elapsed = time.time() - start
+        results[name] = {
+            "ms_per_frame": round(elapsed * 1000.0 / args.frames, 2),
+            "fps": round(args.frames / elapsed, 1),
+            "accuracy": round(float(correct) / total, 3),
+        }
+        print(
+            "{:<8} {:>10} {:>10} {:>10}".format(
+                name, results[name]["ms_per_frame"], results[name]["fps"], results[name]["accuracy"]
+            )
+        )
+    return results
+
+
+class OutageRekognition(object):
+    """ Rekognition stand-in that fails or slows down between start and end
+        seconds after its creation.
+    """
+
+    def __init__(self, client, start, end, mode, slow_latency, timeout):
+        self.client = client
+        self.timeout = timeout
+        self.created = time.time()
+        self.start = start
+        self.end = end
+        self.mode = mode
+        self.slow_latency = slow_latency
+
+    def detect_custom_labels(self, **kwargs):
+        elapsed = time.time() - self.created
+        if self.start <= elapsed < self.end:
+            if self.mode == "down":
+                time.sleep(0.2)
+                raise fakes.FakeClientError("ServiceUnavailableException", "DetectCustomLabels")
+            if self.slow_latency > self.timeout:
+                # What the read timeout of the botocore client does
+                time.sleep(self.timeout)
+                raise socket.timeout("Read timed out")
+            time.sleep(self.slow_latency)
+        return self.client.detect_custom_labels(**kwargs)
+
+
+def run_outage(args, with_fallback):
+    camera = fakes.FakeCamera(frame_source(None, RESOLUTIONS["720p"]), fakes.Latency(1.0 / 30), seed=1)
+    rekognition = OutageRekognition(
+        fakes.FakeRekognition(latency=fakes.Latency(args.rekognition_latency), seed=2),
+        args.outage_start,
+        args.outage_start + args.outage,
+        args.mode,
+        args.slow_latency,
+        args.timeout,
+    )
+    uploader = S3Uploader(fakes.FakeS3(), "bench-bucket", spool_dir=tempfile.mkdtemp(prefix="bench_spool_"))
+    sources = Counter()
+
+    class CountingUploader(object):
+        def submit(self, item, callback=None):
+            sources[item["Metadata"]["Source"]] += 1
+            return uploader.submit(item, callback=callback)
+
+        def stats(self):
+            return uploader.stats()
+
+    stages = DetectionStages(
+        camera.getLastFrame,
+        fakes.FakeModel(seed=3),
+        rekognition,
+        CountingUploader(),
+        fakes.FakeIoTClient(),
+        "bench/infer",
+        fakes.FakeDisplay(),
+        "arn:bench",
+        fallback=LocalPPEDetector() if with_fallback else None,
+        breaker=CircuitBreaker(latency_threshold=1.0, reset_timeout=2.0) if with_fallback else None,
+        # Every frame is uploaded, the sources are counted from the uploads
+        frame_uploads=True,
+    )
+    errors = Counter()
+    pipeline = Pipeline(stages.stage_list(), on_error=lambda name, ex: errors.update([name]))
+    uploader.start()
+    pipeline.start()
+    time.sleep(args.duration)
+    pipeline.join()
+    uploader.join()
+    result = {
+        "frames": sum(sources.values()),
+        "fps": round(sum(sources.values()) / args.duration, 2),
+        "sources": dict(sources),
+        "errors": dict(errors),
+    }
+    if with_fallback:
+        result["breaker"] = stages.breaker.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, default=200, help="frames per resolution")
+    parser.add_argument("--persons", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=16.0, help="seconds of the outage run")
+    parser.add_argument("--outage-start", type=float, default=3.0)
+    parser.add_argument("--outage", type=float, default=10.0, help="seconds")
+    parser.add_argument("--mode", choices=("down", "slow"), default="down")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=3.0, help="read timeout of the client")
+    parser.add_argument("--rekognition-latency", type=float, default=0.15)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    random.seed(0)
+
+    results = {"config": vars(args), "detector": bench_detector(args)}
+    print()
+    print("{:<12} {:>8} {:>8}  {}".format("outage", "frames", "fps", "sources / errors"))
+    for name, with_fallback in (("no fallback", False), ("fallback", True)):
+        result = run_outage(args, with_fallback)
+        results[name] = result
+        print(
+            "{:<12} {:>8} {:>8}  {} {}".format(
+                name, result["frames"], result["fps"], result["sources"], result["errors"]
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
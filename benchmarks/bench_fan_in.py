@@ -0,0 +1,99 @@
+""" Several cameras served by one process, sharing a Rekognition pool with
+    fewer workers than cameras. One camera is busy (fast frames, always
+    people, no call scheduling) and the others are quiet; the per camera
+    frame rate, latency and Rekognition calls show whether the busy camera
+    starves the others.
+
+    Usage: python benchmarks/bench_fan_in.py [--cameras 4] [--workers 2]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from frames import synthetic_frames  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from frame_encoder import FrameEncoder  # noqa: E402
+from s3_uploader import S3Uploader  # noqa: E402
+from frame_sources import FrameSource  # noqa: E402
+from fan_in import RekognitionPool, SharedModel, Camera, CameraSet  # noqa: E402
+
+
+class FakeSource(FrameSource):
+    def __init__(self, name, fps):
+        super(FakeSource, self).__init__(name)
+        self.camera = fakes.FakeCamera(synthetic_frames(1280, 720, 4), fakes.Latency(1.0 / fps))
+
+    def read(self):
+        return self.camera.getLastFrame()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2, help="Rekognition calls in flight")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    rekognition = fakes.FakeRekognition(latency=fakes.Latency(0.2, 0.04, seed=1), seed=2)
+    pool = RekognitionPool(rekognition, workers=args.workers)
+    spool = tempfile.mkdtemp(prefix="bench_spool_")
+    uploader = S3Uploader(fakes.FakeS3(latency=fakes.Latency(0.05)), "bench", spool_dir=spool)
+    model = SharedModel(fakes.FakeModel(latency=fakes.Latency(0.02), seed=3))
+    cameras = []
+    for index in range(args.cameras):
+        name = "busy" if index == 0 else "quiet{}".format(index)
+        metrics = Metrics()
+        source = FakeSource(name, 30 if index == 0 else 5)
+        stages = DetectionStages(
+            source.read,
+            model,
+            pool.client_for(name),
+            uploader,
+            fakes.FakeIoTClient(),
+            "bench/infer",
+            None,
+            "arn:bench",
+            encoder=FrameEncoder(analysis_width=640),
+            metrics=metrics,
+            camera=name,
+        )
+        pipeline = Pipeline(stages.stage_list(), metrics=metrics)
+        cameras.append(Camera(source, stages, pipeline, metrics))
+    camera_set = CameraSet(cameras)
+    pool.start()
+    uploader.start()
+    camera_set.start()
+    time.sleep(args.duration)
+    stats = camera_set.stats()
+    pool_stats = pool.stats()
+    camera_set.join()
+    pool.join()
+    uploader.join()
+    shutil.rmtree(spool, ignore_errors=True)
+
+    print("{:<10}{:>8}{:>14}{:>8}{:>12}".format("camera", "fps", "p95 lat ms", "calls", "wait ms"))
+    for name, camera in stats.items():
+        calls = pool_stats["cameras"][name]
+        print(
+            "{:<10}{:>8.2f}{:>14}{:>8}{:>12.1f}".format(
+                name,
+                camera["fps"],
+                camera["latency_ms"].get("p95", "-"),
+                calls["calls"],
+                calls["avg_wait_ms"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+""" Moving 1080p frames from a capture process to analysis processes:
+    a multiprocessing.Queue (every frame pickled and copied) against the
+    shared memory FrameRing (zero copy views). Each consumer downscales and
+    JPEG encodes its frames, like the analysis path of the detection loop.
+
+    Usage: python benchmarks/bench_frame_ring.py [--consumers 1,2,4] [--frames 300]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from frames import synthetic_frame  # noqa: E402
+from frame_ring import FrameRing, RingReader  # noqa: E402
+
+
+def analyse(image):
+    small = cv2.resize(image, (640, 360))
+    return len(cv2.imencode(".jpg", small)[1])
+
+
+def queue_consumer(queue, results):
+    done = 0
+    while True:
+        image = queue.get()
+        if image is None:
+            break
+        analyse(image)
+        done += 1
+    results.put((done, 0))
+
+
+def ring_consumer(spec, index, count, frames, results):
+    ring = FrameRing.attach(*spec)
+    reader = RingReader(ring, index, count)
+    done = torn = 0
+    while True:
+        frame = reader.next(timeout=1.0)
+        if frame is None or frame.sequence > frames:
+            break
+        analyse(frame.image)
+        if not frame.valid():
+            torn += 1
+        done += 1
+    results.put((done, reader.overruns + torn))
+    ring.close()
+
+
+def run_queue(images, frames, consumers):
+    queue = multiprocessing.Queue(maxsize=8)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=queue_consumer, args=(queue, results))
+        for _ in range(consumers)
+    ]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    for index in range(frames):
+        queue.put(images[index % len(images)])
+    for _ in workers:
+        queue.put(None)
+    totals = [results.get() for _ in workers]
+    elapsed = time.time() - start
+    for worker in workers:
+        worker.join()
+    return sum(done for done, _ in totals) / elapsed, 0
+
+
+def run_ring(images, frames, consumers, fps):
+    ring = FrameRing.create(16, images[0].shape)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=ring_consumer, args=(ring.spec(), index, consumers, frames, results)
+        )
+        for index in range(consumers)
+    ]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    for index in range(frames):
+        ring.write(images[index % len(images)])
+        if fps:
+            time.sleep(max(0.0, start + (index + 1) / fps - time.time()))
+    # One frame past the end for every consumer tells them to stop
+    for index in range(consumers):
+        ring.write(images[0])
+    totals = [results.get() for _ in workers]
+    elapsed = time.time() - start
+    for worker in workers:
+        worker.join()
+    ring.close()
+    return sum(done for done, _ in totals) / elapsed, sum(lost for _, lost in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--consumers", default="1,2,4")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=60, help="Capture rate of the ring producer, 0 for as fast as possible")
+    args = parser.parse_args()
+    images = [synthetic_frame(seed=seed) for seed in range(4)]
+    print("{:>10}{:>14}{:>14}{:>12}".format("consumers", "queue fps", "ring fps", "overruns"))
+    for consumers in [int(value) for value in args.consumers.split(",")]:
+        queue_fps, _ = run_queue(images, args.frames, consumers)
+        ring_fps, overruns = run_ring(images, args.frames, consumers, args.fps)
+        print("{:>10}{:>14.1f}{:>14.1f}{:>12}".format(consumers, queue_fps, ring_fps, overruns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+""" Benchmark of the motion region proposals (motion.py) at 480p, 720p and
+    1080p, against the contour pipeline of "Python code examples/
+    boundingBox.py" run on the full resolution frame difference.
+
+    The scene is a synthetic background with fresh sensor noise on every
+    frame and a person sized block that walks across it during the first
+    half of the frames and stands still during the second half. A frame
+    with regions counts as analysed, the next frames are compared with it.
+    Reports the milliseconds per frame, the regions per frame, the share of
+    still frames without any region and the share of moving frames where a
+    region covers the block.
+
+    Usage:
+        python benchmarks/bench_motion.py --frames 48
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from frames import synthetic_frame  # noqa: E402
+from motion import MotionDetector, overlaps  # noqa: E402
+
+RESOLUTIONS = {"480p": (858, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+
+
+def scene(width, height, count, seed=0):
+    """ Returns the frames and the box of the walking block in each. """
+    rng = np.random.RandomState(seed)
+    background = synthetic_frame(width, height, seed).astype(np.int16)
+    noise = [rng.randint(-6, 7, background.shape).astype(np.int16) for _ in range(4)]
+    block_width, block_height = width // 12, height // 2
+    frames, boxes = [], []
+    for index in range(count):
+        step = min(index, count // 2)
+        x = int(width * 0.1 + step * width * 0.6 / (count // 2))
+        y = height // 3
+        frame = background + noise[index % len(noise)]
+        frame[y : y + block_height, x : x + block_width] = (40, 60, 160)
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+        boxes.append((x, y, x + block_width, y + block_height))
+    return frames, boxes
+
+
+class ContourRegions(object):
+    """ The boundingBox.py steps on the full frame: grayscale, threshold of
+        the difference with the last analysed frame, findContours and a
+        boundingRect per contour.
+    """
+
+    def __init__(self, threshold=25):
+        self.threshold = threshold
+        self.reference = None
+        self.candidate = None
+
+    def regions(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.candidate = gray
+        if self.reference is None:
+            return [(0, 0, frame.shape[1], frame.shape[0])]
+        _, threshed = cv2.threshold(
+            cv2.absdiff(gray, self.reference), self.threshold, 255, cv2.THRESH_BINARY
+        )
+        contours = cv2.findContours(threshed, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append((x, y, x + w, y + h))
+        return boxes
+
+    def analysed(self):
+        self.reference = self.candidate
+
+
+def measure(detector, frames, boxes):
+    moving = len(frames) // 2 + 1
+    regions_total = still_quiet = moving_hits = 0
+    start = time.time()
+    for index, frame in enumerate(frames):
+        regions = detector.regions(frame)
+        if regions:
+            detector.analysed()
+        if index == 0:
+            continue
+        regions_total += len(regions)
+        if index < moving:
+            moving_hits += bool(overlaps([boxes[index]], regions)[0]) if regions else 0
+        else:
+            still_quiet += not regions
+    elapsed = time.time() - start
+    return {
+        "ms_per_frame": round(elapsed * 1000.0 / len(frames), 2),
+        "regions_per_frame": round(float(regions_total) / (len(frames) - 1), 1),
+        "still_quiet": round(float(still_quiet) / (len(frames) - moving), 2),
+        "moving_found": round(float(moving_hits) / (moving - 1), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--width", type=int, default=320, help="width the detector compares at")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    results = {"config": vars(args)}
+    print(
+        "{:<7} {:<9} {:>10} {:>14} {:>12} {:>13}".format(
+            "size", "method", "ms/frame", "regions/frame", "still quiet", "moving found"
+        )
+    )
+    for name, (width, height) in RESOLUTIONS.items():
+        frames, boxes = scene(width, height, args.frames)
+        for method, detector in (
+            ("contours", ContourRegions()),
+            ("motion", MotionDetector(width=args.width)),
+        ):
+            result = measure(detector, frames, boxes)
+            results["{}/{}".format(name, method)] = result
+            print(
+                "{:<7} {:<9} {:>10} {:>14} {:>12} {:>13}".format(
+                    name,
+                    method,
+                    result["ms_per_frame"],
+                    result["regions_per_frame"],
+                    result["still_quiet"],
+                    result["moving_found"],
+                )
+            )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+""" Throughput of the offline replay (replay.py) against the Rekognition
+    stand-in, for an increasing number of worker processes.
+
+    Usage: python benchmarks/bench_replay.py [--source footage.mp4] [--frames 120]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from frames import synthetic_frame  # noqa: E402
+from replay import replay  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source", help="Video or image folder, synthetic 1080p images by default")
+    parser.add_argument("--frames", type=int, default=120, help="Synthetic images to replay")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--concurrency", type=int, help="Maximum concurrent backend calls")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_replay_")
+    try:
+        source = args.source
+        if source is None:
+            source = os.path.join(workdir, "frames")
+            os.makedirs(source)
+            for index in range(args.frames):
+                cv2.imwrite(
+                    os.path.join(source, "{:05d}.jpg".format(index)),
+                    synthetic_frame(seed=index % 8),
+                )
+        print("{:>8}{:>10}{:>10}".format("workers", "frames", "frames/s"))
+        for workers in [int(value) for value in args.workers.split(",")]:
+            summary = replay(
+                [source],
+                os.path.join(workdir, "results.jsonl"),
+                "arn:bench",
+                backend="fakes:replay_backend",
+                workers=workers,
+                concurrency=args.concurrency,
+            )
+            print("{:>8}{:>10}{:>10.1f}".format(workers, summary["frames"], summary["fps"]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
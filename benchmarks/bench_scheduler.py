@@ -0,0 +1,111 @@
+""" Simulation of the Rekognition call scheduler against a backend with a
+    limited capacity, on a simulated clock so ten minutes of footage run in
+    a fraction of a second. The scene alternates between busy and idle
+    periods; the backend throttles calls above its capacity.
+
+    Usage: python benchmarks/bench_scheduler.py [--budget 60] [--capacity 0.5]
+"""
+import argparse
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from fakes import FakeClientError  # noqa: E402
+from scheduler import CallScheduler  # noqa: E402
+
+
+class SimClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimBackend(object):
+    """ Takes latency seconds per call and throttles when called more than
+        capacity times per second, averaged over the last 10 seconds.
+    """
+
+    def __init__(self, clock, capacity, latency=0.3, seed=0):
+        self.clock = clock
+        self.capacity = capacity
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.calls = []
+        self.throttled = 0
+
+    def detect_custom_labels(self, **kwargs):
+        now = self.clock.time()
+        recent = [t for t in self.calls if now - t < 10.0]
+        self.calls.append(now)
+        if len(recent) >= self.capacity * 10.0:
+            self.throttled += 1
+            raise FakeClientError("ThrottlingException", "DetectCustomLabels")
+        self.clock.sleep(max(0.0, self.random.gauss(self.latency, self.latency / 5.0)))
+        return {"CustomLabels": []}
+
+
+def simulate(args, scheduled):
+    clock = SimClock()
+    backend = SimBackend(clock, args.capacity)
+    scheduler = CallScheduler(
+        budget_per_minute=args.budget,
+        active_interval=args.active_interval,
+        idle_interval=args.idle_interval,
+        clock=clock.time,
+        sleep=clock.sleep,
+        seed=1,
+    )
+    frames = failures = 0
+    while clock.now < args.minutes * 60.0:
+        frames += 1
+        # Two busy minutes, then one idle minute
+        active = int(clock.now // 60.0) % 3 != 2
+        try:
+            if not scheduled:
+                backend.detect_custom_labels()
+            elif scheduler.should_call(active):
+                scheduler.call(backend.detect_custom_labels)
+        except FakeClientError:
+            failures += 1
+        clock.sleep(1.0 / args.fps)
+    minutes = clock.now / 60.0
+    return {
+        "frames": frames,
+        "calls_per_minute": len(backend.calls) / minutes,
+        "throttled": backend.throttled,
+        "failed_frames": failures,
+        "scheduler": scheduler.stats() if scheduled else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--fps", type=float, default=15)
+    parser.add_argument("--budget", type=int, default=60, help="Calls per minute")
+    parser.add_argument("--capacity", type=float, default=0.5, help="Backend calls per second")
+    parser.add_argument("--active-interval", type=float, default=1.0)
+    parser.add_argument("--idle-interval", type=float, default=5.0)
+    args = parser.parse_args()
+    print("{:<12}{:>12}{:>12}{:>14}".format("mode", "calls/min", "throttled", "failed frames"))
+    for name, scheduled in (("unscheduled", False), ("scheduled", True)):
+        result = simulate(args, scheduled)
+        print(
+            "{:<12}{:>12.1f}{:>12}{:>14}".format(
+                name, result["calls_per_minute"], result["throttled"], result["failed_frames"]
+            )
+        )
+    print("scheduler decisions: {}".format(result["scheduler"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+""" How many viewers the stream server (stream_server.py) sustains. The
+    server runs on its own thread as on the device, fed with a JPEG frame
+    and a result payload at --fps by a producer thread. The viewers run in
+    a separate process, each with one MJPEG stream and one events
+    connection; --slow of them read the stream at only --slow-kbps. For every client count, reports the frame rate received by the
+    normal and the slow viewers, how late the producer got (it must never
+    wait for a viewer) and the frames the server skipped for busy viewers.
+
+    Usage:
+        python benchmarks/bench_stream.py --clients 1,10,50,100 --duration 5
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+from frames import synthetic_frame  # noqa: E402
+from frame_encoder import EncodedFrame  # noqa: E402
+from stream_server import StreamServer  # noqa: E402
+
+RESOLUTIONS = {"480p": (858, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+MARKER = b"--frame\r\n"
+
+
+async def stream_client(port, duration, rate, counts, index):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream.mjpeg HTTP/1.1\r\nHost: bench\r\n\r\n")
+    await writer.drain()
+    end = time.time() + duration
+    tail = b""
+    while time.time() < end:
+        try:
+            chunk = await asyncio.wait_for(
+                reader.read(8192 if rate else 256 * 1024), end - time.time()
+            )
+        except asyncio.TimeoutError:
+            break
+        if not chunk:
+            break
+        found = (tail + chunk).count(MARKER)
+        tail = chunk[-len(MARKER) + 1 :]
+        counts[index] += found
+        if rate:
+            await asyncio.sleep(len(chunk) / rate)
+    writer.close()
+
+
+async def events_client(port, duration, counts, index):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nHost: bench\r\n\r\n")
+    await writer.drain()
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            chunk = await asyncio.wait_for(reader.read(65536), end - time.time())
+        except asyncio.TimeoutError:
+            break
+        if not chunk:
+            break
+        counts[index] += chunk.count(b"event: result")
+    writer.close()
+
+
+def viewers(port, clients, slow, slow_rate, duration, results):
+    """ Body of the viewer process. """
+
+    async def main():
+        frames = [0] * clients
+        events = [0] * clients
+        tasks = []
+        for index in range(clients):
+            rate = slow_rate if index < slow else 0.0
+            tasks.append(stream_client(port, duration, rate, frames, index))
+            tasks.append(events_client(port, duration, events, index))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return frames, events
+
+    results.put(asyncio.run(main()))
+
+
+def run(args, clients, jpeg, payload):
+    server = StreamServer(host="127.0.0.1", port=0, max_fps=args.fps)
+    server.start()
+    server.ready.wait()
+    stop = threading.Event()
+    lateness = []
+    produced = [0]
+
+    def producer():
+        interval = 1.0 / args.fps
+        next_frame = time.time()
+        while not stop.is_set():
+            start = time.time()
+            lateness.append(max(0.0, start - next_frame))
+            server.set_encoded_frame(jpeg)
+            server.publish_state(payload)
+            produced[0] += 1
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.time()))
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    slow = int(round(clients * args.slow))
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=viewers, args=(server.port, clients, slow, args.slow_kbps * 1000.0, args.duration, results)
+    )
+    start = time.time()
+    process.start()
+    frames, events = results.get()
+    elapsed = time.time() - start
+    process.join()
+    stop.set()
+    thread.join()
+    stats = server.stats()
+    server.join(1.0)
+    normal = frames[slow:] or [0]
+    slow_frames = frames[:slow] or [0]
+    return {
+        "clients": clients,
+        "producer_fps": round(produced[0] / elapsed, 1),
+        "producer_late_ms": round(max(lateness) * 1000.0, 1),
+        "normal_fps": round(sum(normal) / float(len(normal)) / args.duration, 1),
+        "normal_min_fps": round(min(normal) / float(args.duration), 1),
+        "slow_fps": round(sum(slow_frames) / float(len(slow_frames)) / args.duration, 1),
+        "events_per_s": round(sum(events) / float(len(events)) / args.duration, 1),
+        "dropped": stats["frames_dropped"],
+        "mbytes_sent": stats["mbytes_sent"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--clients", default="1,10,50,100")
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="480p")
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--slow", type=float, default=0.1, help="fraction of slow viewers")
+    parser.add_argument("--slow-kbps", type=float, default=100.0, help="read rate of a slow viewer")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    frame = synthetic_frame(*RESOLUTIONS[args.resolution])
+    ret, buffer = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+    jpeg = EncodedFrame(buffer, 80, frame.shape)
+    payload = json.dumps({"type": "result", "persons": 2, "ppes": 1, "danger": 3, "alert": False})
+    print("frame of {} KB at {} fps".format(jpeg.nbytes // 1024, args.fps))
+    print(
+        "{:>8} {:>13} {:>11} {:>13} {:>9} {:>9} {:>9} {:>9}".format(
+            "clients", "producer fps", "late ms", "viewer fps", "min fps", "slow fps", "events/s", "dropped"
+        )
+    )
+    results = {"config": vars(args), "runs": []}
+    for clients in [int(value) for value in args.clients.split(",")]:
+        result = run(args, clients, jpeg, payload)
+        results["runs"].append(result)
+        print(
+            "{clients:>8} {producer_fps:>13} {producer_late_ms:>11} {normal_fps:>13} "
+            "{normal_min_fps:>9} {slow_fps:>9} {events_per_s:>9} {dropped:>9}".format(**result)
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
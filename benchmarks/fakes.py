@@ -0,0 +1,307 @@
+""" Stand-ins for the device and AWS services used by the detection loop,
+    so it can run on a plain Linux box without a DeepLens or a network.
+    Every fake has a configurable latency and error injection.
+"""
+import random
+import sys
+import threading
+import time
+import types
+
+
+class FakeClientError(Exception):
+    """ Mimics botocore.exceptions.ClientError: the error code is found in
+        ex.response["Error"]["Code"].
+    """
+
+    def __init__(self, code, operation):
+        super(FakeClientError, self).__init__(
+            "An error occurred ({}) when calling the {} operation".format(code, operation)
+        )
+        self.response = {"Error": {"Code": code, "Message": code}}
+
+
+class Latency(object):
+    """ Random latency, normally distributed around mean seconds. """
+
+    def __init__(self, mean=0.0, jitter=0.0, seed=None):
+        self.mean = mean
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def sleep(self):
+        if self.mean or self.jitter:
+            time.sleep(max(0.0, self.random.gauss(self.mean, self.jitter)))
+
+
+class FakeCamera(object):
+    """ Replaces awscam.getLastFrame with frames from a frame source. """
+
+    def __init__(self, frames, latency=None, fail_rate=0.0, seed=None):
+        """ frames - Iterator of BGR numpy arrays, see frames.py
+            latency - Latency of a frame grab
+            fail_rate - Fraction of grabs returning (False, None)
+        """
+        self.frames = frames
+        self.latency = latency or Latency()
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def getLastFrame(self):
+        self.latency.sleep()
+        if self.random.random() < self.fail_rate:
+            return False, None
+        with self._lock:
+            return True, next(self.frames)
+
+
+class FakeModel(object):
+    """ Replaces awscam.Model. parseResult returns persons boxes (label 15)
+        in the 300x300 input coordinates of the SSD model.
+    """
+
+    def __init__(self, persons=2, latency=None, person_rate=1.0, seed=None):
+        """ persons - Number of persons found in a frame with people
+            latency - Latency of doInference
+            person_rate - Fraction of frames that contain people
+        """
+        self.persons = persons
+        self.latency = latency or Latency()
+        self.person_rate = person_rate
+        self.random = random.Random(seed)
+
+    def doInference(self, frame):
+        self.latency.sleep()
+        return frame
+
+    def parseResult(self, model_type, result):
+        objects = []
+        if self.random.random() < self.person_rate:
+            for index in range(self.persons):
+                xmin = 20 + (index * 260.0 / max(1, self.persons)) % 240
+                objects.append(
+                    {
+                        "label": 15,
+                        "prob": 0.9,
+                        "xmin": xmin,
+                        "ymin": 40.0,
+                        "xmax": xmin + 50.0,
+                        "ymax": 280.0,
+                    }
+                )
+        return {model_type: objects}
+
+
+class FakeRekognition(object):
+    """ Replaces the boto3 Rekognition client. Every detected person comes
+        with a PPE label unless the frame is drawn as non compliant.
+    """
+
+    def __init__(
+        self,
+        persons=2,
+        latency=None,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        compliant_rate=1.0,
+        seed=None,
+    ):
+        """ persons - Number of persons in every response
+            latency - Latency of a call
+            error_rate - Fraction of calls failing with an InternalServerError
+            throttle_rate - Fraction of calls failing with a ThrottlingException
+            compliant_rate - Fraction of responses where everybody wears PPE
+        """
+        self.persons = persons
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.compliant_rate = compliant_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def detect_custom_labels(self, Image, ProjectVersionArn, **kwargs):
+        with self._lock:
+            self.calls += 1
+            draw = self.random.random()
+            compliant = self.random.random() < self.compliant_rate
+        self.latency.sleep()
+        if draw < self.throttle_rate:
+            raise FakeClientError("ThrottlingException", "DetectCustomLabels")
+        if draw < self.throttle_rate + self.error_rate:
+            raise FakeClientError("InternalServerError", "DetectCustomLabels")
+        labels = []
+        for index in range(self.persons):
+            left = 0.05 + index * 0.9 / max(1, self.persons)
+            labels.append(
+                {
+                    "Name": "person",
+                    "Confidence": 95.0,
+                    "Geometry": {
+                        "BoundingBox": {"Left": left, "Top": 0.1, "Width": 0.15, "Height": 0.8}
+                    },
+                }
+            )
+            if compliant:
+                labels.append(
+                    {
+                        "Name": "PPE",
+                        "Confidence": 88.0,
+                        "Geometry": {
+                            "BoundingBox": {
+                                "Left": left + 0.03,
+                                "Top": 0.1,
+                                "Width": 0.08,
+                                "Height": 0.1,
+                            }
+                        },
+                    }
+                )
+        return {"CustomLabels": labels}
+
+
+class FakeS3(object):
+    """ Replaces the boto3 S3 client with an in-memory store. """
+
+    def __init__(self, latency=None, error_rate=0.0, keep_bodies=False, seed=None):
+        """ latency - Latency of a request
+            error_rate - Fraction of requests failing
+            keep_bodies - Keep uploaded bodies, otherwise only their size
+        """
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.keep_bodies = keep_bodies
+        self.random = random.Random(seed)
+        self.objects = {}
+        self.puts = 0
+        self.bytes = 0
+        self.gets = 0
+        self.heads = 0
+        self.lists = 0
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def _fail(self, operation):
+        with self._lock:
+            failed = self.random.random() < self.error_rate
+        if failed:
+            raise FakeClientError("ServiceUnavailable", operation)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.latency.sleep()
+        self._fail("PutObject")
+        body = bytes(Body)
+        with self._lock:
+            self.puts += 1
+            self.bytes += len(body)
+            self.objects[(Bucket, Key)] = dict(
+                kwargs, Body=body if self.keep_bodies else None, ContentLength=len(body)
+            )
+        return {"ETag": '"{}"'.format(self.puts)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.latency.sleep()
+        self._fail("GetObject")
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise FakeClientError("NoSuchKey", "GetObject")
+            body = self.objects[(Bucket, Key)]["Body"] or b""
+        if Range:
+            # bytes=start-end, end inclusive
+            start, end = Range.split("=")[1].split("-")
+            body = body[int(start) : int(end) + 1]
+        with self._lock:
+            self.gets += 1
+            self.bytes_read += len(body)
+        return {"Body": _StreamingBody(body), "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.latency.sleep()
+        self._fail("HeadObject")
+        with self._lock:
+            self.heads += 1
+            if (Bucket, Key) not in self.objects:
+                raise FakeClientError("NoSuchKey", "HeadObject")
+            return dict((k, v) for k, v in self.objects[(Bucket, Key)].items() if k != "Body")
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        """ Lists the keys in order, MaxKeys per page like S3. """
+        self.latency.sleep()
+        self._fail("ListObjectsV2")
+        with self._lock:
+            self.lists += 1
+            keys = sorted(
+                key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix)
+            )
+            sizes = dict((key, self.objects[(Bucket, key)]["ContentLength"]) for key in keys)
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [{"Key": key, "Size": sizes[key]} for key in page],
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+
+class _StreamingBody(object):
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class FakeIoTClient(object):
+    """ Replaces the Greengrass iot-data client, keeping the messages. """
+
+    def __init__(self, latency=None, keep=1000):
+        self.latency = latency or Latency()
+        self.keep = keep
+        self.messages = []
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, **kwargs):
+        self.latency.sleep()
+        with self._lock:
+            self.published += 1
+            self.messages.append((topic, payload))
+            del self.messages[: -self.keep]
+
+
+class FakeDisplay(object):
+    """ LocalDisplay without a FIFO. """
+
+    def set_frame_data(self, frame):
+        pass
+
+    def set_encoded_frame(self, encoded, frame=None):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def install(camera=None, model=None, iot_client=None):
+    """ Registers fake awscam, mo and greengrasssdk modules in sys.modules,
+        for code that imports them at module level.
+    """
+    awscam = types.ModuleType("awscam")
+    awscam.getLastFrame = (camera or FakeCamera(iter(()))).getLastFrame
+    awscam.Model = lambda *args, **kwargs: model or FakeModel()
+    sys.modules["awscam"] = awscam
+    sys.modules["mo"] = types.ModuleType("mo")
+    greengrasssdk = types.ModuleType("greengrasssdk")
+    greengrasssdk.client = lambda *args, **kwargs: iot_client or FakeIoTClient()
+    sys.modules["greengrasssdk"] = greengrasssdk
+
+
+def replay_backend():
+    """ Backend factory for replay.py: a Rekognition stand-in with a
+        latency of about 100 ms per call.
+    """
+    return FakeRekognition(latency=Latency(0.1, 0.02))
@@ -0,0 +1,88 @@
+""" Frame sources for the benchmarks: replay of image folders and video
+    files, or synthetic frames when no fixture is given. Every source is an
+    endless iterator of BGR numpy arrays.
+"""
+import itertools
+import os
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def synthetic_frame(width=1920, height=1080, seed=0):
+    """ A frame with gradients, shapes and sensor-like noise, which
+        compresses roughly like a camera image.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.dstack([x + 0 * y, y + 0 * x, (x + y) / 2]).astype(np.uint8)
+    for _ in range(40):
+        x0, y0 = rng.randint(0, width), rng.randint(0, height)
+        color = tuple(int(c) for c in rng.randint(0, 255, 3))
+        cv2.rectangle(
+            frame, (x0, y0), (x0 + rng.randint(20, 300), y0 + rng.randint(20, 300)), color, -1
+        )
+    noise = rng.randint(-6, 7, frame.shape)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_frames(width=1920, height=1080, count=8):
+    """ Cycles through count different synthetic frames. """
+    return itertools.cycle([synthetic_frame(width, height, seed) for seed in range(count)])
+
+
+def image_frames(path, size=None):
+    """ Cycles through the images of a folder (or a single image), loaded
+        once and kept in memory so disk access does not skew the timings.
+    """
+    if os.path.isdir(path):
+        names = sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    else:
+        names = [path]
+    frames = []
+    for name in names:
+        frame = cv2.imread(name)
+        if frame is None:
+            continue
+        frames.append(cv2.resize(frame, size) if size else frame)
+    if not frames:
+        raise Exception("No images found in {}".format(path))
+    return itertools.cycle(frames)
+
+
+def video_frames(path, size=None, loop=True):
+    """ Streams the frames of a video file, starting again at the end. """
+    while True:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise Exception("Cannot open video {}".format(path))
+        produced = False
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            produced = True
+            yield cv2.resize(frame, size) if size else frame
+        capture.release()
+        if not loop or not produced:
+            return
+
+
+def frame_source(path=None, size=None):
+    """ Returns the frame iterator for a fixture path: a folder or image is
+        replayed as images, anything else is read as a video. Without a path
+        synthetic frames of the given size (default 1080p) are used.
+    """
+    if path is None:
+        width, height = size or (1920, 1080)
+        return synthetic_frames(width, height)
+    if os.path.isdir(path) or path.lower().endswith(IMAGE_EXTENSIONS):
+        return image_frames(path, size)
+    return video_frames(path, size)
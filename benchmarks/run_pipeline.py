@@ -0,0 +1,273 @@
+""" End to end benchmark of the detection pipeline against stand-in camera,
+    SSD model, Rekognition and S3 backends (see fakes.py). Reports frames
+    per second, p50/p95/p99 latency per stage, CPU and RSS, and saves the
+    results as json so two runs can be compared.
+
+    Usage:
+        python benchmarks/run_pipeline.py --duration 20 --output base.json
+        python benchmarks/run_pipeline.py --duration 20 --baseline base.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from frames import frame_source  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+from person_gate import PersonGate  # noqa: E402
+from label_cache import LabelCache  # noqa: E402
+from mosaic import MosaicBuilder  # noqa: E402
+from frame_encoder import FrameEncoder  # noqa: E402
+from s3_uploader import S3Uploader  # noqa: E402
+from iot_publisher import IoTPublisher  # noqa: E402
+from tracker import PersonTracker  # noqa: E402
+from scheduler import CallScheduler  # noqa: E402
+from motion import MotionDetector  # noqa: E402
+
+RESOLUTIONS = {"480p": (858, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+
+
+class StageTimer(object):
+    """ Wraps a stage function and records how long every call took. """
+
+    def __init__(self, func):
+        self.func = func
+        self.durations = []
+
+    def __call__(self, item):
+        start = time.time()
+        try:
+            return self.func(item)
+        finally:
+            self.durations.append(time.time() - start)
+
+    def summary(self):
+        if not self.durations:
+            return {"calls": 0}
+        ms = np.array(self.durations) * 1000.0
+        return {
+            "calls": len(ms),
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+        }
+
+
+def rss_mb():
+    """ Current resident set size in MB. """
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+
+
+def build(args):
+    """ Builds the stages and pipeline from the command line options. """
+    size = RESOLUTIONS[args.resolution]
+    camera = fakes.FakeCamera(
+        frame_source(args.source, size), fakes.Latency(args.camera_latency), seed=1
+    )
+    model = fakes.FakeModel(
+        persons=args.persons,
+        latency=fakes.Latency(args.ssd_latency),
+        person_rate=args.person_rate,
+        seed=2,
+    )
+    rekognition = fakes.FakeRekognition(
+        persons=args.persons,
+        latency=fakes.Latency(args.rekognition_latency, args.rekognition_latency / 5.0, seed=3),
+        error_rate=args.rekognition_errors,
+        throttle_rate=args.throttle_rate,
+        compliant_rate=args.compliant_rate,
+        seed=4,
+    )
+    s3 = fakes.FakeS3(
+        latency=fakes.Latency(args.s3_latency, args.s3_latency / 5.0, seed=5),
+        error_rate=args.s3_errors,
+        seed=6,
+    )
+    uploader = S3Uploader(
+        s3,
+        "bench-bucket",
+        workers=args.upload_workers,
+        backoff=0.05,
+        spool_dir=tempfile.mkdtemp(prefix="bench_spool_"),
+        drain_interval=0.5,
+    )
+    iot_client = fakes.FakeIoTClient(latency=fakes.Latency(args.iot_latency))
+    publisher = IoTPublisher(iot_client, "bench/infer", max_rate=args.iot_rate)
+    stages = DetectionStages(
+        camera.getLastFrame,
+        model,
+        rekognition,
+        uploader,
+        iot_client,
+        "bench/infer",
+        fakes.FakeDisplay(),
+        "arn:bench",
+        person_gate=PersonGate(0.25) if args.gate else None,
+        label_cache=LabelCache() if args.cache else None,
+        mosaic=MosaicBuilder() if args.mosaic else None,
+        encoder=FrameEncoder(analysis_width=args.analysis_width or None),
+        publisher=publisher,
+        tracker=PersonTracker() if args.track else None,
+        scheduler=CallScheduler(budget_per_minute=args.budget, active_interval=0, idle_interval=0)
+        if args.budget
+        else None,
+        motion=MotionDetector() if args.motion else None,
+        # Every frame is uploaded, like the runs recorded as baselines
+        frame_uploads=True,
+    )
+    timers = []
+    stage_list = []
+    for name, func in stages.stage_list():
+        timer = StageTimer(func)
+        timers.append((name, timer))
+        stage_list.append((name, timer))
+    errors = []
+    pipeline = Pipeline(
+        stage_list,
+        queue_size=args.queue_size,
+        drop_oldest=not args.drop_newest,
+        on_error=lambda name, ex: errors.append((name, str(ex))),
+    )
+    return pipeline, stages, uploader, publisher, rekognition, s3, timers, errors
+
+
+def run(args):
+    pipeline, stages, uploader, publisher, rekognition, s3, timers, errors = build(args)
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    rss_start = rss_mb()
+    uploader.start()
+    publisher.start()
+    start = time.time()
+    pipeline.start()
+    time.sleep(args.duration)
+    pipeline.join()
+    uploader.join()
+    publisher.join()
+    elapsed = time.time() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+
+    completed = pipeline.stats()[pipeline.stages[-1].stage_name]["processed"]
+    results = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "duration_s": elapsed,
+        "frames": completed,
+        "fps": completed / elapsed,
+        "rekognition_calls": rekognition.calls,
+        "s3_puts": s3.puts,
+        "cpu_percent": 100.0 * cpu / elapsed,
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_start,
+        "max_rss_mb": usage_end.ru_maxrss / 1024.0,
+        "stages": dict((name, timer.summary()) for name, timer in timers),
+        "pipeline": pipeline.stats(),
+        "components": stages.stats(),
+        "metrics": stages.metrics.snapshot(),
+        "errors": len(errors),
+    }
+    shutil.rmtree(uploader.spool.path, ignore_errors=True)
+    return results
+
+
+def report(results, baseline=None):
+    def delta(key, value, base):
+        if base is None or key not in base or not base[key]:
+            return ""
+        return " ({:+.1f}%)".format(100.0 * (value - base[key]) / base[key])
+
+    print(
+        "{:.1f} frames/s over {:.1f}s, {} rekognition calls, cpu {:.0f}%, rss {:.0f} MB".format(
+            results["fps"],
+            results["duration_s"],
+            results["rekognition_calls"],
+            results["cpu_percent"],
+            results["rss_mb"],
+        )
+        + delta("fps", results["fps"], baseline)
+    )
+    print("{:<12}{:>8}{:>10}{:>10}{:>10}".format("stage", "calls", "p50 ms", "p95 ms", "p99 ms"))
+    for name, summary in results["stages"].items():
+        if not summary["calls"]:
+            print("{:<12}{:>8}".format(name, 0))
+            continue
+        base = baseline["stages"].get(name) if baseline else None
+        print(
+            "{:<12}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{}".format(
+                name,
+                summary["calls"],
+                summary["p50_ms"],
+                summary["p95_ms"],
+                summary["p99_ms"],
+                delta("p95_ms", summary["p95_ms"], base),
+            )
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source", help="Image, image folder or video to replay")
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="1080p")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--queue-size", type=int, default=1)
+    parser.add_argument("--drop-newest", action="store_true", help="Drop incoming frames instead of the oldest")
+    parser.add_argument("--persons", type=int, default=2)
+    parser.add_argument("--person-rate", type=float, default=1.0)
+    parser.add_argument("--compliant-rate", type=float, default=0.8)
+    parser.add_argument("--camera-latency", type=float, default=1.0 / 30)
+    parser.add_argument("--ssd-latency", type=float, default=0.05)
+    parser.add_argument("--rekognition-latency", type=float, default=0.3)
+    parser.add_argument("--rekognition-errors", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--s3-latency", type=float, default=0.1)
+    parser.add_argument("--s3-errors", type=float, default=0.0)
+    parser.add_argument("--iot-latency", type=float, default=0.02)
+    parser.add_argument("--iot-rate", type=float, default=2.0, help="Max IoT messages per second")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--analysis-width", type=int, default=1280, help="0 disables downscaling")
+    parser.add_argument("--gate", action="store_true", help="Enable the SSD person gate")
+    parser.add_argument("--cache", action="store_true", help="Enable the label cache")
+    parser.add_argument("--budget", type=int, default=0, help="Rekognition calls per minute, 0 disables the scheduler")
+    parser.add_argument("--track", action="store_true", help="Enable the person tracker")
+    parser.add_argument("--mosaic", action="store_true", help="Enable person mosaics")
+    parser.add_argument("--motion", action="store_true", help="Enable the motion regions")
+    parser.add_argument("--output", default="bench_results.json", help="Where to save the results")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    results = run(args)
+    report(results, baseline)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    print("results saved to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,66 +13,84 @@ var s3 = new AWS.S3({
   region: "your-region",
 });
 
-var iterator = 1;
-let data;
-let imageArray;
-let metaData;
-let s3Data;
-let urlObject;
-let url;
+let manifest;
+//ETag of the last manifest, sent as If-None-Match so an unchanged manifest costs a 304
+let etag;
+//sequence number of the frame currently displayed
+let sequence;
 
 //audio for sound alert
 var snd = new Audio("Alarm1.mp3");
-//to mark the number of frames in which there are people without ppe
-let Index = 0;
 
 let slideshow = document.getElementById("slideshow");
 let output = document.getElementById("output");
 let dangerIndex = document.getElementById("dangerIndex");
 
+var bucket = "your-bucket-name";
+//small json file written by the deeplens, pointing to latest.jpg, the last
+//annotated frame; the full footage is in the archive/ segments
+var manifestKey = "latest.json";
+//address of the stream server of the deeplens, e.g. "http://192.168.1.20:8080";
+//when set, the live stream and results come from the device instead of S3.
+//The lambda needs STREAM_HOST=0.0.0.0 and STREAM_ALLOW_ORIGIN set to the
+//origin this page is served from
+var deviceUrl = "";
+//whether the device reported the danger alert in its last result
+let alerting = false;
+
+function show_manifest(manifest) {
+  let PPE = manifest.ppes;
+  let Person = manifest.persons;
+  //number of consecutive frames in which there are people without ppe
+  let Index = manifest.danger_index;
+  output.innerHTML =
+    "Number of Persons: " + Person + " and Number of PPEs: " + PPE;
+  if (manifest.violations !== undefined) {
+    output.innerHTML += ", " + manifest.violations + " without PPE";
+  }
+  //detected on the deeplens alone while rekognition is unreachable
+  if (manifest.source === "local") {
+    output.innerHTML += " (local detection)";
+  }
+  dangerIndex.innerHTML = "Danger Index is now " + Index;
+  //the alert is debounced on the deeplens
+  if (manifest.alert) {
+    console.log("send sound alert!");
+    // document.getElementById("alarm").play();
+    snd.play();
+    alert("Dangerous!");
+    //send alert using other aws service
+  }
+}
+
 function infinite_run() {
   var params = {
-    Bucket: "your-bucket-name",
-    Key: "your-key",
+    Bucket: bucket,
+    Key: manifestKey,
   };
+  if (etag) {
+    params.IfNoneMatch = etag;
+  }
 
   let myPromise1 = s3.getObject(params).promise();
 
   myPromise1
     .then(
       function (fromResolve) {
-        iterator = iterator + 1;
-        data = fromResolve;
-        metaData = data.Metadata;
-        imageArray = data.Body;
-        console.log(data);
-        console.log(metaData);
-        console.log(imageArray);
-        //   document.write(metaData);
-        //   output.innerHTML = metaData.toString();
-        // output.innerHTML = JSON.stringify(metaData);
-        // metaData = fromResolve.Metadata;
-        // imageArray = fromResolve.Body;
-        let PPE = metaData.numberofppes;
-        let Person = metaData.numberofpersons;
-        output.innerHTML =
-          "Number of Persons: " + Person + " and Number of PPEs: " + PPE;
-        if (Person > PPE) {
-          Index = Index + 1;
-          if (Index >= 3) {
-            dangerIndex.innerHTML = "Danger Index is now " + Index;
-            console.log("send sound alert!");
-            // document.getElementById("alarm").play();
-            snd.play();
-            alert("Dangerous!");
-            //send alert using other aws service
-          }
-        } else {
-          Index = 0;
-          dangerIndex.innerHTML = "Danger Index is now " + Index;
+        etag = fromResolve.ETag;
+        manifest = JSON.parse(fromResolve.Body.toString());
+        console.log(manifest);
+        //only a new frame needs a new image, the same frame is not downloaded twice
+        if (manifest.sequence === sequence) {
+          return;
         }
+        sequence = manifest.sequence;
+        show_manifest(manifest);
         //this method returns a url as a promise object, from the 'getObject' method
-        let getUrl = s3.getSignedUrlPromise("getObject", params);
+        let getUrl = s3.getSignedUrlPromise("getObject", {
+          Bucket: bucket,
+          Key: manifest.key,
+        });
         getUrl.then(
           function (url) {
             console.log("The url is ", url);
@@ -83,31 +101,10 @@ function infinite_run() {
           }
         );
       },
-      // when a new object in not present in s3, display the previous one
-      function () {
-        metaData = data.Metadata;
-        imageArray = data.Body;
-        console.log(data);
-        console.log(metaData);
-        console.log(imageArray);
-
-        let PPE = metaData.numberofppes;
-        let Person = metaData.numberofpersons;
-        output.innerHTML =
-          "Number of Persons: " + Person + " and Number of PPEs: " + PPE;
-        if (Person > PPE) {
-          Index = Index + 1;
-          if (Index >= 5) {
-            dangerIndex.innerHTML = "Danger Index is now " + Index;
-            console.log("send sound alert!");
-            // document.getElementById("alarm").play();
-            snd.play();
-            alert("Dangerous!");
-            //send real alert
-          }
-        } else {
-          Index = 0;
-          dangerIndex.innerHTML = "Danger Index is now " + Index;
+      // the manifest has not changed since the last poll, keep the current frame
+      function (err) {
+        if (err.statusCode !== 304) {
+          console.log(err);
         }
       }
     )
@@ -116,6 +113,28 @@ function infinite_run() {
     });
 }
 
-//run it every 5s
-infinite_run();
-setInterval(infinite_run, 5000);
+//results sent by the device as server-sent events, see stream_server.py
+function show_result(result) {
+  show_manifest({
+    ppes: result.ppes,
+    persons: result.persons,
+    danger_index: result.danger,
+    violations: result.violations,
+    source: result.source,
+    //a result comes with every frame, only sound the alert when it is raised
+    alert: result.alert && !alerting,
+  });
+  alerting = result.alert;
+}
+
+if (deviceUrl) {
+  slideshow.src = deviceUrl + "/stream.mjpeg";
+  let events = new EventSource(deviceUrl + "/events");
+  events.addEventListener("result", function (event) {
+    show_result(JSON.parse(event.data));
+  });
+} else {
+  //run it every 5s
+  infinite_run();
+  setInterval(infinite_run, 5000);
+}
@@ -0,0 +1,142 @@
+""" Draws the Rekognition custom labels on a frame. All boxes are converted
+    to pixels in one NumPy operation, colours come from a label table and
+    everything is drawn into a reusable overlay that is composited onto the
+    frame once.
+"""
+import cv2
+import numpy as np
+from detections import as_detections
+
+
+class Annotator(object):
+    """ Draws labelled boxes. The overlay and its mask are kept between
+        frames: they are reused as they are when the boxes did not change,
+        otherwise only the area touched by the previous frame is cleared.
+    """
+
+    # Label name to BGR colour, any other label uses default_colour
+    STYLES = {"person": (0, 255, 0), "PPE": (255, 0, 0)}
+
+    def __init__(
+        self,
+        styles=None,
+        default_colour=(255, 0, 0),
+        thickness=2,
+        font_scale=1,
+        quiet=True,
+    ):
+        """ styles - Dict of label name to BGR colour, defaults to STYLES
+            default_colour - Colour of labels missing from styles
+            thickness - Line thickness of the boxes
+            font_scale - Scale of the label text
+            quiet - When False every label is also printed to stdout
+        """
+        self.styles = dict(self.STYLES if styles is None else styles)
+        self.default_colour = default_colour
+        self.thickness = thickness
+        self.font_scale = font_scale
+        self.quiet = quiet
+        self._overlay = None
+        self._mask = None
+        self._dirty = None
+        self._key = None
+
+    def pixel_boxes(self, labels, shape):
+        """ Returns the names and the (N, 4) int array of left, top, right,
+            bottom pixel coordinates of the labels that have a geometry.
+            labels - Detections or CustomLabels list
+        """
+        detections = as_detections(labels)
+        has_box = detections.has_box()
+        names = [name for name, boxed in zip(detections.names(), has_box) if boxed]
+        return names, detections.pixel_corners(shape).astype(np.int32)
+
+    def annotate(self, image, labels):
+        """ Draws the labels on the image in place and returns the number of
+            labels found per label name.
+            image - BGR numpy array
+            labels - Detections or CustomLabels list of a Rekognition
+                     response
+        """
+        detections = as_detections(labels)
+        counts = detections.counts()
+        names, boxes = self.pixel_boxes(detections, image.shape)
+        if not self.quiet:
+            for detection in detections:
+                print("Label " + detection.name)
+                print("Confidence " + str(detection.confidence))
+            for name, (left, top, right, bottom) in zip(names, boxes):
+                print(
+                    "{}: left {} top {} width {} height {}".format(
+                        name, left, top, right - left, bottom - top
+                    )
+                )
+        if not names:
+            return counts
+        key = (image.shape, tuple(names), boxes.tobytes())
+        if key != self._key:
+            # Same boxes as the previous frame (e.g. a cached or skipped
+            # Rekognition call) reuse the overlay as it is.
+            self._draw(image.shape, names, boxes)
+            self._key = key
+        x0, y0, x1, y1 = self._dirty
+        if x1 > x0 and y1 > y0:
+            # Clear the drawn pixels of the frame, then add the overlay
+            # (black everywhere else), both in place on the region.
+            target = image[y0:y1, x0:x1]
+            cv2.subtract(target, target, dst=target, mask=self._mask[y0:y1, x0:x1])
+            cv2.add(target, self._overlay[y0:y1, x0:x1], dst=target)
+        return counts
+
+    def _draw(self, shape, names, boxes):
+        """ Draws the boxes into the overlay and updates its mask and the
+            region it covers.
+        """
+        if self._overlay is None or self._overlay.shape != shape:
+            self._overlay = np.zeros(shape, dtype=np.uint8)
+            self._mask = np.zeros(shape[:2], dtype=np.uint8)
+        elif self._dirty is not None:
+            # Only clear what the previous frame drew
+            x0, y0, x1, y1 = self._dirty
+            self._overlay[y0:y1, x0:x1] = 0
+        for name, (left, top, right, bottom) in zip(names, boxes):
+            colour = self.styles.get(str(name), self.default_colour)
+            cv2.putText(
+                self._overlay,
+                name,
+                (int(left), int(top)),
+                cv2.FONT_HERSHEY_COMPLEX,
+                self.font_scale,
+                colour,
+                1,
+            )
+            cv2.rectangle(
+                self._overlay,
+                (int(left), int(top)),
+                (int(right), int(bottom)),
+                colour,
+                self.thickness,
+            )
+        # Area touched: the boxes grown by the line width, the text drawn
+        # above them and text running past their right edge.
+        text_width, text_height = 0, 0
+        for name in set(names):
+            (w, h), baseline = cv2.getTextSize(
+                str(name), cv2.FONT_HERSHEY_COMPLEX, self.font_scale, 1
+            )
+            text_width, text_height = max(text_width, w), max(text_height, h + baseline)
+        height, width = shape[:2]
+        margin = self.thickness + 1
+        x0 = max(0, int(boxes[:, 0].min()) - margin)
+        y0 = max(0, int(boxes[:, 1].min()) - text_height - margin)
+        x1 = min(width, max(int(boxes[:, 2].max()), int(boxes[:, 0].max()) + text_width) + margin)
+        y1 = min(height, int(boxes[:, 3].max()) + margin)
+        self._dirty = (x0, y0, x1, y1)
+        if x1 > x0 and y1 > y0:
+            # Everything drawn is non-black, so the drawn pixels are the
+            # non-zero pixels of the overlay.
+            cv2.cvtColor(
+                self._overlay[y0:y1, x0:x1],
+                cv2.COLOR_BGR2GRAY,
+                dst=self._mask[y0:y1, x0:x1],
+            )
@@ -0,0 +1,302 @@
+""" Time-segmented archive of the annotated frames. Instead of one S3 object
+    per frame, the JPEGs of every segment_seconds are concatenated into one
+    MJPEG segment (playable with e.g. ffplay -f mjpeg) and uploaded in one
+    request, next to a small json index holding the offset, size, timestamp
+    and detection counts of every frame.
+
+    Keys are partitioned by UTC hour and carry the start of the segment and
+    a random id drawn at every start of the lambda, so a restart never
+    overwrites earlier segments:
+        <prefix>archive/2026/10/18/13/1792335600000-3fa85f64.mjpeg
+        <prefix>archive/2026/10/18/13/1792335600000-3fa85f64.json
+    ArchiveReader finds the segment of a timestamp by listing the hour
+    partitions around it, reads its index and fetches the frame with a
+    ranged GET, without downloading the segment.
+"""
+from threading import Lock
+import bisect
+import binascii
+import json
+import os
+import time
+
+SEGMENT_EXTENSION = ".mjpeg"
+INDEX_EXTENSION = ".json"
+# Columns of the index and the field of a frame record each one holds
+INDEX_COLUMNS = (
+    ("offsets", "offset"),
+    ("lengths", "length"),
+    ("timestamps", "timestamp"),
+    ("sequences", "sequence"),
+    ("persons", "persons"),
+    ("ppes", "ppes"),
+    ("violations", "violations"),
+    ("danger_index", "danger_index"),
+    ("alert", "alert"),
+    ("sources", "source"),
+)
+
+
+def run_id():
+    """ Random id telling apart the segments of two runs of the lambda. """
+    return binascii.hexlify(os.urandom(4)).decode("ascii")
+
+
+def partition(prefix, timestamp):
+    """ Key prefix of the hour partition holding timestamp. """
+    return prefix + time.strftime("%Y/%m/%d/%H/", time.gmtime(timestamp))
+
+
+def segment_start(key):
+    """ Start timestamp of a segment or index key. """
+    name = key.rsplit("/", 1)[-1]
+    return int(name.split("-", 1)[0]) / 1000.0
+
+
+class SegmentArchiver(object):
+    """ Buffers the annotated frames of one camera into segments. A segment
+        is closed when a frame falls in the next segment_seconds window of
+        the clock, or when it reaches max_bytes, and is handed with its
+        index to the S3Uploader, so it is retried and spooled like the
+        frames were.
+    """
+
+    def __init__(
+        self,
+        uploader,
+        prefix="archive/",
+        segment_seconds=60.0,
+        max_bytes=16 * 1024 * 1024,
+        run=None,
+    ):
+        """ uploader - S3Uploader sending the segments and indexes
+            prefix - Key prefix of the archive, with the camera prefix when
+                     one process serves several cameras
+            segment_seconds - Duration of a segment; segments are aligned on
+                              multiples of it, at most an hour
+            max_bytes - Size at which a segment is closed early
+            run - Id of this run of the lambda, a random one by default
+        """
+        if not 0 < segment_seconds <= 3600:
+            raise Exception("segment_seconds must be between 0 and 3600")
+        self.uploader = uploader
+        self.prefix = prefix
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.run = run if run is not None else run_id()
+        self.segments = 0
+        self.frames = 0
+        self.bytes = 0
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._parts = []
+        self._size = 0
+        self._window_end = None
+        self._index = dict((column, []) for column, _ in INDEX_COLUMNS)
+
+    def add(
+        self,
+        jpeg,
+        timestamp,
+        sequence,
+        persons,
+        ppes,
+        violations=0,
+        danger_index=0,
+        alert=False,
+        source=None,
+    ):
+        """ Appends an annotated frame to the current segment.
+            jpeg - Bytes of the encoded frame
+            timestamp - Capture time of the frame
+            sequence - Sequence number of the frame in this run
+            persons, ppes, violations - Detection counts of the frame
+            danger_index, alert - Danger index and alert after the frame
+            source - Source of the detections, rekognition or local
+        """
+        with self._lock:
+            if self._parts and (
+                timestamp >= self._window_end or self._size + len(jpeg) > self.max_bytes
+            ):
+                self._flush()
+            if not self._parts:
+                window = int(timestamp // self.segment_seconds)
+                self._window_end = (window + 1) * self.segment_seconds
+            index = self._index
+            index["offsets"].append(self._size)
+            index["lengths"].append(len(jpeg))
+            index["timestamps"].append(round(timestamp, 3))
+            index["sequences"].append(sequence)
+            index["persons"].append(persons)
+            index["ppes"].append(ppes)
+            index["violations"].append(violations)
+            index["danger_index"].append(danger_index)
+            index["alert"].append(bool(alert))
+            index["sources"].append(source)
+            self._parts.append(jpeg)
+            self._size += len(jpeg)
+
+    def _flush(self):
+        timestamps = self._index["timestamps"]
+        key = "{}{:013d}-{}".format(
+            partition(self.prefix, timestamps[0]), int(timestamps[0] * 1000), self.run
+        )
+        index = {
+            "segment": key + SEGMENT_EXTENSION,
+            "run": self.run,
+            "start": timestamps[0],
+            "end": timestamps[-1],
+            "frames": len(timestamps),
+        }
+        index.update(self._index)
+        body = b"".join(self._parts)
+        # The segment goes first: the spool drains oldest first, so an index
+        # is never readable long before its segment
+        self.uploader.submit(
+            {
+                "Key": key + SEGMENT_EXTENSION,
+                "Body": body,
+                "ContentType": "video/x-motion-jpeg",
+                "Metadata": {
+                    "Frames": str(len(timestamps)),
+                    "Start": str(timestamps[0]),
+                    "End": str(timestamps[-1]),
+                },
+            }
+        )
+        self.uploader.submit(
+            {
+                "Key": key + INDEX_EXTENSION,
+                "Body": json.dumps(index, separators=(",", ":")).encode("utf-8"),
+                "ContentType": "application/json",
+            }
+        )
+        self.segments += 1
+        self.frames += len(timestamps)
+        self.bytes += len(body)
+        self._reset()
+
+    def flush(self):
+        """ Closes and uploads the current segment, if it has frames. """
+        with self._lock:
+            if self._parts:
+                self._flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "run": self.run,
+                "segments": self.segments,
+                "frames": self.frames,
+                "mbytes": round(self.bytes / 1e6, 1),
+                "buffered_frames": len(self._parts),
+            }
+
+
+class ArchiveReader(object):
+    """ Reads the archive of one camera from S3. Indexes are small and
+        cached; frames are read with ranged GETs.
+    """
+
+    def __init__(self, s3, bucket, prefix="archive/", cache_size=32):
+        """ s3 - boto3 S3 client
+            bucket - Bucket holding the archive
+            prefix - Key prefix of the archive, as given to SegmentArchiver
+            cache_size - Number of indexes kept in memory
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_size = cache_size
+        self._indexes = {}
+
+    def segments(self, start, end):
+        """ Returns the sorted index keys of the segments that may hold
+            frames between the start and end timestamps.
+        """
+        keys = []
+        # A segment starts at most an hour before its first frame's window
+        hour = int(start // 3600) * 3600 - 3600
+        while hour <= end:
+            keys.extend(self._list(partition(self.prefix, hour)))
+            hour += 3600
+        keys.sort(key=segment_start)
+        # The last segment starting before start may still cover it
+        first = 0
+        for position, key in enumerate(keys):
+            if segment_start(key) <= start:
+                first = position
+        return [key for key in keys[first:] if segment_start(key) <= end]
+
+    def _list(self, prefix):
+        keys = []
+        params = {"Bucket": self.bucket, "Prefix": prefix}
+        while True:
+            page = self.s3.list_objects_v2(**params)
+            keys.extend(
+                entry["Key"]
+                for entry in page.get("Contents", [])
+                if entry["Key"].endswith(INDEX_EXTENSION)
+            )
+            if not page.get("IsTruncated"):
+                return keys
+            params["ContinuationToken"] = page["NextContinuationToken"]
+
+    def index(self, key):
+        """ Returns the index stored under key. """
+        if key not in self._indexes:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+            if len(self._indexes) >= self.cache_size:
+                self._indexes.pop(next(iter(self._indexes)))
+            self._indexes[key] = json.loads(response["Body"].read().decode("utf-8"))
+        return self._indexes[key]
+
+    @staticmethod
+    def _record(index, position):
+        record = dict((field, index[column][position]) for column, field in INDEX_COLUMNS)
+        record["segment"] = index["segment"]
+        return record
+
+    def records(self, start, end):
+        """ Yields the index record of every frame between the start and end
+            timestamps, oldest first, without reading any frame.
+        """
+        for key in self.segments(start, end):
+            index = self.index(key)
+            timestamps = index["timestamps"]
+            first = bisect.bisect_left(timestamps, start)
+            last = bisect.bisect_right(timestamps, end)
+            for position in range(first, last):
+                yield self._record(index, position)
+
+    def seek(self, timestamp):
+        """ Returns the record of the last frame captured at or before
+            timestamp, or None when the archive holds no such frame.
+        """
+        # The frame may be the last one of an earlier segment when nothing
+        # was recorded between the start of this one and timestamp
+        for key in reversed(self.segments(timestamp - 3600, timestamp)):
+            index = self.index(key)
+            position = bisect.bisect_right(index["timestamps"], timestamp)
+            if position:
+                return self._record(index, position - 1)
+        return None
+
+    def frame(self, record):
+        """ Returns the JPEG bytes of a record, read with a ranged GET. """
+        first = record["offset"]
+        response = self.s3.get_object(
+            Bucket=self.bucket,
+            Key=record["segment"],
+            Range="bytes={}-{}".format(first, first + record["length"] - 1),
+        )
+        return response["Body"].read()
+
+    def read(self, timestamp):
+        """ Returns (record, jpeg) of the frame shown at timestamp, or None. """
+        record = self.seek(timestamp)
+        if record is None:
+            return None
+        return record, self.frame(record)
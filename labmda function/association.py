@@ -0,0 +1,75 @@
+""" Spatial association of the PPE labels with the person labels of a
+    frame. A person is compliant when enough PPE boxes lie inside their box;
+    a helmet on a shelf next to somebody no longer counts for them.
+"""
+import numpy as np
+from detections import PERSON, PPE, as_detections
+
+
+def label_boxes(labels, name):
+    """ Returns the (n, 4) array of the (left, top, right, bottom) boxes of
+        the labels with the given name, relative to the frame size.
+        labels - Detections or CustomLabels list
+    """
+    return as_detections(labels).corners(name)
+
+
+def overlap_matrices(ppe, persons):
+    """ Containment and IoU of every PPE box with every person box, in one
+        pass.
+        ppe - (n, 4) array of (left, top, right, bottom) boxes
+        persons - (m, 4) array of (left, top, right, bottom) boxes
+        Returns two (n, m) arrays: the fraction of each PPE box inside each
+        person box, and their intersection over union.
+    """
+    left = np.maximum(ppe[:, None, 0], persons[None, :, 0])
+    top = np.maximum(ppe[:, None, 1], persons[None, :, 1])
+    right = np.minimum(ppe[:, None, 2], persons[None, :, 2])
+    bottom = np.minimum(ppe[:, None, 3], persons[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    ppe_area = (ppe[:, 2] - ppe[:, 0]) * (ppe[:, 3] - ppe[:, 1])
+    person_area = (persons[:, 2] - persons[:, 0]) * (persons[:, 3] - persons[:, 1])
+    containment = inter / np.maximum(ppe_area, 1e-12)[:, None]
+    union = ppe_area[:, None] + person_area[None, :] - inter
+    iou = inter / np.maximum(union, 1e-12)
+    return containment, iou
+
+
+def associate(labels, min_containment=0.5, required=1):
+    """ Assigns every PPE label to the person whose box contains most of
+        it, ties going to the person with the highest IoU, which is the
+        closest fit when people overlap.
+        labels - Detections or Rekognition custom labels of the frame
+        min_containment - Minimum fraction of a PPE box inside a person box
+                          for the PPE to belong to that person
+        required - Number of PPE a person needs to be compliant
+        Returns a dict with the per person PPE counts and compliance, the
+        number of compliant persons, of violations and of unassigned PPE.
+    """
+    detections = as_detections(labels)
+    persons = detections.corners(PERSON)
+    ppe = detections.corners(PPE)
+    ppe_per_person = np.zeros(len(persons), dtype=np.int64)
+    unassigned = len(ppe)
+    if len(persons) and len(ppe):
+        containment, iou = overlap_matrices(ppe, persons)
+        # Containment first, IoU only to break ties
+        score = containment + iou * 1e-3
+        owner = np.argmax(score, axis=1)
+        assigned = containment[np.arange(len(ppe)), owner] >= min_containment
+        ppe_per_person = np.bincount(owner[assigned], minlength=len(persons))
+        unassigned = int(len(ppe) - assigned.sum())
+    compliant = ppe_per_person >= required
+    return {
+        "persons": [
+            {
+                "box": [round(float(value), 3) for value in box],
+                "ppe": int(count),
+                "compliant": bool(ok),
+            }
+            for box, count, ok in zip(persons, ppe_per_person, compliant)
+        ],
+        "compliant": int(compliant.sum()),
+        "violations": int(len(persons) - compliant.sum()),
+        "unassigned_ppe": unassigned,
+    }
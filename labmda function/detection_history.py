@@ -0,0 +1,198 @@
+""" Fixed size history of the detections, stored in a NumPy structured
+    array used as a ring buffer, so memory stays constant however long the
+    lambda runs. Rolling aggregates are updated as records come and go.
+"""
+from collections import deque
+from threading import Lock
+import time
+import numpy as np
+from detections import PERSON_ID, PPE_ID, as_detections, find_label_id, label_name
+
+# Name of the confidence histogram shared by the labels past max_labels - 1
+OTHER = "other"
+
+
+HISTORY_DTYPE = np.dtype(
+    [
+        ("timestamp", "f8"),
+        ("frame_id", "i8"),
+        ("label_id", "i2"),
+        ("confidence", "f4"),
+        ("left", "f4"),
+        ("top", "f4"),
+        ("width", "f4"),
+        ("height", "f4"),
+    ]
+)
+
+
+class DetectionHistory(object):
+    """ Ring buffer of detection records. Besides the records it keeps:
+        - the person and PPE counts of the frames in the last window seconds,
+        - a histogram of confidences per label over the stored records, from
+          which confidence percentiles are read.
+        Records hold the interned label ids of detections.py, as the
+        Detections batches do, so a frame is appended without a lookup per
+        label.
+    """
+
+    def __init__(self, capacity=10000, window=60.0, max_labels=16):
+        """ capacity - Number of detection records kept
+            window - Length in seconds of the rolling count window
+            max_labels - Number of confidence histograms; labels interned
+                         after the first max_labels - 1 share the last one,
+                         reported as OTHER
+        """
+        self.capacity = capacity
+        self.window = window
+        self.max_labels = max_labels
+        self._records = np.zeros(capacity, dtype=HISTORY_DTYPE)
+        self._next = 0
+        self._size = 0
+        # One bin per confidence percent, per label
+        self._histograms = np.zeros((max_labels, 101), dtype=np.int64)
+        # Histograms that received a record
+        self._seen = np.zeros(max_labels, dtype=bool)
+        # (timestamp, persons, ppes) of the frames in the window
+        self._frames = deque(maxlen=capacity)
+        self._window_persons = 0
+        self._window_ppes = 0
+        self._lock = Lock()
+
+    def _histogram_rows(self, labels):
+        return np.minimum(labels, self.max_labels - 1)
+
+    def add(self, timestamp, frame_id, labels):
+        """ Records the custom labels detected in a frame.
+            timestamp - Capture time of the frame
+            frame_id - Id of the frame
+            labels - Detections or CustomLabels list of the Rekognition
+                     response
+        """
+        detections = as_detections(labels)
+        count = len(detections)
+        persons = int(np.count_nonzero(detections.labels == PERSON_ID))
+        ppes = int(np.count_nonzero(detections.labels == PPE_ID))
+        with self._lock:
+            self._add_frame(timestamp, persons, ppes)
+            if count == 0:
+                return
+            # Only the newest records are kept when a frame has more labels
+            # than the whole buffer.
+            start = max(0, count - self.capacity)
+            count -= start
+            rows = np.zeros(count, dtype=HISTORY_DTYPE)
+            rows["timestamp"] = timestamp
+            rows["frame_id"] = frame_id
+            rows["label_id"] = detections.labels[start:]
+            rows["confidence"] = detections.confidences[start:]
+            boxes = detections.boxes[start:]
+            for column, field in enumerate(("left", "top", "width", "height")):
+                rows[field] = boxes[:, column]
+            positions = (self._next + np.arange(count)) % self.capacity
+            # Records about to be overwritten leave the histograms. Until the
+            # buffer is full the free slots come first, so the overwritten
+            # positions are the last ones.
+            overwritten = positions[count - max(0, self._size + count - self.capacity) :]
+            if len(overwritten):
+                old = self._records[overwritten]
+                np.subtract.at(
+                    self._histograms,
+                    (self._histogram_rows(old["label_id"]), self._bins(old["confidence"])),
+                    1,
+                )
+            self._records[positions] = rows
+            histogram_rows = self._histogram_rows(rows["label_id"])
+            np.add.at(self._histograms, (histogram_rows, self._bins(rows["confidence"])), 1)
+            self._seen[histogram_rows] = True
+            self._next = (self._next + count) % self.capacity
+            self._size = min(self.capacity, self._size + count)
+
+    @staticmethod
+    def _bins(confidence):
+        return np.clip(np.rint(confidence), 0, 100).astype(np.int64)
+
+    def _add_frame(self, timestamp, persons, ppes):
+        if len(self._frames) == self._frames.maxlen:
+            self._drop_frame()
+        self._frames.append((timestamp, persons, ppes))
+        self._window_persons += persons
+        self._window_ppes += ppes
+        self._expire(timestamp)
+
+    def _drop_frame(self):
+        _, persons, ppes = self._frames.popleft()
+        self._window_persons -= persons
+        self._window_ppes -= ppes
+
+    def _expire(self, now):
+        while self._frames and self._frames[0][0] < now - self.window:
+            self._drop_frame()
+
+    def window_counts(self, now=None):
+        """ Returns the number of frames and the total and average person
+            and PPE counts over the last window seconds.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            frames = len(self._frames)
+            return {
+                "frames": frames,
+                "persons": self._window_persons,
+                "ppes": self._window_ppes,
+                "persons_per_frame": float(self._window_persons) / frames if frames else 0.0,
+                "ppes_per_frame": float(self._window_ppes) / frames if frames else 0.0,
+            }
+
+    def _row_name(self, row):
+        return OTHER if row == self.max_labels - 1 else label_name(row)
+
+    def percentiles(self, name, qs=(50, 90, 99)):
+        """ Returns the confidence percentiles of a label over the stored
+            records, with a resolution of one percent. None for a label
+            never recorded, or one sharing the OTHER histogram: OTHER
+            returns the percentiles of all of them.
+        """
+        if name == OTHER:
+            row = self.max_labels - 1
+        else:
+            row = find_label_id(str(name))
+            if row is None or row >= self.max_labels - 1:
+                return None
+        with self._lock:
+            if not self._seen[row]:
+                return None
+            cumulative = np.cumsum(self._histograms[row])
+            total = cumulative[-1]
+            if total == 0:
+                return None
+            return dict(
+                (q, int(np.searchsorted(cumulative, total * q / 100.0))) for q in qs
+            )
+
+    def query(self, start, end):
+        """ Returns a copy of the records with start <= timestamp < end, oldest
+            first.
+        """
+        with self._lock:
+            if self._size < self.capacity:
+                records = self._records[: self._size]
+            else:
+                records = np.roll(self._records, -self._next)
+            selected = (records["timestamp"] >= start) & (records["timestamp"] < end)
+            return records[selected].copy()
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        """ Returns the window counts and the confidence percentiles of every
+            label.
+        """
+        stats = {"records": self._size, "window": self.window_counts()}
+        stats["confidence"] = dict(
+            (self._row_name(row), self.percentiles(self._row_name(row)))
+            for row in np.flatnonzero(self._seen).tolist()
+        )
+        return stats
@@ -0,0 +1,263 @@
+""" Compact detection records shared by the Rekognition custom labels and
+    the on-device SSD model. A response is parsed once into a Detections
+    batch: the interned label ids, the confidences and the boxes of the
+    frame packed in NumPy arrays, from which the counting, association,
+    drawing, history and publishing read. Indexing a batch gives Detection
+    records, small __slots__ objects without a per record dict.
+
+    Boxes are (left, top, width, height) relative to the frame size, like
+    the BoundingBox of Rekognition; labels without a geometry have NaN
+    boxes.
+"""
+from collections import Counter
+from itertools import chain
+from operator import itemgetter
+from threading import Lock
+import sys
+import numpy as np
+
+PERSON = "person"
+PPE = "PPE"
+
+# Names of the SSD classes used here, other classes are named ssd_<id>
+SSD_LABELS = {15: PERSON}
+
+_label_ids = {}
+_label_names = []
+_label_lock = Lock()
+# Label id of every SSD class id seen
+_ssd_ids = {}
+NO_BOX = (np.nan, np.nan, np.nan, np.nan)
+_ssd_fields = itemgetter("prob", "xmin", "ymin", "xmax", "ymax")
+
+
+def label_id(name):
+    """ Returns the interned id of a label name, the same for the whole
+        process.
+    """
+    found = _label_ids.get(name)
+    if found is not None:
+        return found
+    with _label_lock:
+        if name not in _label_ids:
+            _label_ids[name] = len(_label_names)
+            _label_names.append(sys.intern(str(name)))
+        return _label_ids[name]
+
+
+def find_label_id(name):
+    """ Returns the interned id of a label name, None when it was never
+        interned. Unlike label_id it does not intern the name.
+    """
+    return _label_ids.get(name)
+
+
+def label_name(label):
+    """ Returns the name of an interned label id. """
+    return _label_names[label]
+
+
+def ssd_label_name(label):
+    """ Name of an SSD class id. """
+    return SSD_LABELS.get(label, "ssd_{}".format(label))
+
+
+def ssd_label_id(label):
+    """ Interned label id of an SSD class id. """
+    found = _ssd_ids.get(label)
+    if found is None:
+        found = _ssd_ids[label] = label_id(ssd_label_name(label))
+    return found
+
+
+PERSON_ID = label_id(PERSON)
+PPE_ID = label_id(PPE)
+
+
+class Detection(object):
+    """ One detection: interned label id, confidence in percent and the
+        relative box.
+    """
+
+    __slots__ = ("label", "confidence", "left", "top", "width", "height")
+
+    def __init__(self, label, confidence, left, top, width, height):
+        self.label = label
+        self.confidence = confidence
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+    @property
+    def name(self):
+        return label_name(self.label)
+
+    @property
+    def has_box(self):
+        return self.left == self.left
+
+    def to_label(self):
+        """ The detection as a Rekognition custom label. """
+        label = {"Name": self.name, "Confidence": self.confidence}
+        if self.has_box:
+            label["Geometry"] = {
+                "BoundingBox": {
+                    "Left": self.left,
+                    "Top": self.top,
+                    "Width": self.width,
+                    "Height": self.height,
+                }
+            }
+        return label
+
+    def __repr__(self):
+        return "Detection({}, {:.1f}, {:.3f}, {:.3f}, {:.3f}, {:.3f})".format(
+            self.name, self.confidence, self.left, self.top, self.width, self.height
+        )
+
+
+class Detections(object):
+    """ The detections of a frame as arrays:
+        labels - (n,) int16 interned label ids
+        confidences - (n,) float32 confidences in percent
+        boxes - (n, 4) float32 (left, top, width, height), relative
+    """
+
+    __slots__ = ("labels", "confidences", "boxes", "_corners", "_boxed")
+
+    def __init__(self, labels, confidences, boxes):
+        self.labels = labels
+        self.confidences = confidences
+        self.boxes = boxes
+        # float64 corners of every detection and the mask of the ones with
+        # a box, computed on first use
+        self._corners = None
+        self._boxed = None
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.zeros(0, dtype=np.int16),
+            np.zeros(0, dtype=np.float32),
+            np.zeros((0, 4), dtype=np.float32),
+        )
+
+    @classmethod
+    def from_rekognition(cls, labels):
+        """ Parses the CustomLabels list of a Rekognition response, or of
+            the fallback detector, in one pass.
+        """
+        ids, confidences, boxes = [], [], []
+        ids_get = _label_ids.get
+        for label in labels:
+            name = label["Name"]
+            found = ids_get(name)
+            ids.append(label_id(name) if found is None else found)
+            confidences.append(label["Confidence"])
+            geometry = label.get("Geometry")
+            if geometry is None:
+                boxes.append(NO_BOX)
+            else:
+                box = geometry["BoundingBox"]
+                boxes.append((box["Left"], box["Top"], box["Width"], box["Height"]))
+        # One conversion per array, element wise stores cost more than the
+        # lists for the few labels of a frame
+        return cls(
+            np.array(ids, dtype=np.int16),
+            np.array(confidences, dtype=np.float32),
+            np.array(boxes, dtype=np.float32).reshape(-1, 4),
+        )
+
+    @classmethod
+    def from_ssd(cls, results, input_width, input_height, threshold=0.0, classes=None):
+        """ Parses the output of parseResult for an SSD model in one pass.
+            results - List of dicts with label, prob, xmin, ymin, xmax, ymax
+                      in the coordinates of the model input
+            input_width, input_height - Size of the model input
+            threshold - Minimum probability of a detection kept
+            classes - SSD class ids kept, all of them when None
+        """
+        kept = [
+            obj
+            for obj in results
+            if obj["prob"] > threshold and (classes is None or obj["label"] in classes)
+        ]
+        ids = np.array([ssd_label_id(obj["label"]) for obj in kept], dtype=np.int16)
+        # The fields gathered in C and copied into one array
+        values = np.fromiter(
+            chain.from_iterable(map(_ssd_fields, kept)), dtype=np.float32, count=5 * len(kept)
+        ).reshape(-1, 5)
+        boxes = values[:, 1:] / np.float32((input_width, input_height, input_width, input_height))
+        # Corners to width and height
+        boxes[:, 2:] -= boxes[:, :2]
+        # SSD probabilities are in [0, 1], Rekognition confidences in percent
+        return cls(ids, values[:, 0] * 100, boxes)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        left, top, width, height = self.boxes[index].tolist()
+        return Detection(
+            int(self.labels[index]), float(self.confidences[index]), left, top, width, height
+        )
+
+    def __iter__(self):
+        for index in range(len(self.labels)):
+            yield self[index]
+
+    def names(self):
+        """ The label name of every detection. """
+        return [_label_names[label] for label in self.labels.tolist()]
+
+    def counts(self):
+        """ Counter of the detections per label name. """
+        return Counter(self.names())
+
+    def count(self, name):
+        return int(np.count_nonzero(self.labels == label_id(name)))
+
+    def select(self, name, min_confidence=None):
+        """ The detections of one label, above min_confidence percent. """
+        keep = self.labels == label_id(name)
+        if min_confidence is not None:
+            keep &= self.confidences > min_confidence
+        return Detections(self.labels[keep], self.confidences[keep], self.boxes[keep])
+
+    def has_box(self):
+        """ Mask of the detections that have a box. """
+        return self.boxes[:, 0] == self.boxes[:, 0]
+
+    def corners(self, name=None):
+        """ (n, 4) float64 array of the (left, top, right, bottom) relative
+            boxes, of the detections of one label when name is given.
+            Detections without a box are left out.
+        """
+        if self._corners is None:
+            corners = self.boxes.astype(np.float64)
+            corners[:, 2:] += corners[:, :2]
+            self._corners = corners
+            self._boxed = corners[:, 0] == corners[:, 0]
+        if name is None:
+            return self._corners[self._boxed]
+        return self._corners[self._boxed & (self.labels == label_id(name))]
+
+    def pixel_corners(self, shape, name=None):
+        """ Like corners, in pixels of a frame of the given shape. """
+        height, width = shape[:2]
+        return self.corners(name) * (width, height, width, height)
+
+    def to_labels(self):
+        """ The detections as a Rekognition CustomLabels list. """
+        return [detection.to_label() for detection in self]
+
+    def nbytes(self):
+        return self.labels.nbytes + self.confidences.nbytes + self.boxes.nbytes
+
+
+def as_detections(labels):
+    """ Returns labels as Detections, parsing a CustomLabels list. """
+    if isinstance(labels, Detections):
+        return labels
+    return Detections.from_rekognition(labels)
@@ -0,0 +1,247 @@
+""" Local detection for when Rekognition is slow or unreachable. A circuit
+    breaker watches the latency and errors of the Rekognition calls; while
+    it is open the frames are answered on the device instead, from the SSD
+    person boxes and a colour check of their head region, so detection
+    keeps running at a lower accuracy. The responses of the local detector
+    are marked with their source.
+"""
+from threading import Lock
+import time
+import cv2
+import numpy as np
+
+# Source of the responses of the local detector
+LOCAL_SOURCE = "local"
+# Source of the responses of the custom labels model
+REKOGNITION_SOURCE = "rekognition"
+
+# Hard hat colours as HSV ranges (OpenCV hue goes from 0 to 179)
+HELMET_COLOURS = {
+    "yellow": ((20, 100, 120), (35, 255, 255)),
+    "orange": ((5, 120, 120), (20, 255, 255)),
+    "red": ((0, 120, 100), (5, 255, 255)),
+    "blue": ((100, 120, 80), (125, 255, 255)),
+}
+# White hard hats, not in the defaults: the range also matches sky, walls
+# and any bright background around the head. Add it for sites with a dark
+# background, colours=dict(HELMET_COLOURS, white=WHITE_HELMET).
+WHITE_HELMET = ((0, 0, 200), (179, 40, 255))
+
+
+class CircuitBreaker(object):
+    """ Closed, calls go to Rekognition. After failures failed calls or
+        slow_calls calls slower than latency_threshold in a row it opens,
+        and the calls are skipped for reset_timeout seconds. It is then half
+        open: calls are let through again, and the first outcome closes it
+        or opens it for another reset_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failures=3,
+        slow_calls=3,
+        latency_threshold=3.0,
+        reset_timeout=30.0,
+        clock=time.time,
+    ):
+        """ failures - Failed calls in a row that open the breaker
+            slow_calls - Slow calls in a row that open the breaker
+            latency_threshold - Seconds above which a call is slow
+            reset_timeout - Seconds the breaker stays open
+            clock - Time function
+        """
+        self.max_failures = failures
+        self.max_slow_calls = slow_calls
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.failures = 0
+        self.slow_calls = 0
+        self.trips = 0
+        self.short_circuited = 0
+        self._lock = Lock()
+
+    def allow(self):
+        """ Returns True when Rekognition may be called. """
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    self.short_circuited += 1
+                    return False
+                self.state = self.HALF_OPEN
+            return True
+
+    def record(self, latency=None, error=None):
+        """ Records the outcome of a call: its latency in seconds when it
+            succeeded, its error when it failed.
+        """
+        with self._lock:
+            if error is not None:
+                self.failures += 1
+                self.slow_calls = 0
+            elif latency is not None and latency > self.latency_threshold:
+                self.slow_calls += 1
+                self.failures = 0
+            else:
+                self.failures = self.slow_calls = 0
+            bad = self.failures > 0 or self.slow_calls > 0
+            if self.state == self.HALF_OPEN:
+                if bad:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+            elif self.state == self.CLOSED and (
+                self.failures >= self.max_failures or self.slow_calls >= self.max_slow_calls
+            ):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.trips += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "short_circuited": self.short_circuited,
+                "failures": self.failures,
+                "slow_calls": self.slow_calls,
+            }
+
+
+class LocalPPEDetector(object):
+    """ Finds hard hats without the cloud: the head region of every SSD
+        person box is checked for pixels of the helmet colours. A person
+        whose head region is covered enough gets a PPE label over the
+        coloured pixels. The responses have the format of
+        detect_custom_labels, with the confidence of the persons taken from
+        the SSD model and the confidence of a PPE growing with its coverage.
+    """
+
+    def __init__(
+        self,
+        colours=None,
+        head_height=0.25,
+        head_width=0.6,
+        min_coverage=0.15,
+        full_coverage=0.4,
+        crop_width=48,
+    ):
+        """ colours - Dict of name to (lower, upper) HSV ranges, defaults to
+                      HELMET_COLOURS
+            head_height - Fraction of the person box height searched from
+                          its top
+            head_width - Fraction of the person box width searched around
+                         its centre
+            min_coverage - Fraction of the head region in helmet colours
+                           needed for a PPE label
+            full_coverage - Coverage with a confidence of 100
+            crop_width - Width the head region is scaled down to
+        """
+        colours = HELMET_COLOURS if colours is None else colours
+        self.ranges = [
+            (np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+            for lower, upper in colours.values()
+        ]
+        self.head_height = head_height
+        self.head_width = head_width
+        self.min_coverage = min_coverage
+        self.full_coverage = full_coverage
+        self.crop_width = crop_width
+        self.frames = 0
+        self.persons = 0
+        self.ppes = 0
+        self._lock = Lock()
+
+    def head_region(self, box, shape):
+        """ Pixel (left, top, right, bottom) of the head region of a person
+            box, clipped to the frame.
+        """
+        xmin, ymin, xmax, ymax = box
+        margin = (xmax - xmin) * (1.0 - self.head_width) / 2.0
+        left = int(max(0, xmin + margin))
+        right = int(min(shape[1], xmax - margin))
+        top = int(max(0, ymin))
+        bottom = int(min(shape[0], ymin + (ymax - ymin) * self.head_height))
+        return left, top, right, bottom
+
+    def helmet(self, frame, box):
+        """ Returns the coverage of the head region in helmet colours and
+            the pixel box of the coloured pixels, None when there are none.
+        """
+        left, top, right, bottom = self.head_region(box, frame.shape)
+        if right - left < 2 or bottom - top < 2:
+            return 0.0, None
+        crop = frame[top:bottom, left:right]
+        scale = min(1.0, float(self.crop_width) / crop.shape[1])
+        if scale < 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        mask = None
+        for lower, upper in self.ranges:
+            colour = cv2.inRange(hsv, lower, upper)
+            mask = colour if mask is None else cv2.bitwise_or(mask, colour)
+        coverage = cv2.countNonZero(mask) / float(mask.size)
+        if coverage == 0:
+            return 0.0, None
+        x, y, width, height = cv2.boundingRect(mask)
+        return (
+            coverage,
+            (
+                left + x / scale,
+                top + y / scale,
+                left + (x + width) / scale,
+                top + (y + height) / scale,
+            ),
+        )
+
+    def detect(self, frame, boxes, scores=None):
+        """ Returns a detect_custom_labels style response for a frame.
+            frame - BGR frame
+            boxes - Pixel (xmin, ymin, xmax, ymax) boxes of the SSD persons
+            scores - Optional SSD probabilities of the boxes
+        """
+        height, width = frame.shape[:2]
+
+        def label(name, confidence, box):
+            xmin, ymin, xmax, ymax = box
+            return {
+                "Name": name,
+                "Confidence": round(confidence, 1),
+                "Geometry": {
+                    "BoundingBox": {
+                        "Left": xmin / width,
+                        "Top": ymin / height,
+                        "Width": (xmax - xmin) / width,
+                        "Height": (ymax - ymin) / height,
+                    }
+                },
+            }
+
+        labels = []
+        ppes = 0
+        for index, box in enumerate(boxes):
+            score = scores[index] if scores is not None else 1.0
+            labels.append(label("person", 100.0 * score, box))
+            coverage, helmet_box = self.helmet(frame, box)
+            if coverage >= self.min_coverage:
+                ppes += 1
+                confidence = 100.0 * min(1.0, coverage / self.full_coverage)
+                labels.append(label("PPE", confidence, helmet_box))
+        with self._lock:
+            self.frames += 1
+            self.persons += len(boxes)
+            self.ppes += ppes
+        return {"CustomLabels": labels, "Source": LOCAL_SOURCE}
+
+    def stats(self):
+        with self._lock:
+            return {"frames": self.frames, "persons": self.persons, "ppes": self.ppes}
@@ -0,0 +1,239 @@
+""" Serving several cameras from one process: a Rekognition worker pool
+    shared by the cameras, with a queue per camera served in round robin so
+    a busy camera cannot starve the others, and the per camera pipelines
+    with their frame rate and latency.
+"""
+from threading import Thread, Event, Condition, Lock
+from collections import deque, OrderedDict
+import time
+
+
+class QueueFull(Exception):
+    """ The queue of a camera is full. It carries the error code of a
+        throttled call, so the scheduler and the breaker handle it as one.
+    """
+
+    def __init__(self, camera):
+        super(QueueFull, self).__init__("Rekognition queue of {} is full".format(camera))
+        self.response = {"Error": {"Code": "LimitExceededException", "Message": str(self)}}
+
+
+class _Request(object):
+    __slots__ = ("kwargs", "queued_at", "done", "result", "error")
+
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self.queued_at = time.time()
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class RekognitionPool(object):
+    """ Bounded pool of threads making the Rekognition calls of every
+        camera with one shared client, so at most workers requests are in
+        flight. Each camera has its own queue; the queues are served in
+        round robin. The analyse stage of a camera waits for its call, so a
+        camera has at most one request queued and gets at most one call per
+        round.
+    """
+
+    def __init__(self, client, workers=4, max_queue=8):
+        """ client - boto3 Rekognition client, shared by the workers
+            workers - Number of requests in flight at most
+            max_queue - Maximum number of requests waiting per camera
+        """
+        self.client = client
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queues = OrderedDict()
+        self.stats_by_camera = {}
+        self.in_flight = 0
+        self._cursor = 0
+        self._cond = Condition()
+        self.stop_request = Event()
+        self._threads = []
+
+    def client_for(self, camera):
+        """ Returns the client the stages of a camera call, with the
+            detect_custom_labels method of the boto3 client.
+        """
+        with self._cond:
+            self.queues[camera] = deque()
+            self.stats_by_camera[camera] = {
+                "calls": 0,
+                "errors": 0,
+                "rejected": 0,
+                "wait_ms": 0.0,
+                "latency_ms": 0.0,
+            }
+        return PooledRekognition(self, camera)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = Thread(target=self._work, name="rekognition-{}".format(index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def call(self, camera, kwargs):
+        """ Queues a request of a camera and waits for its result. """
+        request = _Request(kwargs)
+        with self._cond:
+            queue = self.queues[camera]
+            if len(queue) >= self.max_queue:
+                self.stats_by_camera[camera]["rejected"] += 1
+                raise QueueFull(camera)
+            queue.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next(self):
+        """ Picks the next request in round robin, None when every queue is
+            empty. Called with the condition held.
+        """
+        cameras = list(self.queues)
+        for offset in range(len(cameras)):
+            camera = cameras[(self._cursor + offset) % len(cameras)]
+            if self.queues[camera]:
+                self._cursor = (self._cursor + offset + 1) % len(cameras)
+                return camera, self.queues[camera].popleft()
+        return None, None
+
+    def _work(self):
+        while not self.stop_request.isSet():
+            with self._cond:
+                camera, request = self._next()
+                if request is None:
+                    self._cond.wait(0.5)
+                    continue
+                self.in_flight += 1
+            start = time.time()
+            try:
+                request.result = self.client.detect_custom_labels(**request.kwargs)
+            except Exception as ex:
+                request.error = ex
+            end = time.time()
+            with self._cond:
+                self.in_flight -= 1
+                stats = self.stats_by_camera[camera]
+                stats["calls"] += 1
+                stats["errors"] += 1 if request.error is not None else 0
+                stats["wait_ms"] += (start - request.queued_at) * 1000.0
+                stats["latency_ms"] += (end - start) * 1000.0
+            request.done.set()
+
+    def join(self, timeout=None):
+        self.stop_request.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """ Returns the calls, errors and average queue wait and latency of
+            every camera, and the number of requests in flight.
+        """
+        with self._cond:
+            cameras = {}
+            for camera, stats in self.stats_by_camera.items():
+                calls = stats["calls"]
+                cameras[camera] = {
+                    "calls": calls,
+                    "errors": stats["errors"],
+                    "rejected": stats["rejected"],
+                    "queued": len(self.queues[camera]),
+                    "avg_wait_ms": round(stats["wait_ms"] / calls, 1) if calls else 0.0,
+                    "avg_latency_ms": round(stats["latency_ms"] / calls, 1)
+                    if calls
+                    else 0.0,
+                }
+            return {"in_flight": self.in_flight, "cameras": cameras}
+
+
+class PooledRekognition(object):
+    """ Per camera handle on a RekognitionPool. """
+
+    def __init__(self, pool, camera):
+        self.pool = pool
+        self.camera = camera
+
+    def detect_custom_labels(self, **kwargs):
+        return self.pool.call(self.camera, kwargs)
+
+
+class SharedModel(object):
+    """ On-device model shared by the cameras, one inference at a time. """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = Lock()
+
+    def doInference(self, frame):
+        with self._lock:
+            return self.model.doInference(frame)
+
+    def parseResult(self, model_type, result):
+        return self.model.parseResult(model_type, result)
+
+
+class Camera(object):
+    """ A frame source with its stages, pipeline and metrics. """
+
+    def __init__(self, source, stages, pipeline, metrics):
+        self.name = source.name
+        self.source = source
+        self.stages = stages
+        self.pipeline = pipeline
+        self.metrics = metrics
+
+    def stats(self):
+        """ Frame rate and latency since the previous call, with the stage
+            timings and the statistics of the pipeline and components.
+        """
+        snapshot = self.metrics.snapshot()
+        frames = snapshot["counters"].get("frames", 0)
+        latency = snapshot["timings"].get("frame_latency", {})
+        stats = {
+            "fps": round(frames / snapshot["interval"], 2) if snapshot["interval"] else 0.0,
+            "latency_ms": latency,
+            "timings": snapshot["timings"],
+            "counters": snapshot["counters"],
+            "pipeline": self.pipeline.stats(),
+            "source": self.source.stats(),
+        }
+        stats.update(self.stages.stats())
+        # The uploader, publisher, fallback and stream server are shared,
+        # the caller reports them once; the counters above hold the share
+        # of this camera
+        for name in ("uploader", "publisher", "fallback", "breaker", "stream"):
+            stats.pop(name, None)
+        return stats
+
+
+class CameraSet(object):
+    """ Starts, stops and reports on every camera. """
+
+    def __init__(self, cameras):
+        self.cameras = cameras
+
+    def start(self):
+        for camera in self.cameras:
+            camera.pipeline.start()
+
+    def join(self, timeout=None):
+        for camera in self.cameras:
+            camera.pipeline.join(timeout)
+            camera.source.close()
+            # Upload the segment being recorded
+            if camera.stages.archive is not None:
+                camera.stages.archive.flush()
+
+    def is_alive(self):
+        return any(camera.pipeline.is_alive() for camera in self.cameras)
+
+    def stats(self):
+        return dict((camera.name, camera.stats()) for camera in self.cameras)
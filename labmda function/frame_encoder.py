@@ -0,0 +1,139 @@
+""" JPEG encoding of the frames sent to Rekognition, S3 and the local
+    display. Frames for analysis are downscaled and encoded with a quality
+    adapted to a byte budget; annotated frames are encoded once and the
+    buffer is shared by every consumer.
+"""
+from threading import Lock
+import time
+import cv2
+
+
+class EncodedFrame(object):
+    """ A JPEG buffer produced by cv2.imencode. view exposes the encoded
+        bytes without copying them; tobytes() makes a single copy, cached,
+        for APIs that only accept bytes (such as boto3 request parameters).
+    """
+
+    def __init__(self, buffer, quality, shape):
+        """ buffer - uint8 numpy array returned by cv2.imencode
+            quality - JPEG quality used for the encode
+            shape - Shape of the image that was encoded
+        """
+        self.buffer = buffer
+        self.quality = quality
+        self.shape = shape
+        self._bytes = None
+
+    @property
+    def view(self):
+        return memoryview(self.buffer).cast("B")
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+    def tobytes(self):
+        if self._bytes is None:
+            self._bytes = self.buffer.tobytes()
+        return self._bytes
+
+
+class FrameEncoder(object):
+    """ Encodes frames to JPEG and keeps track of the time and bytes spent
+        per encode path ("analysis" and "annotated").
+    """
+
+    def __init__(
+        self,
+        analysis_width=None,
+        byte_budget=None,
+        quality=90,
+        min_quality=40,
+        max_quality=95,
+        quality_step=5,
+    ):
+        """ analysis_width - Width frames are downscaled to before analysis,
+                             None keeps the original size
+            byte_budget - Target maximum size in bytes of an analysis JPEG,
+                          None keeps a fixed quality
+            quality - Starting JPEG quality
+            min_quality, max_quality - Range the adaptive quality stays in
+            quality_step - Quality change applied per adjustment
+        """
+        self.analysis_width = analysis_width
+        self.byte_budget = byte_budget
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_step = quality_step
+        self._stats = {}
+        self._lock = Lock()
+
+    def _encode(self, image, quality):
+        ret, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ret:
+            raise Exception("Failed to encode frame")
+        return EncodedFrame(jpeg, quality, image.shape)
+
+    def _record(self, path, seconds, nbytes):
+        with self._lock:
+            entry = self._stats.setdefault(path, {"frames": 0, "ms": 0.0, "bytes": 0})
+            entry["frames"] += 1
+            entry["ms"] += seconds * 1000.0
+            entry["bytes"] += nbytes
+
+    def downscale(self, frame):
+        """ Resizes the frame to the analysis width, keeping the aspect ratio.
+            Rekognition returns relative coordinates, so the boxes found in
+            the smaller image apply unchanged to the original frame.
+        """
+        height, width = frame.shape[:2]
+        if self.analysis_width is None or width <= self.analysis_width:
+            return frame
+        scale = float(self.analysis_width) / width
+        return cv2.resize(
+            frame,
+            (self.analysis_width, int(round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def encode_for_analysis(self, frame):
+        """ Returns the EncodedFrame to send to Rekognition. With a byte
+            budget the quality is lowered until the JPEG fits (down to
+            min_quality) and raised again, one step per frame, while frames
+            come out well below the budget.
+        """
+        start = time.time()
+        image = self.downscale(frame)
+        encoded = self._encode(image, self.quality)
+        if self.byte_budget is not None:
+            while encoded.nbytes > self.byte_budget and self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - self.quality_step)
+                encoded = self._encode(image, self.quality)
+            if encoded.nbytes < 0.7 * self.byte_budget:
+                self.quality = min(self.max_quality, self.quality + self.quality_step)
+        self._record("analysis", time.time() - start, encoded.nbytes)
+        return encoded
+
+    def encode_annotated(self, image, quality=None):
+        """ Encodes the annotated frame once; the result is shared between
+            the S3 upload and the local display.
+        """
+        start = time.time()
+        encoded = self._encode(image, self.max_quality if quality is None else quality)
+        self._record("annotated", time.time() - start, encoded.nbytes)
+        return encoded
+
+    def stats(self):
+        """ Returns average encode ms and bytes per frame for each path. """
+        with self._lock:
+            stats = {}
+            for path, entry in self._stats.items():
+                frames = entry["frames"]
+                stats[path] = {
+                    "frames": frames,
+                    "ms_per_frame": entry["ms"] / frames,
+                    "bytes_per_frame": float(entry["bytes"]) / frames,
+                }
+            stats["quality"] = self.quality
+            return stats
@@ -0,0 +1,329 @@
+""" Fixed size ring of frames in shared memory, written by a capture process
+    and read by any number of consumer processes without copying or
+    pickling the frames. Every slot carries the sequence number and capture
+    time of its frame; a slot is marked as being written while the capture
+    process fills it, so readers can tell when a frame they hold a view on
+    has been overwritten (an overrun).
+"""
+from multiprocessing import shared_memory
+import multiprocessing
+import threading
+import time
+import cv2
+import numpy as np
+from frame_sources import FrameSource, open_source
+
+# Sequence number of a slot while the capture process is writing it
+WRITING = -1
+# Frames start at a cache line boundary after the header
+ALIGNMENT = 64
+
+
+class FrameRing(object):
+    """ The shared memory block holds a header of int64 sequence numbers
+        (the last written sequence, then one per slot), the float64 capture
+        times of the slots and the slots themselves, preallocated frames of
+        one shape. Sequence n lives in slot n % slots.
+    """
+
+    def __init__(self, memory, slots, shape, dtype, owner):
+        self.memory = memory
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.name = memory.name
+        self.sequences = np.ndarray((slots + 1,), dtype=np.int64, buffer=memory.buf)
+        stamps_offset = self.sequences.nbytes
+        self.stamps = np.ndarray(
+            (slots,), dtype=np.float64, buffer=memory.buf, offset=stamps_offset
+        )
+        frames_offset = _align(stamps_offset + self.stamps.nbytes)
+        self.frames = np.ndarray(
+            (slots,) + self.shape, dtype=self.dtype, buffer=memory.buf, offset=frames_offset
+        )
+
+    @staticmethod
+    def size(slots, shape, dtype=np.uint8):
+        """ Bytes of shared memory needed by a ring. """
+        header = _align(8 * (slots + 1) + 8 * slots)
+        return header + slots * int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    @classmethod
+    def create(cls, slots, shape, dtype=np.uint8, name=None):
+        """ Allocates a new ring, the caller owns it and unlinks it with
+            close().
+        """
+        if slots < 2:
+            raise Exception("A frame ring needs at least 2 slots")
+        memory = shared_memory.SharedMemory(
+            name=name, create=True, size=cls.size(slots, shape, dtype)
+        )
+        ring = cls(memory, slots, shape, dtype, owner=True)
+        ring.sequences[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots, shape, dtype=np.uint8):
+        """ Opens a ring created by another process. """
+        try:
+            # Only the owner should have the block cleaned up at exit
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=name)
+        return cls(memory, slots, shape, dtype, owner=False)
+
+    def spec(self):
+        """ Arguments of attach(), to hand the ring to another process. """
+        return (self.name, self.slots, self.shape, self.dtype.str)
+
+    @property
+    def head(self):
+        """ Sequence number of the last frame written, 0 before the first. """
+        return int(self.sequences[0])
+
+    def write(self, frame, timestamp=None):
+        """ Copies a frame into the next slot and returns its sequence
+            number. Only one process may write to a ring.
+        """
+        if frame.shape != self.shape:
+            raise Exception(
+                "Frame shape {} does not match the ring {}".format(frame.shape, self.shape)
+            )
+        sequence = self.head + 1
+        slot = sequence % self.slots
+        self.sequences[slot + 1] = WRITING
+        np.copyto(self.frames[slot], frame)
+        self.stamps[slot] = time.time() if timestamp is None else timestamp
+        self.sequences[slot + 1] = sequence
+        self.sequences[0] = sequence
+        return sequence
+
+    def get(self, sequence):
+        """ Returns a RingFrame for a sequence number, None when the frame
+            is not in the ring (anymore).
+        """
+        slot = sequence % self.slots
+        if sequence <= 0 or self.sequences[slot + 1] != sequence:
+            return None
+        view = self.frames[slot]
+        view.flags.writeable = False
+        frame = RingFrame(self, sequence, slot, float(self.stamps[slot]), view)
+        # The slot may have been overwritten between the two reads
+        return frame if frame.valid() else None
+
+    def close(self):
+        """ Detaches from the ring, and frees it when this process owns it. """
+        # The numpy views must go before the buffer can be released
+        self.sequences = self.stamps = self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class RingFrame(object):
+    """ Read only, zero copy view on a frame of the ring. The view is only
+        meaningful while valid() is True: check it after using the frame,
+        and drop the result when the frame was overwritten meanwhile.
+    """
+
+    __slots__ = ("ring", "sequence", "slot", "timestamp", "image")
+
+    def __init__(self, ring, sequence, slot, timestamp, image):
+        self.ring = ring
+        self.sequence = sequence
+        self.slot = slot
+        self.timestamp = timestamp
+        self.image = image
+
+    def valid(self):
+        return int(self.ring.sequences[self.slot + 1]) == self.sequence
+
+
+class RingReader(object):
+    """ Reads the frames of a ring in order. With several readers, reader
+        index out of count takes the sequences n where n % count == index,
+        so the frames are shared between the readers without coordination.
+        A reader falling more than a ring behind skips to the oldest frame
+        still available and counts the skipped frames as overruns.
+    """
+
+    def __init__(self, ring, index=0, count=1, poll=0.002):
+        """ ring - FrameRing to read from
+            index, count - Share of the frames taken by this reader
+            poll - Seconds between two checks for a new frame
+        """
+        self.ring = ring
+        self.index = index
+        self.count = count
+        self.poll = poll
+        self.last = 0
+        self.frames = 0
+        self.overruns = 0
+
+    def _own(self, sequence):
+        """ The first sequence from sequence on that belongs to this reader. """
+        return sequence + (self.index - sequence) % self.count
+
+    def next(self, timeout=1.0):
+        """ Returns the next RingFrame of this reader, None on timeout. """
+        deadline = time.time() + timeout
+        while True:
+            head = self.ring.head
+            wanted = self._own(self.last + 1)
+            if wanted <= head:
+                # The slot after the head may be being written already
+                oldest = self._own(max(1, head - self.ring.slots + 2))
+                if wanted < oldest:
+                    self.overruns += (oldest - wanted) // self.count
+                    wanted = oldest
+                self.last = wanted
+                frame = self.ring.get(wanted)
+                if frame is not None:
+                    self.frames += 1
+                    return frame
+                self.overruns += 1
+                continue
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.poll)
+
+    def latest(self):
+        """ Returns the newest frame, skipping any frame not read yet. """
+        head = self.ring.head
+        if head > self.last:
+            self.last = head - 1
+        return self.next(timeout=0)
+
+    def stats(self):
+        return {"frames": self.frames, "overruns": self.overruns}
+
+
+def fit_frame(frame, shape, dtype):
+    """ Returns a frame scaled to the shape of a ring, None when it cannot
+        be, e.g. a grey frame for a colour ring.
+    """
+    shape = tuple(shape)
+    if frame.dtype != dtype or frame.shape[2:] != shape[2:]:
+        return None
+    if frame.shape == shape:
+        return frame
+    return cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+
+
+def capture_loop(camera, location, ring_spec, stop):
+    """ Body of the capture process: reads the frames of a source and
+        writes them into the ring until stop is set. The ring keeps the
+        shape of the first frame; when the source changes resolution, e.g.
+        a stream renegotiated by the camera, the frames are scaled to it,
+        and frames that cannot be are skipped.
+    """
+    source = open_source(camera, location)
+    ring = FrameRing.attach(*ring_spec)
+    last_shape = ring.shape
+    try:
+        while not stop.is_set():
+            ret, frame = source.read()
+            if not ret:
+                continue
+            if frame.shape != last_shape:
+                print(
+                    "Camera {} frames are now {}, the ring holds {}".format(
+                        camera, frame.shape, ring.shape
+                    )
+                )
+                last_shape = frame.shape
+            frame = fit_frame(frame, ring.shape, ring.dtype)
+            if frame is not None:
+                ring.write(frame)
+    finally:
+        source.close()
+        ring.close()
+
+
+class CaptureProcess(object):
+    """ Runs the frame source of a camera in its own process, feeding a
+        frame ring, so decoding and grabbing frames never compete with the
+        encodes and resizes of the detection loop for the interpreter.
+    """
+
+    def __init__(self, camera, location, slots=8):
+        """ camera - Name of the camera
+            location - Location of the source, see frame_sources.open_source
+            slots - Number of frames kept in the ring
+        """
+        # The shape of the ring comes from a first frame of the source
+        probe = open_source(camera, location)
+        try:
+            ret, frame = False, None
+            for _ in range(50):
+                ret, frame = probe.read()
+                if ret:
+                    break
+        finally:
+            probe.close()
+        if not ret:
+            raise Exception("No frame from {}".format(location))
+        self.camera = camera
+        self.ring = FrameRing.create(slots, frame.shape, frame.dtype)
+        # A child forked while other threads run may inherit a lock one of
+        # them holds (logging, boto3, cv2) and hang on it; once threads are
+        # running the child is spawned instead, which re-imports the modules
+        # and the main module: its entry point must be guarded.
+        if threading.active_count() > 1:
+            context = multiprocessing.get_context("spawn")
+        else:
+            context = multiprocessing.get_context("fork")
+        self.stop_request = context.Event()
+        self.process = context.Process(
+            target=capture_loop,
+            args=(camera, location, self.ring.spec(), self.stop_request),
+            name="capture-" + camera,
+        )
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+
+    def join(self, timeout=None):
+        self.stop_request.set()
+        self.process.join(timeout)
+        self.ring.close()
+
+
+class RingSource(FrameSource):
+    """ Frame source reading the newest frame of a ring. The stages draw on
+        the frame and keep it until its upload, far longer than it stays in
+        the ring, so the frame is copied once out of the ring, like
+        awscam.getLastFrame returns a fresh array.
+    """
+
+    def __init__(self, name, ring, timeout=1.0, attempts=3):
+        """ name - Name of the camera
+            ring - FrameRing fed by a CaptureProcess
+            timeout - Seconds to wait for a frame
+            attempts - Copies tried when the frame is overwritten meanwhile
+        """
+        super(RingSource, self).__init__(name)
+        self.reader = RingReader(ring)
+        self.timeout = timeout
+        self.attempts = attempts
+
+    def read(self):
+        for _ in range(self.attempts):
+            frame = self.reader.latest() or self.reader.next(self.timeout)
+            if frame is None:
+                return False, None
+            image = np.array(frame.image)
+            if frame.valid():
+                return True, image
+            # Overwritten while it was copied, try the newest frame
+            self.reader.overruns += 1
+        return False, None
+
+    def stats(self):
+        return self.reader.stats()
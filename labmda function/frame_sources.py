@@ -0,0 +1,198 @@
+""" Frame sources feeding the detection loop. Every source has a name and a
+    read() method returning (ret, frame) like awscam.getLastFrame, so the
+    capture stage does not care where the frames come from.
+"""
+from threading import Thread, Event, Condition
+import os
+import time
+import cv2
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class FrameSource(object):
+    """ Base class of the frame sources. """
+
+    def __init__(self, name):
+        self.name = name
+
+    def read(self):
+        """ Returns (ret, frame), ret is False when no frame is available. """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class AwscamSource(FrameSource):
+    """ The DeepLens camera, through awscam.getLastFrame. """
+
+    def __init__(self, name="deeplens"):
+        super(AwscamSource, self).__init__(name)
+        import awscam
+
+        self.get_last_frame = awscam.getLastFrame
+
+    def read(self):
+        return self.get_last_frame()
+
+
+class StreamSource(FrameSource):
+    """ RTSP or HTTP stream read by a background thread that keeps only the
+        latest frame, so a slow consumer always gets a fresh frame instead of
+        one from the decoder buffer. The stream is reopened when it drops.
+    """
+
+    def __init__(self, name, url, reconnect_delay=2.0, timeout=5.0):
+        """ name - Name of the camera
+            url - Stream url, anything cv2.VideoCapture can open
+            reconnect_delay - Seconds to wait before reopening the stream
+            timeout - Seconds read() waits for a new frame
+        """
+        super(StreamSource, self).__init__(name)
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.timeout = timeout
+        self.frame = None
+        self.version = 0
+        self.read_version = 0
+        self.reconnects = 0
+        self._cond = Condition()
+        self.stop_request = Event()
+        self._thread = Thread(target=self._grab, name="source-" + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _grab(self):
+        while not self.stop_request.isSet():
+            capture = cv2.VideoCapture(self.url)
+            while not self.stop_request.isSet() and capture.isOpened():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                with self._cond:
+                    self.frame = frame
+                    self.version += 1
+                    self._cond.notify_all()
+            capture.release()
+            if not self.stop_request.isSet():
+                self.reconnects += 1
+                self.stop_request.wait(self.reconnect_delay)
+
+    def read(self):
+        """ Waits for a frame newer than the last one read. """
+        with self._cond:
+            if self.version == self.read_version:
+                self._cond.wait(self.timeout)
+            if self.version == self.read_version:
+                return False, None
+            self.read_version = self.version
+            return True, self.frame
+
+    def close(self):
+        self.stop_request.set()
+        self._thread.join(self.timeout)
+
+    def stats(self):
+        return {"reconnects": self.reconnects}
+
+
+class VideoFileSource(FrameSource):
+    """ Video file played at its own frame rate, starting again at the end. """
+
+    def __init__(self, name, path, loop=True, realtime=True):
+        """ name - Name of the camera
+            path - Video file
+            loop - Start again at the end of the file
+            realtime - Pace the frames at the frame rate of the file
+        """
+        super(VideoFileSource, self).__init__(name)
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise Exception("Cannot open video {}".format(path))
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.next_frame = time.time()
+
+    def read(self):
+        if self.realtime and self.frame_interval:
+            delay = self.next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_frame = max(self.next_frame, time.time()) + self.frame_interval
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        return ret, frame
+
+    def close(self):
+        self.capture.release()
+
+
+class ImageFolderSource(FrameSource):
+    """ The images of a folder, shown one after the other in a loop. """
+
+    def __init__(self, name, path, interval=1.0):
+        """ name - Name of the camera
+            path - Folder of images
+            interval - Seconds between two images
+        """
+        super(ImageFolderSource, self).__init__(name)
+        self.paths = sorted(
+            os.path.join(path, entry)
+            for entry in os.listdir(path)
+            if entry.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.paths:
+            raise Exception("No images found in {}".format(path))
+        self.interval = interval
+        self.index = 0
+
+    def read(self):
+        time.sleep(self.interval)
+        frame = cv2.imread(self.paths[self.index % len(self.paths)])
+        self.index += 1
+        return frame is not None, frame
+
+
+def open_source(name, location):
+    """ Opens the source of a location: "awscam" for the DeepLens camera,
+        a stream url, an image folder or a video file.
+    """
+    if location == "awscam":
+        return AwscamSource(name)
+    if "://" in location:
+        return StreamSource(name, location)
+    if os.path.isdir(location):
+        return ImageFolderSource(name, location)
+    return VideoFileSource(name, location)
+
+
+def parse_cameras(spec):
+    """ Splits a comma separated list of name=location entries, e.g.
+        "gate=rtsp://10.0.0.5/live,yard=/data/yard.mp4", into (name,
+        location) pairs. An entry without a name is named after its position.
+    """
+    cameras = []
+    for index, entry in enumerate(part.strip() for part in spec.split(",")):
+        if not entry:
+            continue
+        name, separator, location = entry.partition("=")
+        if not separator or "://" in name:
+            name, location = "camera{}".format(index), entry
+        cameras.append((name.strip(), location.strip()))
+    if not cameras:
+        raise Exception("No frame source configured")
+    return cameras
+
+
+def parse_sources(spec):
+    """ Opens the sources of a camera list, see parse_cameras. """
+    return [open_source(name, location) for name, location in parse_cameras(spec)]
@@ -1,351 +1,456 @@
-# *****************************************************
-#                                                    *
-# Copyright 2018 Amazon.com, Inc. or its affiliates. *
-# All Rights Reserved.                               *
-#                                                    *
-# *****************************************************
-""" A sample lambda for object detection"""
-from threading import Thread, Event
-import os
-import json
-import numpy as np
-import awscam
-import cv2
-import greengrasssdk
-
-# extra imports for rekognition
-# from threading import Thread, Event, Timer
-import mo
-import boto3
-
-# import math
-import io
-
-# from PIL import Image, ImageDraw, ExifTags, ImageColor, ImageFont
-
-
-class LocalDisplay(Thread):
-    """ Class for facilitating the local display of inference results
-        (as images). The class is designed to run on its own thread. In
-        particular the class dumps the inference results into a FIFO 
-        located in the tmp directory (which lambda has access to). The
-        results can be rendered using mplayer by typing:
-        mplayer -demuxer lavf -lavfdopts format=mjpeg:probesize=32 /tmp/results.mjpeg
-    """
-
-    def __init__(self, resolution):
-        """ resolution - Desired resolution of the project stream """
-        # Initialize the base class, so that the object can run on its own
-        # thread.
-        super(LocalDisplay, self).__init__()
-        # List of valid resolutions
-        RESOLUTION = {"1080p": (1920, 1080), "720p": (1280, 720), "480p": (858, 480)}
-        if resolution not in RESOLUTION:
-            raise Exception("Invalid resolution")
-        self.resolution = RESOLUTION[resolution]
-        # Initialize the default image to be a white canvas. Clients
-        # will update the image when ready.
-        self.frame = cv2.imencode(".jpg", 255 * np.ones([640, 480, 3]))[1]
-        self.stop_request = Event()
-
-    def run(self):
-        """ Overridden method that continually dumps images to the desired
-            FIFO file.
-        """
-        # Path to the FIFO file. The lambda only has permissions to the tmp
-        # directory. Pointing to a FIFO file in another directory
-        # will cause the lambda to crash.
-        result_path = "/tmp/results.mjpeg"
-        # Create the FIFO file if it doesn't exist.
-        if not os.path.exists(result_path):
-            os.mkfifo(result_path)
-        # This call will block until a consumer is available
-        with open(result_path, "w") as fifo_file:
-            while not self.stop_request.isSet():
-                try:
-                    # Write the data to the FIFO file. This call will block
-                    # meaning the code will come to a halt here until a consumer
-                    # is available.
-                    fifo_file.write(self.frame.tobytes())
-                except IOError:
-                    continue
-
-    def set_frame_data(self, frame):
-        """ Method updates the image data. This currently encodes the
-            numpy array to jpg but can be modified to support other encodings.
-            frame - Numpy array containing the image data of the next frame
-                    in the project stream.
-        """
-        ret, jpeg = cv2.imencode(".jpg", cv2.resize(frame, self.resolution))
-        if not ret:
-            raise Exception("Failed to set frame data")
-        self.frame = jpeg
-
-    def join(self):
-        self.stop_request.set()
-
-
-def infinite_infer_run():
-    """ Entry point of the lambda function"""
-    try:
-        # This object detection model is implemented as single shot detector (ssd), since
-        # the number of labels is small we create a dictionary that will help us convert
-        # the machine labels to human readable labels.
-        model_type = "ssd"
-        output_map = {
-            1: "aeroplane",
-            2: "bicycle",
-            3: "bird",
-            4: "boat",
-            5: "bottle",
-            6: "bus",
-            7: "car",
-            8: "cat",
-            9: "chair",
-            10: "cow",
-            11: "dinning table",
-            12: "dog",
-            13: "horse",
-            14: "motorbike",
-            15: "person",
-            16: "pottedplant",
-            17: "sheep",
-            18: "sofa",
-            19: "train",
-            20: "tvmonitor",
-        }
-        # Create an IoT client for sending to messages to the cloud.
-        client = greengrasssdk.client("iot-data")
-        iot_topic = "$aws/things/{}/infer".format(os.environ["AWS_IOT_THING_NAME"])
-        # Create a local display instance that will dump the image bytes to a FIFO
-        # file that the image can be rendered locally.
-        local_display = LocalDisplay("480p")
-        local_display.start()
-        # The sample projects come with optimized artifacts, hence only the artifact
-        # path is required.
-        model_path = (
-            "/opt/awscam/artifacts/mxnet_deploy_ssd_resnet50_300_FP16_FUSED.xml"
-        )
-        # Load the model onto the GPU.
-        client.publish(topic=iot_topic, payload="Loading object detection model")
-        model = awscam.Model(model_path, {"GPU": 1})
-        client.publish(topic=iot_topic, payload="Object detection model loaded")
-        # Set the threshold for detection
-        detection_threshold = 0.25
-        # The height and width of the training set images
-        input_height = 300
-        input_width = 300
-
-        """extra part of code for rekognition"""
-
-        # model trained in us east 2
-        # projectVersionArn = "arn:aws:rekognition:us-east-2:510335724440:project/PPE_detection_May_2020/version/PPE_detection_May_2020.2020-06-01T23.33.22/1591025603184"
-        # model trained in us east 1, version 1
-        # projectVersionArn = "arn:aws:rekognition:us-east-1:510335724440:project/ppe-detection-deeplens/version/ppe-detection-deeplens.2020-06-12T14.25.57/1591943158364"
-        # model trained in us east 1, version 2
-        projectVersionArn = "arn:aws:rekognition:us-east-1:510335724440:project/ppe-detection-deeplens/version/ppe-detection-deeplens.2020-06-17T14.28.47/1592375328862"
-
-        rekognition = boto3.client("rekognition")
-        customLabels = []
-
-        s3 = boto3.client("s3")
-
-        iterator = 0
-        """extra part of code for rekognition"""
-        # Do inference until the lambda is killed.
-        while True:
-            # Get a frame from the video stream
-            ret, frame = awscam.getLastFrame()
-            if not ret:
-                raise Exception("Failed to get frame from the stream")
-            # Resize frame to the same size as the training set.
-            frame_resize = cv2.resize(frame, (input_height, input_width))
-            # Run the images through the inference engine and parse the results using
-            # the parser API, note it is possible to get the output of doInference
-            # and do the parsing manually, but since it is a ssd model,
-            # a simple API is provided.
-            parsed_inference_results = model.parseResult(
-                model_type, model.doInference(frame_resize)
-            )
-            # Compute the scale in order to draw bounding boxes on the full resolution
-            # image.
-            yscale = float(frame.shape[0]) / float(input_height)
-            xscale = float(frame.shape[1]) / float(input_width)
-            # Dictionary to be filled with labels and probabilities for MQTT
-            cloud_output = {}
-            # Get the detected objects and probabilities
-            # for obj in parsed_inference_results[model_type]:
-            #     if obj["prob"] > detection_threshold:
-            #         # Add bounding boxes to full resolution frame
-            #         xmin = int(xscale * obj["xmin"])
-            #         ymin = int(yscale * obj["ymin"])
-            #         xmax = int(xscale * obj["xmax"])
-            #         ymax = int(yscale * obj["ymax"])
-            #         # See https://docs.opencv.org/3.4.1/d6/d6e/group__imgproc__draw.html
-            #         # for more information about the cv2.rectangle method.
-            #         # Method signature: image, point1, point2, color, and tickness.
-
-            #         # comment out the drawing part to avoid the results of two models all on one frame
-            #         cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 165, 20), 10)
-            #         # Amount to offset the label/probability text above the bounding box.
-            #         text_offset = 15
-            #         # See https://docs.opencv.org/3.4.1/d6/d6e/group__imgproc__draw.html
-            #         # for more information about the cv2.putText method.
-            #         # Method signature: image, text, origin, font face, font scale, color,
-            #         # and tickness
-            #         cv2.putText(
-            #             frame,
-            #             "{}: {:.2f}%".format(
-            #                 output_map[obj["label"]], obj["prob"] * 100
-            #             ),
-            #             (xmin, ymin - text_offset),
-            #             cv2.FONT_HERSHEY_SIMPLEX,
-            #             2.5,
-            #             (255, 165, 20),
-            #             6,
-            #         )
-            #         # Store label and probability to send to cloud
-            #         cloud_output[output_map[obj["label"]]] = obj["prob"]
-            # # Set the next frame in the local display stream.
-            # local_display.set_frame_data(frame)
-            # # Send results to the cloud
-            # client.publish(topic=iot_topic, payload=json.dumps(cloud_output))
-
-            """extra part of code for rekognition"""
-            hasFrame, imageBytes = cv2.imencode(".jpg", frame)
-            client.publish(topic=iot_topic, payload="import done")
-            if hasFrame:
-                response = rekognition.detect_custom_labels(
-                    Image={"Bytes": imageBytes.tobytes(),},
-                    ProjectVersionArn=projectVersionArn,
-                )
-            client.publish(topic=iot_topic, payload="analyse done")                    
-
-            # image = Img.fromarray(frame)
-            # imgWidth, imgHeight = image.size
-            # draw = ImageDraw.Draw(image)
-            imgHeight, imgWidth, c = frame.shape
-            image = frame
-
-            ppe = 0
-            person = 0
-
-            for elabel in response["CustomLabels"]:
-                # elabel["Timestamp"] = (frameId/frameRate)*1000
-                customLabels.append(elabel)
-
-                print("Label " + str(elabel["Name"]))
-                print("Confidence " + str(elabel["Confidence"]))
-                
-                if str(elabel["Name"]) == "PPE":
-                    ppe = ppe + 1
-                else if str(elabel["Name"]) == "person"
-                    person = person + 1
-                
-                if "Geometry" in elabel:
-                    box = elabel["Geometry"]["BoundingBox"]
-                    left = imgWidth * box["Left"]
-                    top = imgHeight * box["Top"]
-                    width = imgWidth * box["Width"]
-                    height = imgHeight * box["Height"]
-                    
-                    if str(elabel["Name"]) == "person":
-                        cv2.putText(
-                            image,
-                            elabel["Name"],
-                            (int(left), int(top)),
-                            cv2.FONT_HERSHEY_COMPLEX,
-                            1,
-                            (0, 255, 0),
-                            1,
-                        )
-                    else:
-                        cv2.putText(
-                            image,
-                            elabel["Name"],
-                            (int(left), int(top)),
-                            cv2.FONT_HERSHEY_COMPLEX,
-                            1,
-                            (255, 0, 0),
-                            1,
-                        )
-
-                    print("Left: " + "{0:.0f}".format(left))
-                    print("Top: " + "{0:.0f}".format(top))
-                    print("Label Width: " + "{0:.0f}".format(width))
-                    print("Label Height: " + "{0:.0f}".format(height))
-
-                    # points = (
-                    #     (left, top),
-                    #     (left + width, top),
-                    #     (left + width, top + height),
-                    #     (left, top + height),
-                    #     (left, top),
-                    # )
-                    # if str(elabel["Name"]) == "person":
-                    #     draw.line(points, fill="#00d400", width=3)
-                    # else:
-                    #     draw.line(points, fill="#800000", width=3)
-                    if str(elabel["Name"]) == "person":
-                        cv2.rectangle(
-                            image,
-                            (int(left), int(top)),
-                            (int(left + width), int(top + height)),
-                            (0, 255, 0),
-                            2,
-                        )
-                    else:
-                        cv2.rectangle(
-                            image,
-                            (int(left), int(top)),
-                            (int(left + width), int(top + height)),
-                            (255, 0, 0),
-                            2,
-                        )
-            # save the image locally and then upload them into s3
-            client.publish(topic=iot_topic, payload="drawing done")
-            # cv2.imwrite("frame" + format(iterator) + ".jpg", image)
-            # image.save("frame" + format(iterator) + ".jpg")
-            # dont save it to the disk anymore
-            #client.publish(topic=iot_topic, payload="image saving done")
-            iterator = iterator + 1
-
-            # upload as bytes
-            # imageBytes = image.tobytes()
-            # with io.BytesIO(imageBytes) as f:
-            #     s3.upload_fileobj(
-            #         f,
-            #         "custom-labels-console-us-east-1-5e4c514f5b",
-            #         "frameID: " + format(iterator) + ".jpg",
-            #     )
-
-            # write the metadata
-            # metadata = {"NumberOfPersons": str(person), "NumberOfPPEs": str(ppe)}
-            
-            # upload as string
-            img_str = cv2.imencode('.jpg', image)[1].tostring()
-            s3.put_object(
-                Bucket="custom-labels-console-us-east-1-5e4c514f5b",
-                Key="frameID: " + format(iterator) + ".jpg",
-                Body=img_str,
-                ACL="public-read",
-                Metadata={"NumberOfPersons": str(person), "NumberOfPPEs": str(ppe)}
-            )
-            client.publish(topic=iot_topic, payload="send to s3 done")
-
-            # to retrieve meatadata in s3
-            # $ aws s3api head-object --bucket custom-labels-console-us-east-1-5e4c514f5b --key testImage.jpg
-
-            # print(customLabels)
-
-            """extra part of code for rekognition"""
-
-        # cap.release() not sure if we need to keep this
-
-    except Exception as ex:
-        client.publish(
-            topic=iot_topic, payload="Error in object detection lambda: {}".format(ex)
-        )
-
-
-infinite_infer_run()
+# *****************************************************
+#                                                    *
+# Copyright 2018 Amazon.com, Inc. or its affiliates. *
+# All Rights Reserved.                               *
+#                                                    *
+# *****************************************************
+""" A sample lambda for object detection"""
+import time
+
+# Start of the cold start, taken before the slow imports
+START_TIME = time.time()
+
+import os
+import awscam
+import greengrasssdk
+
+# extra imports for rekognition
+# from threading import Thread, Event, Timer
+from pipeline import Pipeline
+from stages import DetectionStages
+from person_gate import PersonGate
+from label_cache import LabelCache
+from frame_encoder import FrameEncoder
+from local_display import LocalDisplay
+from s3_uploader import S3Uploader
+from manifest import LatestManifest
+from annotator import Annotator
+from detection_history import DetectionHistory
+from metrics import Metrics, MetricsReporter, FrameProfiler
+from iot_publisher import IoTPublisher
+from tracker import PersonTracker
+from manifest import DangerIndex
+from scheduler import CallScheduler
+from frame_sources import parse_cameras, parse_sources
+from fan_in import RekognitionPool, SharedModel, Camera, CameraSet
+from startup import ColdStart, warm_up_rekognition, warm_up_s3
+from fallback import CircuitBreaker, LocalPPEDetector
+from motion import MotionDetector
+from stream_server import StreamServer
+from archive import SegmentArchiver, run_id
+
+# import math
+
+# from PIL import Image, ImageDraw, ExifTags, ImageColor, ImageFont
+
+
+def infinite_infer_run():
+    """ Entry point of the lambda function"""
+    try:
+        # Creating the AWS clients and loading the model run side by side,
+        # the time of every step since START_TIME is reported.
+        startup = ColdStart(started=START_TIME)
+        startup.mark("imports")
+        # This object detection model is implemented as single shot detector (ssd). Only
+        # its person class is used, detections.SSD_LABELS names it.
+        model_type = "ssd"
+        # Create an IoT client for sending to messages to the cloud.
+        client = greengrasssdk.client("iot-data")
+        iot_topic = "$aws/things/{}/infer".format(os.environ["AWS_IOT_THING_NAME"])
+        # model trained in us east 2
+        # projectVersionArn = "arn:aws:rekognition:us-east-2:510335724440:project/PPE_detection_May_2020/version/PPE_detection_May_2020.2020-06-01T23.33.22/1591025603184"
+        # model trained in us east 1, version 1
+        # projectVersionArn = "arn:aws:rekognition:us-east-1:510335724440:project/ppe-detection-deeplens/version/ppe-detection-deeplens.2020-06-12T14.25.57/1591943158364"
+        # model trained in us east 1, version 2
+        projectVersionArn = os.environ.get(
+            "PROJECT_VERSION_ARN",
+            "arn:aws:rekognition:us-east-1:510335724440:project/ppe-detection-deeplens/version/ppe-detection-deeplens.2020-06-17T14.28.47/1592375328862",
+        )
+
+        # The cameras share one rekognition client with at most
+        # REKOGNITION_WORKERS requests in flight, the annotated frames are
+        # uploaded by S3_UPLOAD_WORKERS threads sharing one client.
+        rekognition_workers = int(os.environ.get("REKOGNITION_WORKERS", "4"))
+        upload_workers = int(os.environ.get("S3_UPLOAD_WORKERS", "4"))
+        bucket = "custom-labels-console-us-east-1-5e4c514f5b"
+
+        # Cameras served by this process, as name=location entries where the
+        # location is awscam, a stream url, a video file or an image folder,
+        # e.g. "gate=rtsp://10.0.0.5/live,yard=/data/yard.mp4".
+        camera_spec = os.environ.get("CAMERAS", "deeplens=awscam")
+        # With FRAME_RING the frames are grabbed by one process per camera
+        # and handed over through a shared memory ring of FRAME_RING_SLOTS
+        # frames, so capture never waits for the detection loop. They are
+        # forked here, before the first thread of the lambda starts.
+        captures = []
+        if os.environ.get("FRAME_RING", "false").lower() == "true":
+            slots = int(os.environ.get("FRAME_RING_SLOTS", "8"))
+            from frame_ring import CaptureProcess, RingSource
+
+            sources = []
+            for name, location in parse_cameras(camera_spec):
+                capture = CaptureProcess(name, location, slots=slots)
+                capture.start()
+                captures.append(capture)
+                sources.append(RingSource(name, capture.ring))
+        else:
+            sources = parse_sources(camera_spec)
+
+        def create_clients():
+            # boto3 takes a while to import, importing it here overlaps the
+            # import with the model load.
+            import boto3
+            from botocore.config import Config
+
+            # A call hanging for REKOGNITION_TIMEOUT seconds fails, so the
+            # breaker switches to the local detector instead of waiting.
+            rekognition = boto3.client(
+                "rekognition",
+                config=Config(
+                    max_pool_connections=rekognition_workers,
+                    connect_timeout=float(os.environ.get("REKOGNITION_TIMEOUT", "5")),
+                    read_timeout=float(os.environ.get("REKOGNITION_TIMEOUT", "5")),
+                ),
+            )
+            s3 = boto3.client(
+                "s3",
+                endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+                config=Config(max_pool_connections=upload_workers),
+            )
+            # Open the connections while the model is still loading
+            startup.background("warm_up_rekognition", warm_up_rekognition, rekognition)
+            startup.background("warm_up_s3", warm_up_s3, s3, bucket)
+            return rekognition, s3
+
+        clients = startup.background("clients", create_clients)
+        # Create a local display instance that will dump the image bytes to a FIFO
+        # file that the image can be rendered locally.
+        local_display = LocalDisplay("480p")
+        local_display.start()
+        # Serve the annotated stream (/stream.mjpeg), the results as
+        # server-sent events (/events) and the latest frame (/snapshot.jpg)
+        # on STREAM_PORT to any number of viewers, 0 disables the server.
+        # The server has no authentication: it listens on localhost unless
+        # STREAM_HOST is set (0.0.0.0 for the whole network), and only the
+        # dashboard origin in STREAM_ALLOW_ORIGIN may read it from a browser.
+        stream = None
+        stream_port = int(os.environ.get("STREAM_PORT", "8080"))
+        if stream_port:
+            stream = StreamServer(
+                host=os.environ.get("STREAM_HOST", "127.0.0.1"),
+                port=stream_port,
+                allow_origin=os.environ.get("STREAM_ALLOW_ORIGIN") or None,
+                max_fps=float(os.environ.get("STREAM_MAX_FPS", "15")),
+            )
+            stream.start()
+        # The sample projects come with optimized artifacts, hence only the artifact
+        # path is required.
+        model_path = (
+            "/opt/awscam/artifacts/mxnet_deploy_ssd_resnet50_300_FP16_FUSED.xml"
+        )
+        # Load the model onto the GPU.
+        client.publish(topic=iot_topic, payload="Loading object detection model")
+        model = startup.run("model", awscam.Model, model_path, {"GPU": 1})
+        client.publish(topic=iot_topic, payload="Object detection model loaded")
+        # Set the threshold for detection
+        detection_threshold = 0.25
+        # The height and width of the training set images
+        input_height = 300
+        input_width = 300
+
+        """extra part of code for rekognition"""
+
+        multi_camera = len(sources) > 1
+        rekognition, s3 = clients.result()
+        rekognition_pool = RekognitionPool(rekognition, workers=rekognition_workers)
+        rekognition_pool.start()
+        # Upload the annotated frames in the background, spooling them
+        # under /tmp while the uplink is down.
+        uploader = S3Uploader(
+            s3,
+            bucket,
+            workers=upload_workers,
+            spool_bytes=int(os.environ.get("S3_SPOOL_BYTES", str(256 * 1024 * 1024))),
+        )
+        uploader.start()
+        """extra part of code for rekognition"""
+
+        # The on-device model runs one inference at a time for all cameras
+        if multi_camera:
+            model = SharedModel(model)
+        # Capacity of the queues between two stages and what to do when
+        # a queue is full. Dropping the oldest frame keeps the slow stages
+        # working on the freshest frame instead of a growing backlog.
+        queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", "1"))
+        drop_oldest = os.environ.get("PIPELINE_DROP_OLDEST", "true").lower() == "true"
+        # How often the stage timings, queue depths and drop counts are
+        # published, as one message per interval.
+        metrics_interval = float(
+            os.environ.get(
+                "METRICS_INTERVAL", os.environ.get("PIPELINE_STATS_INTERVAL", "30")
+            )
+        )
+        # Messages are sent from a background thread at no more than
+        # IOT_MAX_RATE messages per second, newer detection results replace
+        # the ones still waiting.
+        publisher = IoTPublisher(
+            client,
+            iot_topic,
+            max_rate=float(os.environ.get("IOT_MAX_RATE", "2")),
+            burst=int(os.environ.get("IOT_BURST", "5")),
+        )
+        publisher.start()
+        # Profile the stages for this many frames and write the reports to
+        # /tmp, 0 disables profiling. PROFILE_STAGE limits the profile to one
+        # stage, the stages take turns by default.
+        profiler = None
+        profile_frames = int(os.environ.get("PROFILE_FRAMES", "0"))
+        if profile_frames > 0:
+            profiler = FrameProfiler(
+                profile_frames, stage=os.environ.get("PROFILE_STAGE") or None
+            )
+        # Downscale the frames sent to rekognition and keep their JPEG size
+        # within a byte budget, leave empty to disable.
+        analysis_width = os.environ.get("ANALYSIS_WIDTH", "1280")
+        byte_budget = os.environ.get("ANALYSIS_BYTE_BUDGET", "")
+        # A person is compliant when a PPE box lies mostly inside their box.
+        min_containment = float(os.environ.get("PPE_MIN_CONTAINMENT", "0.5"))
+        # When BREAKER_FAILURES rekognition calls fail in a row, or
+        # BREAKER_SLOW_CALLS take longer than BREAKER_LATENCY seconds, the
+        # frames are analysed on the device for BREAKER_RESET seconds
+        # before rekognition is tried again. Shared by the cameras.
+        fallback = breaker = None
+        if os.environ.get("LOCAL_FALLBACK", "true").lower() == "true":
+            fallback = LocalPPEDetector()
+            breaker = CircuitBreaker(
+                failures=int(os.environ.get("BREAKER_FAILURES", "3")),
+                slow_calls=int(os.environ.get("BREAKER_SLOW_CALLS", "3")),
+                latency_threshold=float(os.environ.get("BREAKER_LATENCY", "3")),
+                reset_timeout=float(os.environ.get("BREAKER_RESET", "30")),
+            )
+
+        # Record the annotated frames in segments of ARCHIVE_SECONDS with a
+        # detection index, 0 disables the archive. The dashboard polls
+        # latest.json, pointing to latest.jpg, replaced every
+        # LATEST_INTERVAL seconds. FRAME_UPLOADS=true uploads every frame
+        # as its own object instead, keyed by the run of the lambda.
+        archive_seconds = float(os.environ.get("ARCHIVE_SECONDS", "60"))
+        archive_bytes = int(os.environ.get("ARCHIVE_MAX_BYTES", str(16 * 1024 * 1024)))
+        frame_uploads = os.environ.get("FRAME_UPLOADS", "false").lower() == "true"
+        latest_interval = float(os.environ.get("LATEST_INTERVAL", "5"))
+        archive_run = run_id()
+
+        def build_camera(source, display):
+            """ Creates the stages and pipeline of one camera. Everything
+                holding per camera state is created here, the clients and
+                the model are shared.
+            """
+            camera = source.name if multi_camera else None
+            prefix = camera + "/" if camera else ""
+            metrics = Metrics()
+            # Only call rekognition when the on-device SSD model sees a person
+            person_gate = None
+            if os.environ.get("GATE_ON_PERSON", "true").lower() == "true":
+                person_gate = PersonGate(detection_threshold)
+            # Reuse the last rekognition result while the scene does not change
+            label_cache = None
+            if os.environ.get("LABEL_CACHE", "true").lower() == "true":
+                label_cache = LabelCache(
+                    max_entries=int(os.environ.get("LABEL_CACHE_ENTRIES", "16")),
+                    ttl=float(os.environ.get("LABEL_CACHE_TTL", "10")),
+                    max_distance=int(os.environ.get("LABEL_CACHE_DISTANCE", "4")),
+                )
+            encoder = FrameEncoder(
+                analysis_width=int(analysis_width) if analysis_width else None,
+                byte_budget=int(byte_budget) if byte_budget else None,
+            )
+            # Print every detected label to stdout when ANNOTATE_QUIET is false
+            annotator = Annotator(
+                quiet=os.environ.get("ANNOTATE_QUIET", "true").lower() == "true"
+            )
+            # Fixed size history of the detections with rolling aggregates
+            history = DetectionHistory(
+                capacity=int(os.environ.get("HISTORY_CAPACITY", "10000")),
+                window=float(os.environ.get("HISTORY_WINDOW", "60")),
+            )
+            # Send only the padded person crops, packed into one mosaic image
+            mosaic = None
+            if os.environ.get("PERSON_MOSAIC", "false").lower() == "true":
+                from mosaic import MosaicBuilder
+
+                mosaic = MosaicBuilder(
+                    padding=float(os.environ.get("PERSON_MOSAIC_PADDING", "0.15"))
+                )
+            # Follow the SSD persons across frames and only ask rekognition
+            # about new persons, persons that moved or labels older than
+            # TRACK_TTL.
+            tracker = None
+            if os.environ.get("TRACK_PERSONS", "true").lower() == "true":
+                tracker = PersonTracker(
+                    iou_threshold=float(os.environ.get("TRACK_IOU", "0.3")),
+                    max_misses=int(os.environ.get("TRACK_MAX_MISSES", "5")),
+                    refresh_iou=float(os.environ.get("TRACK_REFRESH_IOU", "0.5")),
+                    ttl=float(os.environ.get("TRACK_TTL", "10")),
+                )
+            # Frames where nothing moved since the last analysed frame
+            # reuse its result, for at most MOTION_MAX_REUSE_AGE seconds and
+            # MOTION_MAX_REUSE_FRAMES frames; with PERSON_MOSAIC only the
+            # persons in a moving region are sent again.
+            motion = None
+            if os.environ.get("MOTION_REGIONS", "true").lower() == "true":
+                motion = MotionDetector(
+                    width=int(os.environ.get("MOTION_WIDTH", "320")),
+                    threshold=int(os.environ.get("MOTION_THRESHOLD", "25")),
+                    min_area=float(os.environ.get("MOTION_MIN_AREA", "0.001")),
+                    max_reuse_age=float(os.environ.get("MOTION_MAX_REUSE_AGE", "30")),
+                    max_reuse_frames=int(os.environ.get("MOTION_MAX_REUSE_FRAMES", "100")),
+                )
+            # The danger alert is raised after DANGER_ALERT_AFTER frames with
+            # a non compliant person and cleared after DANGER_CLEAR_AFTER
+            # compliant frames.
+            danger_index = DangerIndex(
+                alert_after=int(os.environ.get("DANGER_ALERT_AFTER", "3")),
+                clear_after=int(os.environ.get("DANGER_CLEAR_AFTER", "2")),
+            )
+            # Rekognition calls stay within REKOGNITION_BUDGET calls per
+            # minute, shared by the cameras, one every ACTIVE_INTERVAL seconds
+            # while people are in view and one every IDLE_INTERVAL seconds
+            # otherwise. Throttled and failed calls are retried with backoff.
+            scheduler = CallScheduler(
+                budget_per_minute=max(
+                    1, int(os.environ.get("REKOGNITION_BUDGET", "60")) // len(sources)
+                ),
+                active_interval=float(os.environ.get("ACTIVE_INTERVAL", "1")),
+                idle_interval=float(os.environ.get("IDLE_INTERVAL", "5")),
+                target_latency=float(
+                    os.environ.get("REKOGNITION_TARGET_LATENCY", "1")
+                ),
+                retries=int(os.environ.get("REKOGNITION_RETRIES", "3")),
+            )
+
+            stages = DetectionStages(
+                source.read,
+                model,
+                rekognition_pool.client_for(source.name),
+                uploader,
+                client,
+                iot_topic,
+                display,
+                projectVersionArn,
+                model_type=model_type,
+                input_height=input_height,
+                input_width=input_width,
+                detection_threshold=detection_threshold,
+                person_gate=person_gate,
+                label_cache=label_cache,
+                mosaic=mosaic,
+                encoder=encoder,
+                # Small json file describing the latest frame, polled by the
+                # dashboard
+                manifest=LatestManifest(uploader, key=prefix + "latest.json"),
+                annotator=annotator,
+                history=history,
+                metrics=metrics,
+                publisher=publisher,
+                tracker=tracker,
+                danger_index=danger_index,
+                min_containment=min_containment,
+                scheduler=scheduler,
+                camera=camera,
+                startup=startup,
+                fallback=fallback,
+                breaker=breaker,
+                motion=motion,
+                stream=stream,
+                archive=SegmentArchiver(
+                    uploader,
+                    prefix=prefix + "archive/",
+                    segment_seconds=archive_seconds,
+                    max_bytes=archive_bytes,
+                    run=archive_run,
+                )
+                if archive_seconds > 0
+                else None,
+                frame_uploads=frame_uploads,
+                latest_interval=latest_interval,
+                run=archive_run,
+            )
+
+            def report_error(stage_name, ex):
+                # A failing stage repeats its error on every frame, only the
+                # latest one per stage is kept while waiting to be sent.
+                publisher.publish(
+                    "Error in {}{} stage: {}".format(prefix, stage_name, ex),
+                    key="error:" + prefix + stage_name,
+                )
+
+            # Capture, local inference, rekognition, annotation and upload
+            # each run on their own thread so capture never waits on the
+            # network.
+            pipeline = Pipeline(
+                stages.stage_list(),
+                queue_size=queue_size,
+                drop_oldest=drop_oldest,
+                on_error=report_error,
+                metrics=metrics,
+                profiler=profiler,
+            )
+            return Camera(source, stages, pipeline, metrics)
+
+        # Only the first camera is shown on the local display
+        cameras = CameraSet(
+            [
+                build_camera(source, local_display if index == 0 else None)
+                for index, source in enumerate(sources)
+            ]
+        )
+
+        def component_stats():
+            stats = {
+                "cameras": cameras.stats(),
+                "rekognition_pool": rekognition_pool.stats(),
+                "uploader": uploader.stats(),
+                "publisher": publisher.stats(),
+                "local_display": local_display.stats(),
+                "startup": startup.stats(),
+            }
+            if stream is not None:
+                stats["stream"] = stream.stats()
+            if fallback is not None:
+                stats["fallback"] = fallback.stats()
+                stats["breaker"] = breaker.stats()
+            return stats
+
+        reporter = MetricsReporter(
+            Metrics(),
+            lambda payload: publisher.publish(payload, key="metrics"),
+            interval=metrics_interval,
+            extra=component_stats,
+        )
+        cameras.start()
+        reporter.start()
+        # Do inference until the lambda is killed.
+        while cameras.is_alive():
+            time.sleep(1)
+        reporter.join()
+        cameras.join()
+        for capture in captures:
+            capture.join()
+        rekognition_pool.join()
+        publisher.join()
+        if stream is not None:
+            stream.join(1.0)
+        startup.close()
+
+    except Exception as ex:
+        client.publish(
+            topic=iot_topic, payload="Error in object detection lambda: {}".format(ex)
+        )
+
+
+# Greengrass imports this module and runs the loop at import time. A capture
+# process started with spawn (see frame_ring.CaptureProcess) imports the main
+# module of its parent again, as __mp_main__: when this file is run as a
+# script, that import must not start a second detection loop.
+if __name__ != "__mp_main__":
+    infinite_infer_run()
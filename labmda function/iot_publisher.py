@@ -0,0 +1,209 @@
+""" Background publisher for the IoT messages of the detection loop.
+    Messages are queued by the stages and sent by a separate thread at a
+    limited rate, so a slow MQTT round trip never holds up inference.
+    Messages published under the same key replace each other while they
+    wait, so only the latest state is sent when the rate limit is reached.
+"""
+from threading import Thread, Event, Condition
+from collections import OrderedDict
+import json
+import time
+import numpy as np
+from detections import as_detections
+
+# Key of the detection result message, a newer frame supersedes the
+# result of an older one that is still waiting.
+RESULT_KEY = "result"
+
+
+def result_key(camera=None):
+    """ Key of the detection results of a camera. """
+    return RESULT_KEY if camera is None else "{}:{}".format(RESULT_KEY, camera)
+
+
+def compact_labels(labels):
+    """ Rekognition custom labels as [name, confidence, left, top, width,
+        height] lists, with the box relative to the frame size. Labels
+        without a box are left out.
+        labels - Detections or CustomLabels list
+    """
+    detections = as_detections(labels)
+    # Rounded as arrays, round() per value costs more than the rest
+    confidences = np.round(detections.confidences.astype(np.float64), 1).tolist()
+    boxes = np.round(detections.boxes.astype(np.float64), 3).tolist()
+    return [
+        [name, confidence] + box
+        for name, confidence, box in zip(detections.names(), confidences, boxes)
+        # NaN, no box
+        if box[0] == box[0]
+    ]
+
+
+def result_payload(
+    frame_id,
+    timestamp,
+    labels,
+    persons,
+    ppes,
+    danger_index=None,
+    tracks=None,
+    alert=None,
+    association=None,
+    camera=None,
+    source=None,
+):
+    """ Compact json payload with the counts and labels of one frame, see
+        compact_labels for the label format.
+        frame_id - Id of the frame
+        timestamp - Capture time of the frame
+        labels - Detections or Rekognition custom labels of the frame
+        persons, ppes - Number of persons and PPEs found
+        danger_index - Optional current danger index
+        tracks - Optional person tracks of the frame, sent as [id, xmin,
+                 ymin, xmax, ymax] lists in pixels
+        alert - Optional state of the debounced danger alert
+        association - Optional result of association.associate, sent as the
+                      number of violations and a [ppe count, compliant] pair
+                      per person
+        camera - Optional name of the camera the frame comes from
+        source - Optional source of the labels, rekognition or local
+    """
+    payload = {
+        "type": "result",
+        "frame": frame_id,
+        "ts": round(timestamp, 3),
+        "persons": persons,
+        "ppes": ppes,
+        "labels": compact_labels(labels),
+    }
+    if danger_index is not None:
+        payload["danger"] = danger_index
+    if camera is not None:
+        payload["camera"] = camera
+    if source is not None:
+        payload["source"] = source
+    if alert is not None:
+        payload["alert"] = alert
+    if association is not None:
+        payload["violations"] = association["violations"]
+        payload["people"] = [
+            [person["ppe"], int(person["compliant"])]
+            for person in association["persons"]
+        ]
+    if tracks is not None:
+        payload["tracks"] = [
+            [track.track_id] + [int(round(value)) for value in track.box]
+            for track in tracks
+        ]
+    return json.dumps(payload, separators=(",", ":"))
+
+
+class IoTPublisher(Thread):
+    """ Rate limited, coalescing publisher in front of the Greengrass IoT
+        data client. publish() never blocks; messages are sent in order by
+        the publisher thread, at most max_rate per second with bursts of up
+        to burst messages.
+    """
+
+    def __init__(self, client, topic, max_rate=2.0, burst=5, max_queue=64):
+        """ client - Greengrass IoT data client
+            topic - Topic the messages are published to
+            max_rate - Maximum number of messages per second
+            burst - Number of messages that can be sent back to back after a
+                    quiet period
+            max_queue - Maximum number of waiting messages, the oldest one
+                        is dropped when the queue is full
+        """
+        if max_rate <= 0:
+            raise Exception("The publish rate must be positive")
+        super(IoTPublisher, self).__init__(name="iot-publisher")
+        self.daemon = True
+        self.client = client
+        self.topic = topic
+        self.max_rate = float(max_rate)
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.stop_request = Event()
+        self.published = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = OrderedDict()
+        self._sequence = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.time()
+        self._cond = Condition()
+
+    def publish(self, payload, key=None):
+        """ Queues a message. A message with a key replaces the waiting
+            message with the same key, keeping its place in the queue.
+            payload - String payload
+            key - Optional key of the state the message describes
+        """
+        with self._cond:
+            if key is not None and key in self._pending:
+                self._pending[key] = payload
+                self.merged += 1
+                return
+            if key is None:
+                self._sequence += 1
+                key = self._sequence
+            if len(self._pending) >= self.max_queue:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[key] = payload
+            self._cond.notify()
+
+    def _take_token(self):
+        """ Returns how long to wait before the next message may be sent,
+            taking a token when it can be sent right away.
+        """
+        now = time.time()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled) * self.max_rate
+        )
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.max_rate
+
+    def run(self):
+        """ Overridden method sending the queued messages until stopped. """
+        while not self.stop_request.isSet():
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(0.5)
+                    continue
+            wait = self._take_token()
+            if wait:
+                # Messages published meanwhile are merged into the queue
+                self.stop_request.wait(wait)
+                continue
+            with self._cond:
+                if not self._pending:
+                    continue
+                _, payload = self._pending.popitem(last=False)
+            try:
+                self.client.publish(topic=self.topic, payload=payload)
+                self.published += 1
+            except Exception as ex:
+                self.failed += 1
+                print("Failed to publish to {}: {}".format(self.topic, ex))
+
+    def join(self, timeout=None):
+        self.stop_request.set()
+        with self._cond:
+            self._cond.notify()
+        super(IoTPublisher, self).join(timeout)
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "published": self.published,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": queued,
+        }
@@ -0,0 +1,103 @@
+""" Response cache for Rekognition custom labels, keyed on a perceptual hash
+    of the frame so that an unchanged scene reuses the previous result
+    instead of paying for another round trip.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+import cv2
+import numpy as np
+
+
+def frame_signature(frame, hash_size=8):
+    """ Computes a difference hash (dHash) of the frame: the frame is
+        reduced to a tiny grayscale thumbnail and every bit tells whether a
+        pixel is brighter than its right neighbour. Similar frames produce
+        hashes that differ in only a few bits.
+        frame - BGR numpy array
+        hash_size - Side of the hash grid, the hash has hash_size**2 bits
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class LabelCache(object):
+    """ Bounded LRU cache of detect_custom_labels responses. A lookup hits
+        when a stored signature is within max_distance bits of the frame's
+        signature and the entry is younger than ttl seconds.
+    """
+
+    def __init__(self, max_entries=16, ttl=10.0, max_distance=4, hash_size=8):
+        """ max_entries - Number of responses kept before the least recently
+                          used one is evicted
+            ttl - Maximum age in seconds of a response that may be served
+            max_distance - Hamming distance tolerated between two signatures
+            hash_size - Side of the hash grid, see frame_signature
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_age = None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def signature(self, frame):
+        return frame_signature(frame, self.hash_size)
+
+    def lookup(self, signature, now=None):
+        """ Returns the cached response closest to the signature, or None.
+            Expired entries met along the way are evicted.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            best_key = None
+            best_distance = self.max_distance + 1
+            for key, (stored, _) in list(self._entries.items()):
+                if now - stored > self.ttl:
+                    del self._entries[key]
+                    self.evictions += 1
+                    continue
+                distance = hamming_distance(key, signature)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            stored, response = self._entries[best_key]
+            self.hits += 1
+            self.last_age = now - stored
+            return response
+
+    def store(self, signature, response, now=None):
+        """ Caches a response under the signature of the frame it belongs to. """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[signature] = (now, response)
+            self._entries.move_to_end(signature)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """ Returns hit rate, age of the last served response and evictions. """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0,
+                "last_age": self.last_age,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,193 @@
+""" Local display of the annotated frames on the DeepLens: a thread writing
+    the latest frame as MJPEG to a FIFO in /tmp, shown with mplayer. Shared
+    by the lambda function and the examples in "Python code examples".
+"""
+from threading import Thread, Event, Condition
+import errno
+import fcntl
+import os
+import time
+import cv2
+import numpy as np
+
+
+class LocalDisplay(Thread):
+    """ Class for facilitating the local display of inference results
+        (as images). The class is designed to run on its own thread. In
+        particular the class dumps the inference results into a FIFO
+        located in the tmp directory (which lambda has access to). The
+        results can be rendered using mplayer by typing:
+        mplayer -demuxer lavf -lavfdopts format=mjpeg:probesize=32 /tmp/results.mjpeg
+        The thread sleeps until a new frame is set, writes at most max_fps
+        frames per second and frames are not encoded while nobody reads
+        the FIFO. Frames are shown at the configured resolution; a frame
+        handed over at another size is resized and encoded by the thread,
+        only when it is written.
+    """
+
+    def __init__(self, resolution, max_fps=15, result_path="/tmp/results.mjpeg"):
+        """ resolution - Desired resolution of the project stream
+            max_fps - Maximum number of frames written per second
+            result_path - Path to the FIFO file
+        """
+        # Initialize the base class, so that the object can run on its own
+        # thread.
+        super(LocalDisplay, self).__init__()
+        # List of valid resolutions
+        RESOLUTION = {"1080p": (1920, 1080), "720p": (1280, 720), "480p": (858, 480)}
+        if resolution not in RESOLUTION:
+            raise Exception("Invalid resolution")
+        self.resolution = RESOLUTION[resolution]
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.result_path = result_path
+        # Initialize the default image to be a white canvas. Clients
+        # will update the image when ready.
+        self.frame = cv2.imencode(".jpg", 255 * np.ones([640, 480, 3]))[1]
+        # Version of the frame held in self.frame and of the last frame
+        # written, the writer only wakes up when they differ.
+        self.frame_version = 1
+        self.written_version = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.reader_connected = Event()
+        self.stop_request = Event()
+        self.condition = Condition()
+
+    def open_fifo(self):
+        """ Opens the FIFO for writing once a reader is connected. Returns
+            None when no reader is available yet.
+        """
+        try:
+            fd = os.open(self.result_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as ex:
+            if ex.errno == errno.ENXIO:
+                return None
+            raise
+        # Writes should block while the reader catches up.
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        return os.fdopen(fd, "wb")
+
+    def next_frame(self):
+        """ Waits for a frame that has not been written yet and returns it,
+            or None when the display is stopped.
+        """
+        with self.condition:
+            while (
+                self.frame_version == self.written_version
+                and not self.stop_request.isSet()
+            ):
+                self.condition.wait(1.0)
+            if self.stop_request.isSet():
+                return None
+            # Frames set since the last write were never shown.
+            self.frames_dropped += self.frame_version - self.written_version - 1
+            self.written_version = self.frame_version
+            return self.frame
+
+    def run(self):
+        """ Overridden method that dumps every new image to the desired
+            FIFO file.
+        """
+        # The lambda only has permissions to the tmp directory. Pointing to
+        # a FIFO file in another directory will cause the lambda to crash.
+        # Create the FIFO file if it doesn't exist.
+        if not os.path.exists(self.result_path):
+            os.mkfifo(self.result_path)
+        while not self.stop_request.isSet():
+            fifo_file = self.open_fifo()
+            if fifo_file is None:
+                # Check again for a consumer in a little while.
+                self.stop_request.wait(0.5)
+                continue
+            self.reader_connected.set()
+            # Make sure the new reader gets the current frame straight away.
+            with self.condition:
+                self.written_version = self.frame_version - 1
+            try:
+                last_write = 0.0
+                while True:
+                    # Cap the output frame rate.
+                    delay = last_write + self.min_interval - time.time()
+                    if delay > 0:
+                        self.stop_request.wait(delay)
+                    frame = self.next_frame()
+                    if frame is None:
+                        break
+                    if isinstance(frame, np.ndarray) and frame.ndim == 3:
+                        frame = self.encode(frame)
+                    # Write the data to the FIFO file. This call will block
+                    # until the consumer has read the previous frame.
+                    fifo_file.write(frame)
+                    fifo_file.flush()
+                    last_write = time.time()
+                    self.frames_written += 1
+            except (IOError, OSError):
+                # The consumer went away, wait for the next one.
+                pass
+            finally:
+                self.reader_connected.clear()
+                try:
+                    fifo_file.close()
+                except (IOError, OSError):
+                    pass
+
+    def update_frame(self, jpeg):
+        with self.condition:
+            self.frame = jpeg
+            self.frame_version += 1
+            self.condition.notify()
+
+    def encode(self, frame):
+        """ Encodes an image at the display resolution. """
+        ret, jpeg = cv2.imencode(".jpg", cv2.resize(frame, self.resolution))
+        if not ret:
+            raise Exception("Failed to set frame data")
+        return jpeg
+
+    def set_frame_data(self, frame):
+        """ Method updates the image data. This currently encodes the
+            numpy array to jpg but can be modified to support other encodings.
+            Nothing is encoded while no consumer reads the FIFO.
+            frame - Numpy array containing the image data of the next frame
+                    in the project stream.
+        """
+        if not self.reader_connected.isSet():
+            self.frames_skipped += 1
+            return
+        self.update_frame(self.encode(frame))
+
+    def set_encoded_frame(self, encoded, frame=None):
+        """ Method updates the image data with an already encoded jpg, so
+            the frame uploaded to S3 does not need to be encoded again when
+            it has the display resolution.
+            encoded - EncodedFrame of the next frame in the project stream.
+            frame - The image that was encoded; when the encode has another
+                    size, this image is resized and encoded instead, by the
+                    display thread
+        """
+        if not self.reader_connected.isSet():
+            self.frames_skipped += 1
+            return
+        height, width = encoded.shape[:2]
+        if frame is None or (width, height) == self.resolution:
+            self.update_frame(encoded.view)
+        else:
+            self.update_frame(frame)
+
+    def stats(self):
+        """ Returns the number of frames written, dropped because a newer
+            frame replaced them, and skipped because no consumer was reading.
+        """
+        return {
+            "written": self.frames_written,
+            "dropped": self.frames_dropped,
+            "skipped": self.frames_skipped,
+            "reader_connected": self.reader_connected.isSet(),
+        }
+
+    def join(self):
+        self.stop_request.set()
+        with self.condition:
+            self.condition.notify()
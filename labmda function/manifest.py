@@ -0,0 +1,169 @@
+""" Small json "latest state" manifest published next to the frames, so the
+    dashboard can poll a few hundred bytes (with If-None-Match) instead of
+    downloading every frame to read its metadata.
+"""
+from threading import Lock
+import json
+import time
+
+
+class DangerIndex(object):
+    """ Number of consecutive frames in which at least one person was not
+        wearing PPE. The alert is raised once the index reaches alert_after
+        and cleared only after clear_after compliant frames in a row, so a
+        single missed detection neither raises nor clears it.
+    """
+
+    def __init__(self, alert_after=3, clear_after=2):
+        """ alert_after - Frames with a violation before the alert is raised
+            clear_after - Compliant frames before the index and alert reset
+        """
+        self.alert_after = alert_after
+        self.clear_after = clear_after
+        self.index = 0
+        self.alert = False
+        self._compliant = 0
+
+    def update(self, violations):
+        """ Counts a frame with the given number of non compliant persons
+            and returns the danger index.
+        """
+        if violations > 0:
+            self.index += 1
+            self._compliant = 0
+            if self.index >= self.alert_after:
+                self.alert = True
+        else:
+            self._compliant += 1
+            if self._compliant >= self.clear_after:
+                self.index = 0
+                self.alert = False
+        return self.index
+
+
+class LatestManifest(object):
+    """ Keeps the latest.json manifest up to date. Every frame carries an
+        increasing sequence number. Frames are uploaded concurrently and
+        complete out of order, so manifest uploads are serialised and a
+        manifest older than the one already sent is never uploaded. Only
+        one caller uploads at a time, outside the lock: the others record
+        their manifest and return, and the uploading caller sends the
+        latest one recorded meanwhile before it returns.
+    """
+
+    def __init__(self, uploader, key="latest.json"):
+        """ uploader - S3Uploader used for the manifest uploads, and running
+                       the callback of the frame uploads
+            key - Key of the manifest in the bucket
+        """
+        self.uploader = uploader
+        self.key = key
+        self.callback_name = "manifest:" + key
+        uploader.register(self.callback_name, self._frame_uploaded)
+        self.published_sequence = 0
+        self.coalesced = 0
+        self._latest_sequence = 0
+        self._pending = None
+        self._uploading = False
+        self._lock = Lock()
+
+    def callback(
+        self, sequence, persons, ppes, danger_index, timestamp, alert, association, source
+    ):
+        """ The upload callback publishing the manifest of a frame once the
+            frame is in S3, as given to S3Uploader.submit. It is kept with
+            the frame when the frame goes to the spool.
+        """
+        return (
+            self.callback_name,
+            (sequence, persons, ppes, danger_index, timestamp, alert, association, source),
+        )
+
+    def _frame_uploaded(
+        self, item, sequence, persons, ppes, danger_index, timestamp, alert, association, source
+    ):
+        self.publish(
+            sequence,
+            item["Key"],
+            persons,
+            ppes,
+            danger_index,
+            timestamp,
+            alert=alert,
+            association=association,
+            source=source,
+        )
+
+    def publish(
+        self,
+        sequence,
+        frame_key,
+        persons,
+        ppes,
+        danger_index,
+        timestamp=None,
+        alert=False,
+        association=None,
+        source=None,
+    ):
+        """ Uploads the manifest of a frame. Call it once the frame itself is
+            in S3, typically from the callback of the frame upload.
+            sequence - Increasing sequence number of the frame
+            frame_key - Key of the uploaded frame
+            persons, ppes - Detection counts of the frame
+            danger_index - Danger index after this frame
+            timestamp - Capture time of the frame, defaults to now
+            alert - Whether the debounced danger alert is raised
+            association - Optional result of association.associate, adds
+                          the violations and the per person compliance
+            source - Optional source of the detections, rekognition or
+                     local when the device answered on its own
+        """
+        manifest = {
+            "key": frame_key,
+            "persons": persons,
+            "ppes": ppes,
+            "danger_index": danger_index,
+            "alert": alert,
+            "sequence": sequence,
+            "timestamp": time.time() if timestamp is None else timestamp,
+        }
+        if association is not None:
+            manifest["violations"] = association["violations"]
+            manifest["people"] = association["persons"]
+        if source is not None:
+            manifest["source"] = source
+        item = {
+            "Key": self.key,
+            "Body": json.dumps(manifest).encode("utf-8"),
+            "ACL": "public-read",
+            "ContentType": "application/json",
+            "CacheControl": "no-cache",
+        }
+        with self._lock:
+            if sequence <= self._latest_sequence:
+                return
+            self._latest_sequence = sequence
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (sequence, item)
+            if self._uploading:
+                return
+            self._uploading = True
+        try:
+            while True:
+                with self._lock:
+                    if self._pending is None:
+                        # Cleared with the pending check, so a manifest
+                        # recorded after it finds no uploading caller
+                        self._uploading = False
+                        return
+                    sequence, item = self._pending
+                    self._pending = None
+                if self.uploader.upload(item):
+                    with self._lock:
+                        self.published_sequence = sequence
+        except Exception:
+            with self._lock:
+                self._uploading = False
+            raise
@@ -0,0 +1,240 @@
+""" Low overhead instrumentation of the detection loop: timers feeding
+    fixed bucket histograms, a reporter publishing one compact metrics
+    message every few seconds, and an optional profiler for a fixed number
+    of frames.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from threading import Thread, Event, Lock
+import bisect
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+# Upper bounds in milliseconds of the histogram buckets, the last bucket
+# holds everything above.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram(object):
+    """ Count, sum, max and bucket counts of the observed durations. """
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the q-th percentile. """
+        target = self.count * q / 100.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "n": self.count,
+            "avg": round(self.total / self.count, 2) if self.count else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": round(self.max, 2),
+        }
+
+
+class Metrics(object):
+    """ Thread safe aggregator of stage durations and counters. """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = Lock()
+        self._since = time.time()
+
+    def observe(self, name, seconds):
+        """ Records a duration in seconds under a name. """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds * 1000.0)
+
+    @contextmanager
+    def timer(self, name):
+        """ Times the body of a with statement. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self, reset=True):
+        """ Returns the summaries of every histogram and the counters since
+            the previous snapshot (or since the start when reset is False).
+        """
+        with self._lock:
+            now = time.time()
+            snapshot = {
+                "interval": round(now - self._since, 1),
+                "timings": dict(
+                    (name, histogram.summary()) for name, histogram in self._histograms.items()
+                ),
+                "counters": dict(self._counters),
+            }
+            if reset:
+                self._histograms = {}
+                self._counters = {}
+                self._since = now
+        return snapshot
+
+
+class MetricsReporter(Thread):
+    """ Publishes the metrics snapshot, together with the statistics of the
+        other components, as one message every interval seconds.
+    """
+
+    def __init__(self, metrics, publish, interval=30.0, extra=None):
+        """ metrics - Metrics aggregator
+            publish - Callable taking the json payload
+            interval - Seconds between two messages
+            extra - Optional callable returning a dict merged into the payload
+        """
+        super(MetricsReporter, self).__init__(name="metrics-reporter")
+        self.daemon = True
+        self.metrics = metrics
+        self.publish = publish
+        self.interval = interval
+        self.extra = extra
+        self.stop_request = Event()
+
+    def payload(self):
+        payload = self.metrics.snapshot()
+        payload["ts"] = int(time.time())
+        if self.extra is not None:
+            payload.update(self.extra())
+        return json.dumps(payload, separators=(",", ":"))
+
+    def run(self):
+        while not self.stop_request.wait(self.interval):
+            try:
+                self.publish(self.payload())
+            except Exception as ex:
+                # Never let reporting take the reporter thread down
+                print("Failed to publish metrics: {}".format(ex))
+
+    def join(self, timeout=None):
+        self.stop_request.set()
+        super(MetricsReporter, self).join(timeout)
+
+
+class FrameProfiler(object):
+    """ Debug helper profiling the stages with cProfile, and tracking memory
+        allocations with tracemalloc, for a fixed number of frames. Only one
+        cProfile profiler may be active in a process (Python 3.12 raises
+        otherwise), so one stage is profiled at a time: the stages take
+        turns, round robin, and a stage whose turn it is not runs its item
+        unprofiled. Every stage has its own profile; they are merged into
+        one report at the end.
+    """
+
+    def __init__(self, frames, output_dir="/tmp", stage=None):
+        """ frames - Number of frames to profile
+            output_dir - Where the .pstats and tracemalloc reports are written
+            stage - Name of the only stage profiled, all of them in turn when
+                    None
+        """
+        self.frames = frames
+        self.output_dir = output_dir
+        self.stage = stage
+        self.active = frames > 0
+        self.reports = None
+        self.calls = Counter()
+        self._done = 0
+        self._profiles = {}
+        self._stages = []
+        self._turn = 0
+        self._lock = Lock()
+        # Held while a profiler is enabled
+        self._running = Lock()
+        if self.active:
+            tracemalloc.start()
+
+    def _take_turn(self, name):
+        with self._lock:
+            if name not in self._stages:
+                self._stages.append(name)
+            if self._stages[self._turn] != name or not self._running.acquire(False):
+                return None
+            self._turn = (self._turn + 1) % len(self._stages)
+            self.calls[name] += 1
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = cProfile.Profile()
+            return profile
+
+    def runcall(self, name, func, *args):
+        """ Calls func(*args) under the profile of the named stage when it is
+            its turn, unprofiled otherwise.
+        """
+        if self.stage is not None and name != self.stage:
+            return func(*args)
+        profile = self._take_turn(name)
+        if profile is None:
+            return func(*args)
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            self._running.release()
+
+    def frame_done(self):
+        """ Counts a finished frame, writes the reports after the last one. """
+        with self._lock:
+            if not self.active:
+                return
+            self._done += 1
+            if self._done < self.frames:
+                return
+            self.active = False
+        self.reports = self.write_reports()
+
+    def write_reports(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        stats_path = os.path.join(self.output_dir, "profile-{}.pstats".format(stamp))
+        memory_path = os.path.join(self.output_dir, "tracemalloc-{}.txt".format(stamp))
+        # Waits for the profile of a stage still running
+        with self._running:
+            profiles = list(self._profiles.values())
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(stats_path)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        with open(memory_path, "w") as memory_file:
+            for stat in snapshot.statistics("lineno")[:50]:
+                memory_file.write("{}\n".format(stat))
+        return {
+            "pstats": stats_path if profiles else None,
+            "tracemalloc": memory_path,
+            "profiled_calls": dict(self.calls),
+        }
@@ -0,0 +1,147 @@
+""" Packs the person crops of one or more frames into a single mosaic image
+    so that several people can be analysed with one Rekognition call, and
+    maps the labels found in the mosaic back onto the original frames.
+"""
+import math
+import numpy as np
+
+
+class MosaicBuilder(object):
+    """ Builds mosaics out of person boxes. Crops are padded, placed on
+        shelves from left to right and top to bottom, and remembered so the
+        returned bounding boxes can be translated back to frame space.
+    """
+
+    def __init__(self, padding=0.15, spacing=8):
+        """ padding - Extra margin added around each person box, as a fraction
+                      of the box size, so PPE at the edge is not cut off
+            spacing - Empty pixels between two crops in the mosaic
+        """
+        self.padding = padding
+        self.spacing = spacing
+
+    def padded_box(self, box, frame_shape):
+        """ Returns the integer (xmin, ymin, xmax, ymax) of a pixel box grown
+            by the padding and clipped to the frame.
+        """
+        frame_height, frame_width = frame_shape[:2]
+        xmin, ymin, xmax, ymax = box
+        pad_x = (xmax - xmin) * self.padding
+        pad_y = (ymax - ymin) * self.padding
+        return (
+            int(max(0, xmin - pad_x)),
+            int(max(0, ymin - pad_y)),
+            int(min(frame_width, math.ceil(xmax + pad_x))),
+            int(min(frame_height, math.ceil(ymax + pad_y))),
+        )
+
+    def build(self, crops):
+        """ Packs crops into one image.
+            crops - List of (frame_index, frame, box) where box is a pixel
+                    (xmin, ymin, xmax, ymax) in the frame
+            Returns the mosaic image and the list of placements, one dict per
+            crop with frame_index, frame_shape, src (x, y, w, h in the frame)
+            and dst (x, y in the mosaic).
+        """
+        if not crops:
+            raise Exception("Cannot build a mosaic without crops")
+        regions = []
+        for frame_index, frame, box in crops:
+            xmin, ymin, xmax, ymax = self.padded_box(box, frame.shape)
+            if xmax <= xmin or ymax <= ymin:
+                continue
+            regions.append((frame_index, frame, xmin, ymin, xmax - xmin, ymax - ymin))
+        if not regions:
+            raise Exception("Cannot build a mosaic without crops")
+        # Aim for a roughly square mosaic, but never narrower than the widest crop.
+        area = sum((w + self.spacing) * (h + self.spacing) for _, _, _, _, w, h in regions)
+        shelf_width = max(max(r[4] for r in regions), int(math.sqrt(area)))
+        # Tallest crops first keeps the shelves tight.
+        order = sorted(range(len(regions)), key=lambda i: -regions[i][5])
+        placements = [None] * len(regions)
+        x = y = shelf_height = 0
+        for i in order:
+            frame_index, frame, sx, sy, w, h = regions[i]
+            if x > 0 and x + w > shelf_width:
+                x = 0
+                y += shelf_height + self.spacing
+                shelf_height = 0
+            placements[i] = {
+                "frame_index": frame_index,
+                "frame_shape": frame.shape[:2],
+                "src": (sx, sy, w, h),
+                "dst": (x, y),
+            }
+            x += w + self.spacing
+            shelf_height = max(shelf_height, h)
+        mosaic_width = max(p["dst"][0] + p["src"][2] for p in placements)
+        mosaic_height = max(p["dst"][1] + p["src"][3] for p in placements)
+        mosaic = np.zeros((mosaic_height, mosaic_width, 3), dtype=np.uint8)
+        for (_, frame, sx, sy, w, h), placement in zip(regions, placements):
+            dx, dy = placement["dst"]
+            mosaic[dy : dy + h, dx : dx + w] = frame[sy : sy + h, sx : sx + w]
+        return mosaic, placements
+
+    def map_labels(self, labels, placements, mosaic_shape):
+        """ Translates custom labels found in a mosaic back to the frames the
+            crops came from. A label belongs to the crop containing the centre
+            of its box and is clipped to that crop.
+            labels - The CustomLabels list returned for the mosaic
+            placements - Placements returned by build
+            mosaic_shape - Shape of the mosaic image
+            Returns a dict of frame_index to the list of labels, with bounding
+            boxes relative to the full frame.
+        """
+        mosaic_height, mosaic_width = mosaic_shape[:2]
+        results = {}
+        for placement in placements:
+            results.setdefault(placement["frame_index"], [])
+        if not placements:
+            return results
+        # Tile rectangles in mosaic pixels, one row per placement
+        tiles = np.array(
+            [p["dst"] + p["src"][2:] for p in placements], dtype=np.float64
+        )
+        for elabel in labels:
+            if "Geometry" not in elabel:
+                # Image level labels apply to every frame in the mosaic.
+                for frame_labels in results.values():
+                    frame_labels.append(elabel)
+                continue
+            box = elabel["Geometry"]["BoundingBox"]
+            left = box["Left"] * mosaic_width
+            top = box["Top"] * mosaic_height
+            right = left + box["Width"] * mosaic_width
+            bottom = top + box["Height"] * mosaic_height
+            cx = (left + right) / 2.0
+            cy = (top + bottom) / 2.0
+            inside = np.nonzero(
+                (tiles[:, 0] <= cx)
+                & (cx < tiles[:, 0] + tiles[:, 2])
+                & (tiles[:, 1] <= cy)
+                & (cy < tiles[:, 1] + tiles[:, 3])
+            )[0]
+            if len(inside) == 0:
+                # Centre fell in the spacing between crops
+                continue
+            placement = placements[inside[0]]
+            dx, dy = placement["dst"]
+            sx, sy, w, h = placement["src"]
+            frame_height, frame_width = placement["frame_shape"]
+            # Clip to the crop, then move from mosaic to frame pixels
+            left = min(max(left, dx), dx + w) - dx + sx
+            right = min(max(right, dx), dx + w) - dx + sx
+            top = min(max(top, dy), dy + h) - dy + sy
+            bottom = min(max(bottom, dy), dy + h) - dy + sy
+            mapped = dict(elabel)
+            mapped["Geometry"] = dict(elabel["Geometry"])
+            mapped["Geometry"]["BoundingBox"] = {
+                "Left": left / frame_width,
+                "Top": top / frame_height,
+                "Width": (right - left) / frame_width,
+                "Height": (bottom - top) / frame_height,
+            }
+            # Polygon points are only valid in mosaic space
+            mapped["Geometry"].pop("Polygon", None)
+            results[placement["frame_index"]].append(mapped)
+        return results
@@ -0,0 +1,244 @@
+""" Motion region proposals: the parts of a frame that changed since the
+    last analysed frame. The threshold, contour and bounding box steps of
+    "Python code examples/boundingBox.py" run on a small grayscale copy of
+    the frame, against the last analysed frame as background, and the boxes
+    are merged and filtered with NumPy. Frames without regions can skip the
+    analysis, and only the persons in a region need to be sent again.
+"""
+from threading import Lock
+import time
+import cv2
+import numpy as np
+
+
+def merge_boxes(boxes, gap=0):
+    """ Merges boxes that overlap or lie within gap pixels of each other
+        into their common bounding box, until no two boxes touch.
+        boxes - (n, 4) array of (xmin, ymin, xmax, ymax)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    while len(boxes) > 1:
+        grown = boxes + (-gap, -gap, gap, gap)
+        touch = (
+            (grown[:, None, 0] <= grown[None, :, 2])
+            & (grown[None, :, 0] <= grown[:, None, 2])
+            & (grown[:, None, 1] <= grown[None, :, 3])
+            & (grown[None, :, 1] <= grown[:, None, 3])
+        )
+        # Label every box with the lowest index of the boxes it touches,
+        # repeated until the labels of the connected boxes agree
+        group = np.arange(len(boxes))
+        while True:
+            lowest = np.where(touch, group[None, :], len(boxes)).min(axis=1)
+            if np.array_equal(lowest, group):
+                break
+            group = lowest
+        if len(np.unique(group)) == len(boxes):
+            break
+        merged = np.empty((len(np.unique(group)), 4))
+        for index, label in enumerate(np.unique(group)):
+            members = boxes[group == label]
+            merged[index] = (
+                members[:, 0].min(),
+                members[:, 1].min(),
+                members[:, 2].max(),
+                members[:, 3].max(),
+            )
+        boxes = merged
+    return boxes
+
+
+def overlaps(boxes, regions):
+    """ Returns for every box whether it overlaps one of the regions. """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    regions = np.asarray(regions, dtype=np.float64).reshape(-1, 4)
+    if not len(boxes) or not len(regions):
+        return np.zeros(len(boxes), dtype=bool)
+    return (
+        (boxes[:, None, 0] < regions[None, :, 2])
+        & (regions[None, :, 0] < boxes[:, None, 2])
+        & (boxes[:, None, 1] < regions[None, :, 3])
+        & (regions[None, :, 1] < boxes[:, None, 3])
+    ).any(axis=1)
+
+
+def merge_labels(previous, fresh, regions, shape):
+    """ Labels of a frame where only the regions were analysed again: the
+        previous labels whose box centre lies outside every region, and the
+        fresh labels.
+        previous, fresh - Rekognition custom labels
+        regions - Pixel boxes that were analysed again
+        shape - Shape of the frame
+    """
+    height, width = shape[:2]
+    kept = []
+    for label in previous:
+        if "Geometry" not in label:
+            continue
+        box = label["Geometry"]["BoundingBox"]
+        x = (box["Left"] + box["Width"] / 2.0) * width
+        y = (box["Top"] + box["Height"] / 2.0) * height
+        if not overlaps([(x, y, x, y)], regions)[0]:
+            kept.append(label)
+    return kept + list(fresh)
+
+
+class MotionDetector(object):
+    """ Compares every frame with the last analysed one. The frames are
+        shrunk to width pixels, converted to grayscale and blurred; pixels
+        that differ by more than threshold are kept, speckles are removed by
+        an opening and the changes close to each other are joined by a
+        dilation. The bounding boxes of the remaining blobs, merged and
+        without the ones smaller than min_area, are the regions.
+
+        A still frame may reuse the response of the last analysed frame for
+        at most max_reuse_age seconds and max_reuse_frames frames, so a
+        static scene is still analysed again now and then.
+    """
+
+    def __init__(
+        self,
+        width=320,
+        threshold=25,
+        blur=5,
+        dilate=3,
+        min_area=0.001,
+        merge_gap=0.02,
+        padding=0.02,
+        max_reuse_age=30.0,
+        max_reuse_frames=100,
+    ):
+        """ width - Width of the frames compared
+            threshold - Grey level difference of a changed pixel
+            blur - Size of the Gaussian blur smoothing sensor noise, 0 for none
+            dilate - Iterations of the dilation joining nearby changes
+            min_area - Smallest region kept, as a fraction of the frame area
+            merge_gap - Regions closer than this fraction of the frame width
+                        are merged
+            padding - Margin added around the regions, as a fraction of the
+                      frame width
+            max_reuse_age - Seconds after the last analysed frame beyond
+                            which a still frame is analysed again
+            max_reuse_frames - Still frames that may reuse the response of
+                               the last analysed frame
+        """
+        self.width = width
+        self.threshold = threshold
+        self.blur = blur
+        self.dilate = dilate
+        self.min_area = min_area
+        self.merge_gap = merge_gap
+        self.padding = padding
+        self.max_reuse_age = max_reuse_age
+        self.max_reuse_frames = max_reuse_frames
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+        self.reference = None
+        self.candidate = None
+        self.frames = 0
+        self.still_frames = 0
+        self.regions_found = 0
+        self.analysed_at = None
+        self.reused = 0
+        self.reuses_expired = 0
+        self._lock = Lock()
+
+    def prepare(self, frame):
+        """ The small, blurred grayscale copy of a frame that is compared. """
+        scale = float(self.width) / frame.shape[1]
+        # Linear sampling costs a tenth of INTER_AREA, the blur takes care
+        # of the noise it lets through
+        small = cv2.resize(
+            frame,
+            (self.width, max(1, int(round(frame.shape[0] * scale)))),
+            interpolation=cv2.INTER_LINEAR,
+        )
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        if self.blur:
+            gray = cv2.GaussianBlur(gray, (self.blur, self.blur), 0)
+        return gray
+
+    def mask(self, gray):
+        """ Binary mask of the changes between gray and the reference. """
+        _, mask = cv2.threshold(
+            cv2.absdiff(gray, self.reference), self.threshold, 255, cv2.THRESH_BINARY
+        )
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        if self.dilate:
+            mask = cv2.dilate(mask, self.kernel, iterations=self.dilate)
+        return mask
+
+    def regions(self, frame):
+        """ Returns the pixel (xmin, ymin, xmax, ymax) boxes of the frame that
+            changed since the last analysed frame, the whole frame when there
+            is no analysed frame yet. Call analysed() once the frame has
+            been analysed.
+        """
+        gray = self.prepare(frame)
+        height, width = frame.shape[:2]
+        with self._lock:
+            self.candidate = gray
+            self.frames += 1
+            if self.reference is None or self.reference.shape != gray.shape:
+                self.regions_found += 1
+                return [(0.0, 0.0, float(width), float(height))]
+            mask = self.mask(gray)
+        # One call gives the bounding box and area of every blob, like
+        # boundingRect on every contour of findContours
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        stats = stats[1:count]
+        small_area = float(mask.shape[0] * mask.shape[1])
+        stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area * small_area]
+        boxes = np.empty((len(stats), 4))
+        boxes[:, 0] = stats[:, cv2.CC_STAT_LEFT]
+        boxes[:, 1] = stats[:, cv2.CC_STAT_TOP]
+        boxes[:, 2] = boxes[:, 0] + stats[:, cv2.CC_STAT_WIDTH]
+        boxes[:, 3] = boxes[:, 1] + stats[:, cv2.CC_STAT_HEIGHT]
+        boxes = merge_boxes(boxes, self.merge_gap * self.width)
+        # Back to the frame, padded and clipped
+        scale = float(width) / self.width
+        pad = self.padding * width
+        boxes = boxes * scale + (-pad, -pad, pad, pad)
+        boxes = np.clip(boxes, 0, (width, height, width, height))
+        with self._lock:
+            if len(boxes):
+                self.regions_found += len(boxes)
+            else:
+                self.still_frames += 1
+        return [tuple(box) for box in boxes]
+
+    def analysed(self, timestamp=None):
+        """ Makes the frame of the last regions() call the reference.
+            timestamp - Capture time of the frame, now by default
+        """
+        with self._lock:
+            if self.candidate is not None:
+                self.reference = self.candidate
+            self.analysed_at = timestamp if timestamp is not None else time.time()
+            self.reused = 0
+
+    def reusable(self, timestamp):
+        """ Returns True when a still frame captured at timestamp may reuse
+            the response of the last analysed frame, and counts the reuse.
+        """
+        with self._lock:
+            if (
+                self.analysed_at is None
+                or timestamp - self.analysed_at > self.max_reuse_age
+                or self.reused >= self.max_reuse_frames
+            ):
+                self.reuses_expired += 1
+                return False
+            self.reused += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "still_frames": self.still_frames,
+                "still_ratio": float(self.still_frames) / self.frames
+                if self.frames
+                else 0.0,
+                "regions": self.regions_found,
+                "reuses_expired": self.reuses_expired,
+            }
@@ -0,0 +1,65 @@
+""" Gate deciding whether a frame is worth sending to Rekognition, based on
+    the person detections of the on-device SSD model.
+"""
+from threading import Lock
+from detections import Detections, ssd_label_name
+
+
+class PersonGate(object):
+    """ Lets a frame through only when the SSD model found at least one
+        person above the detection threshold. Frames without people skip
+        the cloud call entirely. The gate keeps count of the frames it let
+        through (hits) and the frames it held back (skips).
+    """
+
+    # Label id of "person" in the output map of the sample SSD model
+    PERSON_LABEL = 15
+
+    def __init__(self, detection_threshold, person_label=PERSON_LABEL):
+        """ detection_threshold - Minimum SSD probability for a person
+            person_label - SSD label id of the person class
+        """
+        self.detection_threshold = detection_threshold
+        self.person_label = person_label
+        self.hits = 0
+        self.skips = 0
+        self._lock = Lock()
+
+    def persons(self, ssd_results):
+        """ Returns the SSD detections that are persons above the threshold.
+            ssd_results - Detections parsed with Detections.from_ssd, or the
+                          list of dicts with label, prob, xmin, ymin, xmax,
+                          ymax
+        """
+        if isinstance(ssd_results, Detections):
+            return ssd_results.select(
+                ssd_label_name(self.person_label), self.detection_threshold * 100
+            )
+        return [
+            obj
+            for obj in ssd_results
+            if obj["label"] == self.person_label
+            and obj["prob"] > self.detection_threshold
+        ]
+
+    def allow(self, ssd_results):
+        """ Returns True when the frame should be sent to Rekognition. """
+        has_person = len(self.persons(ssd_results)) > 0
+        with self._lock:
+            if has_person:
+                self.hits += 1
+            else:
+                self.skips += 1
+        return has_person
+
+    def stats(self):
+        """ Returns the hit and skip counts and the ratio of frames let
+            through to frames seen.
+        """
+        with self._lock:
+            total = self.hits + self.skips
+            return {
+                "hits": self.hits,
+                "skips": self.skips,
+                "hit_ratio": float(self.hits) / total if total else 0.0,
+            }
@@ -0,0 +1,204 @@
+""" Small building blocks for running the inference loop as a set of
+    pipelined stages. Every stage runs on its own thread and hands its
+    output to the next stage through a bounded queue, so a slow stage
+    (typically a network round trip) never stalls the stages before it.
+"""
+from threading import Thread, Event, Condition
+from collections import deque
+import time
+
+
+class StageQueue(object):
+    """ Bounded, thread safe queue connecting two pipeline stages. When the
+        queue is full the configured policy decides what happens to the new
+        item: with drop_oldest the oldest queued item is discarded so the
+        consumer always sees the freshest frame, otherwise the new item is
+        discarded and the producer carries on.
+    """
+
+    def __init__(self, maxsize=1, drop_oldest=True):
+        """ maxsize - Maximum number of items waiting in the queue
+            drop_oldest - Drop the oldest item (True) or the incoming item
+                          (False) when the queue is full
+        """
+        if maxsize < 1:
+            raise Exception("Queue size must be at least 1")
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+        self._items = deque()
+        self._cond = Condition()
+
+    def put(self, item):
+        """ Adds an item without ever blocking the producer. Returns False
+            when the incoming item itself was dropped.
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if not self.drop_oldest:
+                    return False
+                self._items.popleft()
+            self._items.append(item)
+            self._cond.notify()
+        return True
+
+    def get(self, timeout=None):
+        """ Removes and returns the oldest item, waiting up to timeout
+            seconds for one to arrive. Returns None on timeout.
+        """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def depth(self):
+        """ Number of items currently waiting in the queue. """
+        with self._cond:
+            return len(self._items)
+
+
+class Stage(Thread):
+    """ Worker thread running one step of the pipeline. The worker pulls an
+        item from its inbox, passes it to the stage function and pushes the
+        result to its outbox. A stage without an inbox is a source and calls
+        its function repeatedly with None. Returning None from the stage
+        function drops the item.
+    """
+
+    def __init__(
+        self,
+        name,
+        func,
+        inbox=None,
+        outbox=None,
+        on_error=None,
+        metrics=None,
+        profiler=None,
+    ):
+        """ name - Name used when reporting statistics
+            func - Callable taking the input item and returning the output item
+            inbox - StageQueue to read from, None for a source stage
+            outbox - StageQueue to write to, None for the last stage
+            on_error - Optional callable(name, exception) for failed items
+            metrics - Optional Metrics recording the duration of every call
+            profiler - Optional FrameProfiler, used while it is active
+        """
+        super(Stage, self).__init__(name="stage-" + name)
+        self.daemon = True
+        self.stage_name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.metrics = metrics
+        self.profiler = profiler
+        self.processed = 0
+        self.errors = 0
+        self.stop_request = Event()
+
+    def run(self):
+        """ Overridden method that keeps feeding items through the stage
+            function until the stage is stopped.
+        """
+        while not self.stop_request.isSet():
+            if self.inbox is not None:
+                item = self.inbox.get(timeout=0.5)
+                if item is None:
+                    continue
+            else:
+                item = None
+            start = time.time()
+            try:
+                if self.profiler is not None and self.profiler.active:
+                    result = self.profiler.runcall(self.stage_name, self.func, item)
+                else:
+                    result = self.func(item)
+            except Exception as ex:
+                self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(self.stage_name, ex)
+                # Back off a little so a persistent failure, such as a
+                # camera that stopped streaming, does not spin the CPU.
+                self.stop_request.wait(0.1)
+                continue
+            if self.metrics is not None:
+                self.metrics.observe(self.stage_name, time.time() - start)
+            self.processed += 1
+            if self.outbox is not None:
+                if result is not None:
+                    self.outbox.put(result)
+            elif self.profiler is not None:
+                self.profiler.frame_done()
+
+    def join(self, timeout=None):
+        self.stop_request.set()
+        super(Stage, self).join(timeout)
+
+
+class Pipeline(object):
+    """ Chains a list of stage functions together with bounded queues.
+        The first stage is the source, every following stage consumes the
+        output of the previous one.
+    """
+
+    def __init__(
+        self,
+        stages,
+        queue_size=1,
+        drop_oldest=True,
+        on_error=None,
+        metrics=None,
+        profiler=None,
+    ):
+        """ stages - List of (name, func) tuples in processing order
+            queue_size - Capacity of each queue between two stages
+            drop_oldest - Queue policy, see StageQueue
+            on_error - Optional callable(name, exception) for failed items
+            metrics - Optional Metrics timing every stage
+            profiler - Optional FrameProfiler profiling every stage
+        """
+        if not stages:
+            raise Exception("A pipeline needs at least one stage")
+        self.stages = []
+        inbox = None
+        for index, (name, func) in enumerate(stages):
+            outbox = None
+            if index < len(stages) - 1:
+                outbox = StageQueue(queue_size, drop_oldest)
+            self.stages.append(
+                Stage(name, func, inbox, outbox, on_error, metrics, profiler)
+            )
+            inbox = outbox
+        self.started = None
+
+    def start(self):
+        """ Starts every stage, the last one first so consumers are ready
+            before the source produces anything.
+        """
+        self.started = time.time()
+        for stage in reversed(self.stages):
+            stage.start()
+
+    def join(self, timeout=None):
+        """ Stops every stage, the source first. """
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def is_alive(self):
+        return all(stage.is_alive() for stage in self.stages)
+
+    def stats(self):
+        """ Returns per-stage statistics: items processed, errors, and the
+            depth and drop count of the queue feeding the stage.
+        """
+        stats = {}
+        for stage in self.stages:
+            entry = {"processed": stage.processed, "errors": stage.errors}
+            if stage.inbox is not None:
+                entry["queue_depth"] = stage.inbox.depth()
+                entry["dropped"] = stage.inbox.dropped
+            stats[stage.stage_name] = entry
+        return stats
@@ -0,0 +1,333 @@
+""" Offline replay of recorded footage through the PPE detection logic.
+    Video files and image folders are streamed frame by frame, analysed by
+    a pool of worker processes and the results are written in frame order
+    as JSON lines or CSV, optionally with the annotated frames.
+
+    Usage:
+        python replay.py footage.mp4 images/ --output results.jsonl \\
+            --project-version-arn arn:aws:rekognition:... --every 15
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import argparse
+import importlib
+import csv
+import json
+import os
+import time
+import cv2
+from frame_encoder import FrameEncoder
+from annotator import Annotator
+from manifest import DangerIndex
+from iot_publisher import compact_labels
+from association import associate
+from detections import Detections
+from scheduler import error_code, service_error
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+CSV_FIELDS = (
+    "source",
+    "index",
+    "timestamp",
+    "persons",
+    "ppes",
+    "violations",
+    "danger_index",
+    "alert",
+    "labels",
+    "error",
+)
+
+
+def image_paths(path):
+    """ Sorted image files of a folder. """
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def iter_tasks(sources, every=1):
+    """ Generator of (source, index, timestamp, item) tasks, one per frame.
+        Images are passed by path so the workers decode them in parallel;
+        video frames have to be decoded in order and are passed as arrays.
+        sources - Video files, image files or image folders
+        every - Only keep one frame out of every, for long footage
+    """
+    for source in sources:
+        if os.path.isdir(source) or source.lower().endswith(IMAGE_EXTENSIONS):
+            paths = image_paths(source) if os.path.isdir(source) else [source]
+            for index, path in enumerate(paths[::every]):
+                yield source, index * every, None, path
+            continue
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise Exception("Cannot open video {}".format(source))
+        index = 0
+        while True:
+            # grab() skips the decode of the frames that are not kept
+            if not capture.grab():
+                break
+            if index % every == 0:
+                ret, frame = capture.retrieve()
+                if ret:
+                    timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                    yield source, index, round(timestamp, 3), frame
+            index += 1
+        capture.release()
+
+
+def rekognition_backend():
+    """ Default detection backend, a boto3 Rekognition client. """
+    import boto3
+
+    return boto3.client("rekognition")
+
+
+def load_backend(spec):
+    """ Resolves a "module:callable" backend factory. """
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "rekognition_backend")
+
+
+class ReplayWorker(object):
+    """ Per process state: the backend client, the encoder and the
+        annotator are created once per worker, not once per frame.
+    """
+
+    def __init__(
+        self,
+        backend,
+        project_version_arn,
+        analysis_width=None,
+        limit=None,
+        annotated_dir=None,
+        retries=3,
+        min_containment=0.5,
+    ):
+        """ backend - Object with a detect_custom_labels method
+            project_version_arn - Rekognition custom labels model version
+            analysis_width - Width frames are downscaled to before analysis
+            limit - Optional semaphore shared by the workers, bounding the
+                    number of concurrent backend calls
+            annotated_dir - Optional folder the annotated frames are saved to
+            retries - Retries of a failing backend call after the first attempt
+            min_containment - See association.associate
+        """
+        self.backend = backend
+        self.project_version_arn = project_version_arn
+        self.encoder = FrameEncoder(analysis_width=analysis_width)
+        self.annotator = Annotator()
+        self.limit = limit
+        self.annotated_dir = annotated_dir
+        self.retries = retries
+        self.min_containment = min_containment
+
+    def detect(self, frame):
+        """ Calls the backend, retrying throttling, server and connection
+            errors, see scheduler.service_error.
+        """
+        encoded = self.encoder.encode_for_analysis(frame)
+        for attempt in range(self.retries + 1):
+            try:
+                if self.limit is None:
+                    return self._call(encoded)
+                with self.limit:
+                    return self._call(encoded)
+            except Exception as ex:
+                if attempt == self.retries or not service_error(ex):
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _call(self, encoded):
+        return self.backend.detect_custom_labels(
+            Image={"Bytes": encoded.tobytes()},
+            ProjectVersionArn=self.project_version_arn,
+        )
+
+    def process(self, task):
+        """ Returns the result of one frame. A frame that cannot be read or
+            that the backend fails on gets an error result and the replay
+            goes on; any other exception is a bug and ends the replay.
+        """
+        source, index, timestamp, item = task
+        result = {"source": source, "index": index, "timestamp": timestamp}
+        frame = cv2.imread(item) if isinstance(item, str) else item
+        if frame is None:
+            return self._failed(result, "Cannot read image {}".format(item))
+        try:
+            response = self.detect(frame)
+        except Exception as ex:
+            if error_code(ex) is None and not service_error(ex):
+                raise
+            return self._failed(result, str(ex))
+        labels = Detections.from_rekognition(response["CustomLabels"])
+        counts = self.annotator.annotate(frame, labels)
+        association = associate(labels, self.min_containment)
+        result.update(
+            persons=counts["person"],
+            ppes=counts["PPE"],
+            violations=association["violations"],
+            labels=compact_labels(labels),
+        )
+        if self.annotated_dir is not None:
+            name = "{}-{:08d}.jpg".format(
+                os.path.basename(source.rstrip(os.sep)), index
+            )
+            cv2.imwrite(os.path.join(self.annotated_dir, name), frame)
+        return result
+
+    @staticmethod
+    def _failed(result, error):
+        result.update(persons=0, ppes=0, violations=0, labels=[], error=error)
+        return result
+
+
+# The worker of the current process, created by init_worker
+_worker = None
+
+
+def init_worker(backend_spec, project_version_arn, analysis_width, limit, annotated_dir):
+    global _worker
+    _worker = ReplayWorker(
+        load_backend(backend_spec)(),
+        project_version_arn,
+        analysis_width=analysis_width,
+        limit=limit,
+        annotated_dir=annotated_dir,
+    )
+
+
+def process_task(task):
+    return _worker.process(task)
+
+
+def ordered_map(executor, func, tasks, window):
+    """ Like executor.map, but with at most window tasks in flight so a
+        long video is never read ahead into memory. Results are yielded in
+        task order.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(func, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ResultWriter(object):
+    """ Writes the results as JSON lines, or as CSV when the output file
+        name ends with .csv.
+    """
+
+    def __init__(self, path):
+        self.csv = path.lower().endswith(".csv")
+        self.file = open(path, "w")
+        self.writer = None
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, CSV_FIELDS)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.csv:
+            row = dict(result, labels=json.dumps(result["labels"]))
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(result, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def replay(
+    sources,
+    output,
+    project_version_arn,
+    backend="replay:rekognition_backend",
+    workers=None,
+    concurrency=None,
+    every=1,
+    analysis_width=1280,
+    annotated_dir=None,
+):
+    """ Replays the sources and writes the results, returns a summary.
+        sources - Video files, image files or image folders
+        output - Result file, .jsonl or .csv
+        project_version_arn - Rekognition custom labels model version
+        backend - "module:callable" factory of the detection backend
+        workers - Number of worker processes, one per core by default
+        concurrency - Maximum number of concurrent backend calls
+        every - Only analyse one frame out of every
+        analysis_width - Width frames are downscaled to, None to disable
+        annotated_dir - Optional folder for the annotated frames
+    """
+    workers = workers or os.cpu_count() or 1
+    limit = multiprocessing.Semaphore(concurrency) if concurrency else None
+    if annotated_dir is not None and not os.path.isdir(annotated_dir):
+        os.makedirs(annotated_dir)
+    danger_index = DangerIndex()
+    writer = ResultWriter(output)
+    summary = {"frames": 0, "errors": 0, "persons": 0, "ppes": 0, "violations": 0}
+    start = time.time()
+    try:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=init_worker,
+            initargs=(backend, project_version_arn, analysis_width, limit, annotated_dir),
+        ) as executor:
+            results = ordered_map(
+                executor, process_task, iter_tasks(sources, every), workers * 2
+            )
+            for result in results:
+                # The danger index depends on the previous frames, so it is
+                # computed here on the results put back in order.
+                result["danger_index"] = danger_index.update(result["violations"])
+                result["alert"] = danger_index.alert
+                writer.write(result)
+                summary["frames"] += 1
+                summary["errors"] += 1 if "error" in result else 0
+                summary["persons"] += result["persons"]
+                summary["ppes"] += result["ppes"]
+                summary["violations"] += result["violations"]
+    finally:
+        writer.close()
+    elapsed = time.time() - start
+    summary["seconds"] = round(elapsed, 2)
+    summary["fps"] = round(summary["frames"] / elapsed, 2) if elapsed else 0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("sources", nargs="+", help="Video files, images or image folders")
+    parser.add_argument("--output", default="replay.jsonl", help=".jsonl or .csv result file")
+    parser.add_argument("--project-version-arn", default=os.environ.get("PROJECT_VERSION_ARN"))
+    parser.add_argument("--backend", default="replay:rekognition_backend", help="module:callable backend factory")
+    parser.add_argument("--workers", type=int, help="Worker processes, one per core by default")
+    parser.add_argument("--concurrency", type=int, help="Maximum concurrent backend calls")
+    parser.add_argument("--every", type=int, default=1, help="Analyse one frame out of every")
+    parser.add_argument("--analysis-width", type=int, default=1280, help="0 disables downscaling")
+    parser.add_argument("--annotated-dir", help="Save the annotated frames to this folder")
+    args = parser.parse_args(argv)
+    if not args.project_version_arn:
+        parser.error("--project-version-arn or PROJECT_VERSION_ARN is required")
+    summary = replay(
+        args.sources,
+        args.output,
+        args.project_version_arn,
+        backend=args.backend,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        every=max(1, args.every),
+        analysis_width=args.analysis_width or None,
+        annotated_dir=args.annotated_dir,
+    )
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
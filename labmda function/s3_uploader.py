@@ -0,0 +1,320 @@
+""" Background uploader for the annotated frames. Uploads run on a pool of
+    worker threads sharing one S3 client, failed uploads are retried with
+    exponential backoff and, while the uplink is down, frames are spilled
+    to a size capped spool directory and uploaded oldest first once the
+    connection is back. Uploads S3 rejects are dropped, they would fail the
+    same way on every attempt.
+"""
+from threading import Thread, Event, Lock
+from collections import OrderedDict
+import binascii
+import json
+import os
+import random
+import time
+import queue
+from scheduler import service_error
+
+# Parameter of a spooled upload holding its callback, removed before the
+# upload is sent
+CALLBACK_PARAM = "_callback"
+
+
+class UploadSpool(object):
+    """ Directory holding uploads that could not be sent. Every upload is
+        stored as a body file and a json file with its request parameters,
+        and the callback to run once it is sent, if any. When the spool
+        grows past max_bytes the oldest uploads are deleted. The entries
+        and their sizes are kept in memory, the directory is only listed
+        once, at start.
+    """
+
+    def __init__(self, path, max_bytes):
+        """ path - Directory of the spool, must be under /tmp on the device
+            max_bytes - Maximum total size of the spooled bodies
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self.bytes = 0
+        self._counter = 0
+        # Body size of every entry, oldest first
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._load()
+
+    def _load(self):
+        """ Indexes the entries left by an earlier run. """
+        # File names start with a zero padded timestamp, so sorting them
+        # gives the oldest upload first.
+        names = sorted(name[:-5] for name in os.listdir(self.path) if name.endswith(".json"))
+        for name in names:
+            try:
+                size = os.path.getsize(os.path.join(self.path, name + ".bin"))
+            except OSError:
+                # Incomplete entry, e.g. left behind by a crash
+                self._remove(name)
+                continue
+            self._entries[name] = size
+            self.bytes += size
+
+    def _remove(self, name):
+        for ext in (".bin", ".json"):
+            try:
+                os.remove(os.path.join(self.path, name + ext))
+            except OSError:
+                pass
+
+    def _forget(self, name):
+        self.bytes -= self._entries.pop(name, 0)
+        self._remove(name)
+
+    def put(self, item, callback=None):
+        """ Stores an upload, evicting the oldest ones if needed.
+            callback - Optional json serialisable description of the
+                       callback to run once the upload is sent
+        """
+        body = item["Body"]
+        with self._lock:
+            self._counter += 1
+            name = "{:020d}-{:06d}".format(int(time.time() * 1e6), self._counter % 1000000)
+            with open(os.path.join(self.path, name + ".bin"), "wb") as body_file:
+                body_file.write(body)
+            params = dict((k, v) for k, v in item.items() if k != "Body")
+            if callback is not None:
+                params[CALLBACK_PARAM] = callback
+            # The json file is written last, it marks the upload as complete.
+            with open(os.path.join(self.path, name + ".json"), "w") as params_file:
+                json.dump(params, params_file)
+            self._entries[name] = len(body)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                self._forget(next(iter(self._entries)))
+                self.evicted += 1
+
+    def oldest(self):
+        """ Returns (name, item, callback) of the oldest upload, or None. """
+        with self._lock:
+            while self._entries:
+                name = next(iter(self._entries))
+                try:
+                    with open(os.path.join(self.path, name + ".json")) as params_file:
+                        item = json.load(params_file)
+                    with open(os.path.join(self.path, name + ".bin"), "rb") as body_file:
+                        item["Body"] = body_file.read()
+                    return name, item, item.pop(CALLBACK_PARAM, None)
+                except (IOError, OSError, ValueError):
+                    # Incomplete entry, e.g. left behind by a crash
+                    self._forget(name)
+        return None
+
+    def remove(self, name):
+        with self._lock:
+            self._forget(name)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self.bytes, "evicted": self.evicted}
+
+
+class S3Uploader(object):
+    """ Accepts uploads without blocking the caller and sends them from a
+        pool of worker threads. Every upload is a dict of put_object
+        parameters (Key, Body, Metadata, ...), the bucket is added by the
+        uploader.
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket,
+        workers=4,
+        max_queue=16,
+        retries=3,
+        backoff=0.5,
+        spool_dir="/tmp/s3_spool",
+        spool_bytes=256 * 1024 * 1024,
+        drain_interval=5.0,
+    ):
+        """ s3 - boto3 S3 client shared by the workers; create it with a
+                 max_pool_connections of at least workers
+            bucket - Bucket receiving the uploads
+            workers - Number of concurrent uploads
+            max_queue - Uploads waiting in memory before they go to the spool
+            retries - Attempts after the first failure of an upload
+            backoff - Base delay in seconds of the exponential backoff
+            spool_dir - Directory for uploads made while offline, None to
+                        drop them instead
+            spool_bytes - Maximum size of the spool
+            drain_interval - Seconds between two attempts to drain the spool
+                             while the uplink is down
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.retries = retries
+        self.backoff = backoff
+        self.drain_interval = drain_interval
+        self.spool = UploadSpool(spool_dir, spool_bytes) if spool_dir else None
+        # Spooled callbacks of an earlier run are not run, see register
+        self.run = binascii.hexlify(os.urandom(4)).decode("ascii")
+        self._callbacks = {}
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_latency = None
+        self._latency_total = 0.0
+        self._lock = Lock()
+        self._queue = queue.Queue(max_queue)
+        self._online = Event()
+        self._online.set()
+        self.stop_request = Event()
+        self._threads = [
+            Thread(target=self._work, name="s3-upload-{}".format(i)) for i in range(workers)
+        ]
+        if self.spool is not None:
+            self._threads.append(Thread(target=self._drain, name="s3-spool-drain"))
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        self.stop_request.set()
+
+    def register(self, name, func):
+        """ Registers a named callback, func(item, *args), for the uploads
+            submitted with callback=(name, args). Unlike a plain callable it
+            is stored with a spooled upload and run once the spool sends
+            it. The callbacks of uploads spooled by an earlier run are not
+            run: their arguments, e.g. sequence numbers, belong to that run.
+        """
+        self._callbacks[name] = func
+
+    def submit(self, item, callback=None):
+        """ Queues an upload. When the queue is full, or the uplink is known
+            to be down, the upload goes straight to the spool.
+            item - put_object parameters of the upload
+            callback - Optional callable(item) run by the worker once the
+                       upload succeeded, not run for spooled uploads; or a
+                       (name, args) pair of a registered callback, with json
+                       serialisable args, also run for spooled uploads
+        """
+        if self._online.isSet():
+            try:
+                self._queue.put_nowait((item, callback))
+                return
+            except queue.Full:
+                pass
+        self._spill(item, callback)
+
+    def _spill(self, item, callback=None):
+        if self.spool is None:
+            with self._lock:
+                self.dropped += 1
+            return
+        if isinstance(callback, tuple):
+            name, args = callback
+            self.spool.put(item, [self.run, name, list(args)])
+        else:
+            self.spool.put(item)
+
+    def _callback(self, item, callback):
+        if isinstance(callback, tuple):
+            name, args = callback
+            self._callbacks[name](item, *args)
+        else:
+            callback(item)
+
+    def upload(self, item):
+        """ Uploads one item on the calling thread, retrying failures of S3
+            or of the uplink with backoff. Returns True on success, False
+            once the retries ran out, and None when S3 rejected the upload
+            (access denied, no such bucket, invalid request): it is dropped
+            and logged instead of being retried or spooled.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Exponential backoff with jitter, so several workers do not
+                # retry in lockstep.
+                delay = self.backoff * (2 ** (attempt - 1))
+                if self.stop_request.wait(delay * (0.5 + random.random())):
+                    return False
+            start = time.time()
+            try:
+                self.s3.put_object(Bucket=self.bucket, **item)
+            except Exception as ex:
+                if service_error(ex):
+                    continue
+                with self._lock:
+                    self.rejected += 1
+                print("Dropped the upload of {}: {}".format(item.get("Key"), ex))
+                return None
+            latency = time.time() - start
+            with self._lock:
+                self.uploaded += 1
+                self.last_latency = latency
+                self._latency_total += latency
+            self._online.set()
+            return True
+        with self._lock:
+            self.failed += 1
+        self._online.clear()
+        return False
+
+    def _work(self):
+        while not self.stop_request.isSet():
+            try:
+                item, callback = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            uploaded = self.upload(item)
+            if uploaded is False:
+                self._spill(item, callback)
+            elif uploaded and callback is not None:
+                self._callback(item, callback)
+
+    def _drain(self):
+        """ Uploads the spooled items, oldest first. """
+        while not self.stop_request.isSet():
+            entry = self.spool.oldest()
+            if entry is None:
+                self.stop_request.wait(self.drain_interval)
+                continue
+            name, item, callback = entry
+            uploaded = self.upload(item)
+            if uploaded is False:
+                self.stop_request.wait(self.drain_interval)
+                continue
+            self.spool.remove(name)
+            if uploaded and callback is not None and callback[0] == self.run:
+                self._callback(item, (callback[1], callback[2]))
+
+    def stats(self):
+        """ Returns the backlog (queued and spooled uploads), upload counts
+            and upload latency in milliseconds.
+        """
+        with self._lock:
+            stats = {
+                "online": self._online.isSet(),
+                "queued": self._queue.qsize(),
+                "uploaded": self.uploaded,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "last_latency_ms": None
+                if self.last_latency is None
+                else self.last_latency * 1000.0,
+                "avg_latency_ms": self._latency_total * 1000.0 / self.uploaded
+                if self.uploaded
+                else None,
+            }
+        stats["backlog"] = stats["queued"]
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+            stats["backlog"] += stats["spool"]["files"]
+        return stats
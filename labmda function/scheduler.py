@@ -0,0 +1,212 @@
+""" Scheduler deciding when the next Rekognition call may be made. It keeps
+    the calls within a per minute budget, samples active or non compliant
+    scenes more often than idle ones, backs off when the service throttles
+    or slows down, and retries failed calls with jittered backoff.
+"""
+from collections import deque, Counter
+from threading import Lock
+import random
+import socket
+import time
+
+# Error codes meaning the model has no capacity left for the call
+THROTTLE_CODES = (
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+)
+# Error codes of a service failing on its side, worth another attempt
+SERVER_CODES = (
+    "InternalServerError",
+    "InternalError",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "SlowDown",
+    "RequestTimeout",
+    "RequestTimeoutException",
+)
+
+
+def error_code(ex):
+    """ The error code of a botocore ClientError, None for other errors. """
+    response = getattr(ex, "response", None)
+    if not isinstance(response, dict):
+        return None
+    return response.get("Error", {}).get("Code")
+
+
+def service_error(ex):
+    """ Whether ex is a failure of the service or of the way to it: a
+        throttling or server error response (HTTP 429 or 5xx), a timeout or
+        a lost connection. Other errors, validation errors and missing
+        permissions or resources included, are bugs of the caller or of the
+        setup and are not retried or hidden.
+    """
+    code = error_code(ex)
+    if code is not None:
+        if code in THROTTLE_CODES or code in SERVER_CODES:
+            return True
+        status = ex.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return status is not None and (status == 429 or status >= 500)
+    if isinstance(ex, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    try:
+        from botocore.exceptions import ConnectionError as BotoConnectionError
+        from botocore.exceptions import HTTPClientError
+    except ImportError:
+        return False
+    # EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError and
+    # ConnectionClosedError derive from these
+    return isinstance(ex, (BotoConnectionError, HTTPClientError))
+
+
+class CallScheduler(object):
+    """ The interval between two calls is the largest of: the interval of
+        the current mode (active or idle), the budget interval, and the
+        measured latency stretched when it exceeds target_latency; it is
+        multiplied by a penalty that doubles on every throttling response
+        and decays back with every successful call.
+    """
+
+    def __init__(
+        self,
+        budget_per_minute=60,
+        active_interval=1.0,
+        idle_interval=5.0,
+        target_latency=1.0,
+        retries=3,
+        backoff=0.5,
+        max_backoff=30.0,
+        clock=time.time,
+        sleep=time.sleep,
+        seed=None,
+    ):
+        """ budget_per_minute - Maximum number of calls in any 60 seconds
+            active_interval - Seconds between calls while the scene has
+                              people in it or is not compliant
+            idle_interval - Seconds between calls while the scene is idle
+            target_latency - Latency in seconds above which the calls are
+                             spaced out further
+            retries - Retries of a failing call after the first attempt,
+                      before the error is raised; 0 calls once
+            backoff - First backoff in seconds, doubled on every retry
+            max_backoff - Upper bound of a backoff
+            clock, sleep - Time functions, replaced by simulated ones in tests
+            seed - Seed of the backoff jitter
+        """
+        if budget_per_minute <= 0:
+            raise Exception("The call budget must be positive")
+        if retries < 0:
+            raise Exception("The number of retries cannot be negative")
+        self.budget_per_minute = budget_per_minute
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.target_latency = target_latency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random.Random(seed)
+        self.latency = None
+        self.penalty = 1.0
+        self.blocked_until = 0.0
+        self.last_call = None
+        self.last_decision = None
+        self.decisions = Counter()
+        self._calls = deque()
+        self._lock = Lock()
+
+    def interval(self, active):
+        """ Seconds to wait between two calls in the given mode. """
+        interval = max(
+            self.active_interval if active else self.idle_interval,
+            60.0 / self.budget_per_minute,
+        )
+        if self.latency is not None and self.latency > self.target_latency:
+            interval = max(interval, self.latency * self.latency / self.target_latency)
+        return interval * self.penalty
+
+    def should_call(self, active):
+        """ Returns True when a call may be made now.
+            active - Whether the scene has people in it or is not compliant
+        """
+        with self._lock:
+            now = self.clock()
+            while self._calls and now - self._calls[0] >= 60.0:
+                self._calls.popleft()
+            if now < self.blocked_until:
+                decision = "backoff"
+            elif len(self._calls) >= self.budget_per_minute:
+                decision = "budget"
+            elif self.last_call is not None and now - self.last_call < self.interval(active):
+                decision = "interval"
+            else:
+                decision = "call"
+                self.last_call = now
+                self._calls.append(now)
+            self.decisions[decision] += 1
+            self.last_decision = decision
+            return decision == "call"
+
+    def _backoff(self, attempt):
+        """ Full jitter exponential backoff. """
+        return self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """ Calls func, retrying failures of the service with jittered
+            backoff. A throttling response also holds back the calls of
+            should_call for the duration of the backoff. The error of the last
+            attempt is raised, other errors right away.
+        """
+        for attempt in range(self.retries + 1):
+            start = self.clock()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as ex:
+                if not service_error(ex):
+                    raise
+                delay = self._backoff(attempt)
+                with self._lock:
+                    if error_code(ex) in THROTTLE_CODES:
+                        self.decisions["throttled"] += 1
+                        self.penalty = min(self.penalty * 2.0, 16.0)
+                        self.blocked_until = self.clock() + delay
+                    else:
+                        self.decisions["failed"] += 1
+                if attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.decisions["retried"] += 1
+                self.sleep(delay)
+                with self._lock:
+                    # The retry counts against the budget as well, at the
+                    # time it is made so the window stays in time order
+                    self._calls.append(self.clock())
+                continue
+            latency = self.clock() - start
+            with self._lock:
+                self.latency = (
+                    latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                )
+                self.penalty = max(1.0, self.penalty * 0.9)
+                self.decisions["succeeded"] += 1
+            return result
+
+    def stats(self):
+        """ Returns the decision counts and the current scheduling state. """
+        with self._lock:
+            stats = dict(self.decisions)
+            stats.update(
+                {
+                    "last_decision": self.last_decision,
+                    "latency_ms": round(self.latency * 1000.0, 1)
+                    if self.latency is not None
+                    else None,
+                    "penalty": round(self.penalty, 2),
+                    "active_interval": round(self.interval(True), 2),
+                    "idle_interval": round(self.interval(False), 2),
+                    "calls_last_minute": len(self._calls),
+                }
+            )
+            return stats
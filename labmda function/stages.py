@@ -0,0 +1,583 @@
+""" The individual steps of the PPE detection loop, written as pipeline
+    stage functions (see pipeline.py). Each stage receives a job dictionary
+    describing one frame, adds its own results to it and returns it for the
+    next stage.
+"""
+import json
+import time
+import cv2
+from detections import Detections, PERSON, SSD_LABELS
+from frame_encoder import FrameEncoder
+from manifest import DangerIndex
+from association import associate
+from annotator import Annotator
+from detection_history import DetectionHistory
+from metrics import Metrics
+from fallback import CircuitBreaker, REKOGNITION_SOURCE
+from motion import overlaps, merge_labels
+from iot_publisher import result_payload, result_key
+from scheduler import service_error
+from archive import run_id
+
+
+class DetectionStages(object):
+    """ Holds the models, clients and settings shared by the stages of the
+        detection loop. The camera, model and AWS clients are passed in so
+        the stages can be driven by stand-ins away from the device.
+    """
+
+    def __init__(
+        self,
+        get_frame,
+        model,
+        rekognition,
+        uploader,
+        client,
+        iot_topic,
+        local_display,
+        project_version_arn,
+        model_type="ssd",
+        input_height=300,
+        input_width=300,
+        detection_threshold=0.25,
+        person_gate=None,
+        label_cache=None,
+        mosaic=None,
+        encoder=None,
+        manifest=None,
+        annotator=None,
+        history=None,
+        metrics=None,
+        publisher=None,
+        tracker=None,
+        danger_index=None,
+        min_containment=0.5,
+        scheduler=None,
+        camera=None,
+        startup=None,
+        fallback=None,
+        breaker=None,
+        motion=None,
+        stream=None,
+        archive=None,
+        frame_uploads=False,
+        latest_interval=5.0,
+        run=None,
+    ):
+        """ get_frame - Callable returning (ret, frame), e.g. awscam.getLastFrame
+            model - Loaded awscam.Model used for the on-device SSD detector
+            rekognition - boto3 Rekognition client
+            uploader - S3Uploader sending the annotated frames in the background
+            client - Greengrass IoT data client
+            iot_topic - Topic used for status messages
+            local_display - LocalDisplay receiving the annotated frames, or None
+            project_version_arn - Rekognition custom labels model version
+            model_type - Parser used for the on-device model output
+            input_height, input_width - Input size of the on-device model
+            detection_threshold - Minimum SSD probability for a person box
+            person_gate - Optional PersonGate; frames without a person then
+                          skip the Rekognition call
+            label_cache - Optional LabelCache serving responses for frames
+                          that look like a recently analysed one
+            mosaic - Optional MosaicBuilder; when persons are found only
+                     their crops are sent to Rekognition, packed in a mosaic
+            encoder - FrameEncoder used for every JPEG encode, a default one
+                      without downscaling is created when not given
+            manifest - Optional LatestManifest updated after every upload
+            annotator - Annotator drawing the labels, a default quiet one is
+                        created when not given
+            history - DetectionHistory recording every detection, a default
+                      one is created when not given
+            metrics - Metrics receiving the timings of the steps inside the
+                      stages (encode, rekognition call) and the counters
+            publisher - Optional IoTPublisher; status messages then go through
+                        it and the result of every frame is published
+            tracker - Optional PersonTracker; the labels are then cached per
+                      person track and Rekognition is only called for new,
+                      moved or stale tracks
+            danger_index - DangerIndex debouncing the danger alert, a default
+                           one is created when not given
+            min_containment - Fraction of a PPE box that must lie inside a
+                              person box for the PPE to count for them
+            scheduler - Optional CallScheduler deciding when Rekognition may
+                        be called and retrying failed calls; frames it holds
+                        back reuse the previous response
+            camera - Optional camera name, used as prefix of the S3 keys and
+                     sent with the published results, when one process
+                     serves several cameras
+            startup - Optional ColdStart; the first rekognition call and the
+                      first result are recorded in it, and its report is
+                      published with the first result
+            fallback - Optional LocalPPEDetector answering on the device
+                       while the breaker is open, and for frames whose
+                       Rekognition call failed
+            breaker - CircuitBreaker fed with the latency and errors of the
+                      Rekognition calls, a default one is created when a
+                      fallback is given
+            motion - Optional MotionDetector; frames where nothing changed
+                     since the last analysed frame reuse its Rekognition
+                     response, within the reuse limits of the detector, and
+                     with a mosaic or tracks only the persons in a changed
+                     region are sent again
+            stream - Optional StreamServer showing the annotated frames and
+                     the results to the viewers on the local network
+            archive - Optional SegmentArchiver recording the annotated frames
+                      and their counts in time segments
+            frame_uploads - Whether every annotated frame is also uploaded as
+                            its own object, which the manifest points to
+            latest_interval - Without frame uploads, seconds between two
+                              uploads of latest.jpg, the frame the manifest
+                              points to; a raised or cleared alert is
+                              uploaded at once
+            run - Id of this run of the lambda in the keys of the frame
+                  uploads, so a restart does not overwrite them; a random
+                  one by default
+        """
+        self.get_frame = get_frame
+        self.model = model
+        self.rekognition = rekognition
+        self.uploader = uploader
+        self.client = client
+        self.iot_topic = iot_topic
+        self.local_display = local_display
+        self.project_version_arn = project_version_arn
+        self.model_type = model_type
+        self.input_height = input_height
+        self.input_width = input_width
+        self.detection_threshold = detection_threshold
+        self.person_gate = person_gate
+        self.label_cache = label_cache
+        self.mosaic = mosaic
+        self.encoder = encoder if encoder is not None else FrameEncoder()
+        self.manifest = manifest
+        self.danger_index = danger_index if danger_index is not None else DangerIndex()
+        self.min_containment = min_containment
+        self.scheduler = scheduler
+        self.camera = camera
+        self.key_prefix = camera + "/" if camera else ""
+        self.archive = archive
+        self.frame_uploads = frame_uploads
+        self.latest_interval = latest_interval
+        self.run = run if run is not None else run_id()
+        self._latest_at = None
+        self._latest_alert = False
+        self.last_response = self.EMPTY_RESPONSE
+        self.annotator = annotator if annotator is not None else Annotator()
+        self.history = history if history is not None else DetectionHistory()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.publisher = publisher
+        self.tracker = tracker
+        self.startup = startup
+        self.fallback = fallback
+        if breaker is None and fallback is not None:
+            breaker = CircuitBreaker()
+        self.breaker = breaker
+        self.motion = motion
+        self.stream = stream
+        self.previous_response = None
+        self.frame_id = 0
+        self.iterator = 0
+
+    # Result reused for frames that do not need a Rekognition call
+    EMPTY_RESPONSE = {"CustomLabels": []}
+
+    def publish(self, payload, key=None):
+        if self.publisher is not None:
+            self.publisher.publish(payload, key)
+        else:
+            self.client.publish(topic=self.iot_topic, payload=payload)
+
+    def capture(self, _):
+        """ Source stage: grabs the latest frame from the video stream. """
+        ret, frame = self.get_frame()
+        if not ret:
+            raise Exception("Failed to get frame from the stream")
+        self.frame_id += 1
+        return {"frame_id": self.frame_id, "timestamp": time.time(), "frame": frame}
+
+    def infer(self, job):
+        """ Runs the on-device SSD model on the frame. """
+        # Resize frame to the same size as the training set.
+        frame_resize = cv2.resize(job["frame"], (self.input_height, self.input_width))
+        # Run the images through the inference engine and parse the results using
+        # the parser API, note it is possible to get the output of doInference
+        # and do the parsing manually, but since it is a ssd model,
+        # a simple API is provided.
+        parsed_inference_results = self.model.parseResult(
+            self.model_type, self.model.doInference(frame_resize)
+        )
+        job["ssd"] = Detections.from_ssd(
+            parsed_inference_results[self.model_type],
+            self.input_width,
+            self.input_height,
+            self.detection_threshold,
+            classes=SSD_LABELS,
+        )
+        # The person boxes in the full resolution image
+        persons = job["ssd"].select(PERSON)
+        job["person_boxes"] = [
+            tuple(box) for box in persons.pixel_corners(job["frame"].shape).tolist()
+        ]
+        job["person_scores"] = (persons.confidences / 100).tolist()
+        return job
+
+    def analyse(self, job):
+        """ Sends the frame to the Rekognition custom labels model. """
+        if self.tracker is not None:
+            # Tracks are updated on every frame, also the ones the gate
+            # holds back, so persons leaving the scene end their track.
+            job["tracks"] = self.tracker.update(job["person_boxes"])
+        if self.person_gate is not None and not self.person_gate.allow(job["ssd"]):
+            # Nobody in frame according to the SSD model, so there is nothing
+            # for the PPE model to find either.
+            job["response"] = self.EMPTY_RESPONSE
+            self.metrics.incr("gate_skips")
+            return job
+        if self.motion is not None:
+            job["motion"] = self.motion.regions(job["frame"])
+            previous = self.previous_response
+            if (
+                not job["motion"]
+                and previous is not None
+                # An answer of the fallback detector is not kept for long
+                and previous.get("Source", REKOGNITION_SOURCE) == REKOGNITION_SOURCE
+                and self.motion.reusable(job["timestamp"])
+            ):
+                # Nothing moved since the last analysed frame, not long ago
+                job["response"] = previous
+                self.metrics.incr("motion_skips")
+                return job
+        if self.fallback is None:
+            job["response"] = self.analyse_remote(job)
+        elif not self.breaker.allow():
+            # Rekognition is down or too slow, answer on the device
+            job["response"] = self.detect_local(job)
+        else:
+            try:
+                job["response"] = self.analyse_remote(job)
+            except Exception as ex:
+                # Only an unavailable service is answered locally, other
+                # errors are bugs and fail the frame
+                if not service_error(ex):
+                    raise
+                job["response"] = self.detect_local(job)
+        # Only a frame that was sent to a detector becomes the motion
+        # reference, not one answered from the cache or the tracks
+        if self.motion is not None and job.get("analysed"):
+            self.motion.analysed(job["timestamp"])
+        self.previous_response = job["response"]
+        return job
+
+    def analyse_remote(self, job):
+        """ Returns the Rekognition response of the frame, from the cache,
+            the tracks or a call, in that order: the cache answers frames
+            that look like a recently analysed one, the tracks the frames
+            whose persons all have recent labels.
+        """
+        signature = None
+        if self.label_cache is not None:
+            signature = self.label_cache.signature(job["frame"])
+            cached = self.label_cache.lookup(signature)
+            if cached is not None:
+                self.metrics.incr("cache_hits")
+                return cached
+        if self.tracker is not None and job["tracks"]:
+            response = self.analyse_tracks(job)
+        elif not self.may_call(job):
+            return self.last_response
+        else:
+            if self.mosaic is not None and job["person_boxes"]:
+                response = self.detect_persons(job)
+            else:
+                response = self.detect(job["frame"])
+            job["analysed"] = True
+            self.last_response = response
+        if signature is not None and job.get("analysed"):
+            self.label_cache.store(signature, response)
+        return response
+
+    def detect_local(self, job):
+        """ Answers a frame with the fallback detector. """
+        self.metrics.incr("fallback_frames")
+        job["analysed"] = True
+        with self.metrics.timer("fallback_detect"):
+            return self.fallback.detect(
+                job["frame"], job["person_boxes"], job["person_scores"]
+            )
+
+    def may_call(self, job):
+        """ Asks the scheduler whether Rekognition may be called for the
+            frame. Scenes with people or an ongoing danger are active.
+        """
+        if self.scheduler is None:
+            return True
+        active = bool(job["person_boxes"]) or self.danger_index.index > 0
+        if self.scheduler.should_call(active):
+            return True
+        self.metrics.incr("scheduler_skips")
+        return False
+
+    def detect_persons(self, job):
+        """ Analyses the persons of the frame in a mosaic. With motion
+            regions only the persons in a region are sent, the labels of
+            the others are kept from the previous response.
+        """
+        frame, boxes = job["frame"], job["person_boxes"]
+        previous = self.previous_response
+        if (
+            job.get("motion") is None
+            or previous is None
+            or previous.get("Source", REKOGNITION_SOURCE) != REKOGNITION_SOURCE
+        ):
+            return self.detect_mosaic(frame, boxes)
+        moving = [box for box, hit in zip(boxes, overlaps(boxes, job["motion"])) if hit]
+        if len(moving) == len(boxes):
+            return self.detect_mosaic(frame, boxes)
+        self.metrics.incr("motion_partial")
+        fresh = self.detect_mosaic(frame, moving)["CustomLabels"] if moving else []
+        return {
+            "CustomLabels": merge_labels(
+                previous["CustomLabels"], fresh, moving, frame.shape
+            )
+        }
+
+    def analyse_tracks(self, job):
+        """ Returns a response built from the labels cached on the tracks,
+            calling Rekognition first for the tracks that need it. With a
+            mosaic only those persons are sent, otherwise the whole frame is
+            and every track of the frame is refreshed. With motion regions,
+            a track whose labels only got old keeps them while it lies
+            outside every region, within the reuse age of the detector.
+        """
+        frame, tracks = job["frame"], job["tracks"]
+        pending = self.tracker.pending(tracks)
+        if pending and job.get("motion") is not None:
+            moving = overlaps([track.box for track in pending], job["motion"])
+            kept = [
+                track
+                for track, hit in zip(pending, moving)
+                if not hit
+                and track.labels is not None
+                and job["timestamp"] - track.analysed_at <= self.motion.max_reuse_age
+            ]
+            if kept:
+                self.metrics.incr("motion_partial")
+                pending = [track for track in pending if track not in kept]
+        if pending and self.may_call(job):
+            if self.mosaic is not None:
+                boxes = [track.box for track in pending]
+                labels = self.detect_mosaic(frame, boxes)["CustomLabels"]
+            else:
+                pending = tracks
+                labels = self.detect(frame)["CustomLabels"]
+            self.tracker.assign(pending, labels, frame.shape)
+            job["analysed"] = True
+        else:
+            self.metrics.incr("track_hits")
+        return {"CustomLabels": self.tracker.labels(tracks)}
+
+    def detect(self, image):
+        """ Calls the Rekognition custom labels model on an image. """
+        with self.metrics.timer("encode_analysis"):
+            encoded = self.encoder.encode_for_analysis(image)
+        call = self.rekognition.detect_custom_labels
+        start = time.time()
+        with self.metrics.timer("rekognition_call"):
+            try:
+                if self.scheduler is not None:
+                    response = self.scheduler.call(
+                        call,
+                        Image={"Bytes": encoded.tobytes(),},
+                        ProjectVersionArn=self.project_version_arn,
+                    )
+                else:
+                    response = call(
+                        Image={"Bytes": encoded.tobytes(),},
+                        ProjectVersionArn=self.project_version_arn,
+                    )
+            except Exception as ex:
+                self.metrics.incr("rekognition_errors")
+                if self.breaker is not None and service_error(ex):
+                    self.breaker.record(error=ex)
+                raise
+        if self.breaker is not None:
+            self.breaker.record(latency=time.time() - start)
+        if self.startup is not None:
+            self.startup.mark("first_rekognition")
+        return response
+
+    def detect_mosaic(self, frame, boxes):
+        """ Analyses only the persons of the frame, packed into a mosaic,
+            and returns a response with boxes relative to the full frame.
+        """
+        mosaic, placements = self.mosaic.build([(0, frame, box) for box in boxes])
+        response = dict(self.detect(mosaic))
+        labels = self.mosaic.map_labels(
+            response["CustomLabels"], placements, mosaic.shape
+        )
+        response["CustomLabels"] = labels[0]
+        return response
+
+    def annotate(self, job):
+        """ Counts the labels, assigns the PPE to the persons wearing them
+            and draws the labels on the frame.
+        """
+        # Parsed once, the steps below and the upload read the arrays
+        detections = Detections.from_rekognition(job["response"]["CustomLabels"])
+        job["detections"] = detections
+        self.history.add(job["timestamp"], job["frame_id"], detections)
+        counts = self.annotator.annotate(job["frame"], detections)
+        job["image"] = job["frame"]
+        job["persons"] = counts["person"]
+        job["ppes"] = counts["PPE"]
+        job["association"] = associate(detections, self.min_containment)
+        return job
+
+    def upload(self, job):
+        """ Last stage: queues the annotated frame and its counts for upload
+            to S3.
+        """
+        self.iterator = self.iterator + 1
+        sequence = self.iterator
+        persons, ppes, timestamp = job["persons"], job["ppes"], job["timestamp"]
+        source = job["response"].get("Source", REKOGNITION_SOURCE)
+        association = job["association"]
+        danger_index = self.danger_index.update(association["violations"])
+        alert = self.danger_index.alert
+        # One encode shared by the upload and the local display
+        with self.metrics.timer("encode_annotated"):
+            encoded = self.encoder.encode_annotated(job["image"])
+
+        jpeg = encoded.tobytes()
+        if self.archive is not None:
+            self.archive.add(
+                jpeg,
+                timestamp,
+                sequence,
+                persons,
+                ppes,
+                violations=association["violations"],
+                danger_index=danger_index,
+                alert=alert,
+                source=source,
+            )
+        if self.frame_uploads:
+            key = "{}frameID: {}-{}.jpg".format(self.key_prefix, self.run, sequence)
+        elif self.manifest is not None and self.latest_due(timestamp, alert):
+            # One object overwritten in place, for the dashboard
+            key = self.key_prefix + "latest.jpg"
+        else:
+            key = None
+        if key is not None:
+            self.metrics.incr("uploads")
+            self.uploader.submit(
+                {
+                    "Key": key,
+                    "Body": jpeg,
+                    "ACL": "public-read",
+                    "ContentType": "image/jpeg",
+                    "Metadata": {
+                        "NumberOfPersons": str(persons),
+                        "NumberOfPPEs": str(ppes),
+                        "Violations": str(association["violations"]),
+                        "DangerIndex": str(danger_index),
+                        "DangerAlert": str(alert).lower(),
+                        "Source": source,
+                    },
+                },
+                # The manifest is published once the frame is in S3, so the
+                # dashboard never sees a manifest pointing to a missing frame
+                callback=self.manifest.callback(
+                    sequence,
+                    persons,
+                    ppes,
+                    danger_index,
+                    timestamp,
+                    alert,
+                    association,
+                    source,
+                )
+                if self.manifest is not None
+                else None,
+            )
+        if self.local_display is not None:
+            self.local_display.set_encoded_frame(encoded, job["image"])
+        if self.publisher is not None or self.stream is not None:
+            # One payload for the IoT message and the viewers
+            payload = result_payload(
+                job["frame_id"],
+                timestamp,
+                job["detections"],
+                persons,
+                ppes,
+                danger_index=danger_index,
+                tracks=job.get("tracks"),
+                alert=alert,
+                association=association,
+                camera=self.camera,
+                source=source,
+            )
+            if self.publisher is not None:
+                self.metrics.incr("published")
+                self.publisher.publish(payload, key=result_key(self.camera))
+            if self.stream is not None:
+                self.metrics.incr("streamed")
+                self.stream.set_encoded_frame(encoded, self.camera)
+                self.stream.publish_state(payload, self.camera)
+        self.metrics.incr("frames")
+        self.metrics.observe("frame_latency", time.time() - timestamp)
+        if self.startup is not None and self.startup.first_result(self.camera):
+            self.publish(json.dumps(self.startup.stats()), key="startup")
+        return job
+
+    def latest_due(self, timestamp, alert):
+        """ Returns True when the frame should replace latest.jpg: once
+            every latest_interval seconds, and when the alert changed.
+        """
+        if (
+            self._latest_at is not None
+            and timestamp - self._latest_at < self.latest_interval
+            and alert == self._latest_alert
+        ):
+            return False
+        self._latest_at = timestamp
+        self._latest_alert = alert
+        return True
+
+    def stats(self):
+        """ Returns the statistics of the optional components. """
+        stats = {
+            "encoder": self.encoder.stats(),
+            "uploader": self.uploader.stats(),
+            "history": self.history.stats(),
+        }
+        if self.person_gate is not None:
+            stats["person_gate"] = self.person_gate.stats()
+        if self.label_cache is not None:
+            stats["label_cache"] = self.label_cache.stats()
+        if self.publisher is not None:
+            stats["publisher"] = self.publisher.stats()
+        if self.tracker is not None:
+            stats["tracker"] = self.tracker.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        if self.motion is not None:
+            stats["motion"] = self.motion.stats()
+        if self.stream is not None:
+            stats["stream"] = self.stream.stats()
+        if self.archive is not None:
+            stats["archive"] = self.archive.stats()
+        if self.fallback is not None:
+            stats["fallback"] = self.fallback.stats()
+            stats["breaker"] = self.breaker.stats()
+        return stats
+
+    def stage_list(self):
+        """ The stages in processing order, as expected by Pipeline. """
+        return [
+            ("capture", self.capture),
+            ("inference", self.infer),
+            ("rekognition", self.analyse),
+            ("annotation", self.annotate),
+            ("upload", self.upload),
+        ]
@@ -0,0 +1,110 @@
+""" Cold start of the lambda. The slow steps of startup (creating the AWS
+    clients, loading the on-device model) run side by side instead of one
+    after the other, the clients open their connections with a warm-up
+    request before the first frame needs them, and the time from the start
+    of the process to every step and to the first result is recorded, so
+    the outage of a restart can be measured.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class ColdStart(object):
+    """ Runs startup steps in the foreground or on background threads and
+        records when each of them finished, in milliseconds since started.
+    """
+
+    def __init__(self, started=None, workers=3, clock=time.time):
+        """ started - Start time of the process, now when not given
+            workers - Number of steps run in the background at once
+            clock - Time function
+        """
+        self.clock = clock
+        self.started = started if started is not None else clock()
+        self.steps = OrderedDict()
+        self.errors = {}
+        self.first_results = OrderedDict()
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(workers)
+
+    def _elapsed(self):
+        return round((self.clock() - self.started) * 1000.0, 1)
+
+    def mark(self, name):
+        """ Records that a step finished, only the first time it does.
+            Returns True the first time.
+        """
+        if name in self.steps:
+            return False
+        with self._lock:
+            if name in self.steps:
+                return False
+            self.steps[name] = self._elapsed()
+            return True
+
+    def _timed(self, name, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as ex:
+            self.errors[name] = str(ex)
+            raise
+        finally:
+            self.mark(name)
+
+    def run(self, name, func, *args, **kwargs):
+        """ Runs a step now and returns its result. """
+        return self._timed(name, func, args, kwargs)
+
+    def background(self, name, func, *args, **kwargs):
+        """ Starts a step on a background thread and returns its future. """
+        return self._executor.submit(self._timed, name, func, args, kwargs)
+
+    def first_result(self, camera=None):
+        """ Records the first result of a camera. Returns True for the first
+            result of the process, which ends the cold start.
+        """
+        key = camera or "default"
+        if key in self.first_results:
+            return False
+        with self._lock:
+            if key in self.first_results:
+                return False
+            self.first_results[key] = self._elapsed()
+            first = len(self.first_results) == 1
+        if first:
+            self.mark("first_result")
+        return first
+
+    def time_to_first_result(self):
+        """ Milliseconds from the start to the first result, None before. """
+        return self.steps.get("first_result")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "time_to_first_result_ms": self.steps.get("first_result"),
+                "steps_ms": dict(self.steps),
+                "first_result_ms": dict(self.first_results),
+                "errors": dict(self.errors),
+            }
+
+    def close(self):
+        """ Lets the background steps still running finish on their own. """
+        self._executor.shutdown(wait=False)
+
+
+def warm_up_rekognition(rekognition):
+    """ Lists one Custom Labels project, so the credentials are loaded and
+        the TLS connection is open before the first real frame. It is a
+        free control plane request: no inference is billed or counted
+        against REKOGNITION_BUDGET. An error answer opens the connection
+        as well; run as a ColdStart step, it is only recorded.
+    """
+    rekognition.describe_projects(MaxResults=1)
+
+
+def warm_up_s3(s3, bucket):
+    """ Opens the connection to the bucket, see warm_up_rekognition. """
+    s3.head_bucket(Bucket=bucket)
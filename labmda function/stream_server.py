@@ -0,0 +1,315 @@
+""" Embedded HTTP server for viewers on the local network, next to the
+    single reader FIFO of LocalDisplay:
+        /stream.mjpeg - the annotated frames as a multipart/x-mixed-replace
+                        MJPEG stream, shown by an <img> tag
+        /events - the detection results as Server-Sent Events
+        /snapshot.jpg - the latest annotated frame
+    Every endpoint takes an optional ?camera=name, the first camera that
+    sent a frame by default; cameras that never sent anything are not
+    found. All the clients share the one encoded frame of
+    the upload; each client is sent the latest frame when it is ready for
+    one, so a slow viewer skips frames instead of holding up the others or
+    the detection loop.
+
+    There is no authentication: the server listens on localhost unless
+    another host is given, and only the allow_origin page may read it from
+    a browser.
+"""
+from threading import Thread, Event
+from urllib.parse import urlsplit, parse_qs
+import asyncio
+
+BOUNDARY = b"frame"
+
+
+class Channel(object):
+    """ Latest value of a stream, shared by its clients. Only used from the
+        event loop.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.version = 0
+        self.data = None
+        self._part = None
+        self._waiters = []
+
+    def publish(self, data):
+        self.version += 1
+        self.data = data
+        self._part = None
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_newer(self, version, timeout):
+        """ Returns once the channel holds a version newer than version,
+            raises asyncio.TimeoutError after timeout seconds.
+        """
+        if self.version != version:
+            return
+        waiter = self.loop.create_future()
+        self._waiters.append(waiter)
+        await asyncio.wait_for(waiter, timeout)
+
+    def part(self):
+        """ The current frame as a part of the multipart stream, built once
+            for all the clients.
+        """
+        if self._part is None:
+            self._part = b"".join(
+                (
+                    b"--" + BOUNDARY + b"\r\n",
+                    b"Content-Type: image/jpeg\r\n",
+                    "Content-Length: {}\r\n\r\n".format(len(self.data)).encode("ascii"),
+                    self.data,
+                    b"\r\n",
+                )
+            )
+        return self._part
+
+
+class StreamServer(Thread):
+    """ Runs the asyncio server on its own thread. The detection loop hands
+        over the frames and results with set_encoded_frame and
+        publish_state, which never block.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8080,
+        allow_origin=None,
+        max_fps=15,
+        keepalive=15.0,
+        send_timeout=30.0,
+        buffer_bytes=256 * 1024,
+    ):
+        """ host, port - Address to listen on, port 0 picks a free port
+            allow_origin - Origin of the dashboard allowed to read the
+                           server from a browser, e.g. http://dash.local,
+                           "*" for any; None allows only same origin pages
+            max_fps - Maximum frames per second sent to a stream client
+            keepalive - Seconds between two keep-alive comments of the
+                        events stream
+            send_timeout - Seconds a client may take to accept a frame or
+                           event before it is disconnected
+            buffer_bytes - Bytes buffered per client before it counts as
+                           busy and is skipped frames
+        """
+        super(StreamServer, self).__init__(name="stream-server")
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.allow_origin = allow_origin
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.keepalive = keepalive
+        self.send_timeout = send_timeout
+        self.buffer_bytes = buffer_bytes
+        self.loop = None
+        self.ready = Event()
+        self.default_camera = None
+        self.frames = {}
+        self.states = {}
+        self.clients = {"stream": 0, "events": 0}
+        self.requests = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.events_sent = 0
+        self.timeouts = 0
+        self.bytes_sent = 0
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            tasks = [task for task in asyncio.all_tasks(self.loop) if not task.done()]
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(server.wait_closed())
+            self.loop.close()
+
+    def _channel(self, channels, camera):
+        if camera not in channels:
+            channels[camera] = Channel(self.loop)
+        return channels[camera]
+
+    def _client_channel(self, channels, camera):
+        """ Channel of a camera for a client, None when the camera never
+            sent a frame or a result. Only the cameras of the detection
+            loop get channels, whatever names the clients ask for.
+        """
+        if camera is None:
+            # Before the first frame the clients wait on the channel of
+            # the default camera, see _publish
+            camera = self.default_camera
+        elif camera not in self.frames and camera not in self.states:
+            return None
+        return self._channel(channels, camera)
+
+    def _publish(self, channels, camera, data):
+        if self.default_camera is None and camera is not None:
+            self.default_camera = camera
+            # Clients that connected before the first frame wait on the
+            # channel of the default camera, which is now this one
+            for shared in (self.frames, self.states):
+                if None in shared and camera not in shared:
+                    shared[camera] = shared.pop(None)
+        self._channel(channels, camera).publish(data)
+
+    def set_encoded_frame(self, encoded, camera=None):
+        """ Shows an EncodedFrame to the stream and snapshot clients. """
+        if self.ready.isSet():
+            self.loop.call_soon_threadsafe(
+                self._publish, self.frames, camera, encoded.tobytes()
+            )
+
+    def publish_state(self, payload, camera=None):
+        """ Sends a json payload to the events clients. """
+        if self.ready.isSet():
+            self.loop.call_soon_threadsafe(
+                self._publish, self.states, camera, payload.encode("utf-8")
+            )
+
+    async def _handle(self, reader, writer):
+        self.requests += 1
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10.0)
+            method, target = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")[:2]
+            url = urlsplit(target)
+            camera = parse_qs(url.query).get("camera", [None])[0]
+            endpoints = {
+                "/stream.mjpeg": (self._stream, self.frames),
+                "/events": (self._events, self.states),
+                "/snapshot.jpg": (self._snapshot, self.frames),
+            }
+            if method != "GET":
+                await self._respond(writer, "405 Method Not Allowed", b"")
+            elif url.path not in endpoints:
+                await self._respond(writer, "404 Not Found", b"")
+            else:
+                endpoint, channels = endpoints[url.path]
+                channel = self._client_channel(channels, camera)
+                if channel is None:
+                    await self._respond(writer, "404 Not Found", b"Unknown camera")
+                else:
+                    await endpoint(writer, channel)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except asyncio.CancelledError:
+            # The server is stopping; asyncio before 3.12 logs handlers that
+            # end cancelled
+            pass
+        finally:
+            writer.close()
+
+    def _headers(self, status, content_type, length=None):
+        lines = [
+            "HTTP/1.1 " + status,
+            "Content-Type: " + content_type,
+            "Cache-Control: no-cache",
+            "Connection: close",
+        ]
+        if self.allow_origin:
+            # The dashboard is served from another origin
+            lines.append("Access-Control-Allow-Origin: " + self.allow_origin)
+        if length is not None:
+            lines.append("Content-Length: {}".format(length))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+    async def _send(self, writer, data):
+        """ Writes data, waiting until the client has taken most of what was
+            written before.
+        """
+        writer.write(data)
+        self.bytes_sent += len(data)
+        await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+    async def _respond(self, writer, status, body, content_type="text/plain"):
+        await self._send(writer, self._headers(status, content_type, len(body)) + body)
+
+    async def _snapshot(self, writer, channel):
+        if channel.data is None:
+            await self._respond(writer, "503 Service Unavailable", b"No frame yet")
+        else:
+            await self._respond(writer, "200 OK", channel.data, "image/jpeg")
+
+    async def _stream(self, writer, channel):
+        writer.transport.set_write_buffer_limits(high=self.buffer_bytes)
+        await self._send(
+            writer,
+            self._headers(
+                "200 OK",
+                "multipart/x-mixed-replace; boundary=" + BOUNDARY.decode("ascii"),
+            ),
+        )
+        self.clients["stream"] += 1
+        try:
+            version = 0
+            while True:
+                try:
+                    await channel.wait_newer(version, self.keepalive)
+                except asyncio.TimeoutError:
+                    continue
+                if version:
+                    # Frames published while this client was busy
+                    self.frames_dropped += channel.version - version - 1
+                version = channel.version
+                sent = self.loop.time()
+                await self._send(writer, channel.part())
+                self.frames_sent += 1
+                delay = sent + self.min_interval - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            self.clients["stream"] -= 1
+
+    async def _events(self, writer, channel):
+        await self._send(writer, self._headers("200 OK", "text/event-stream"))
+        self.clients["events"] += 1
+        try:
+            version = 0
+            while True:
+                try:
+                    await channel.wait_newer(version, self.keepalive)
+                except asyncio.TimeoutError:
+                    await self._send(writer, b": keep-alive\n\n")
+                    continue
+                version = channel.version
+                await self._send(writer, b"event: result\ndata: " + channel.data + b"\n\n")
+                self.events_sent += 1
+        finally:
+            self.clients["events"] -= 1
+
+    def stats(self):
+        """ Returns the connected clients and the frames and events sent,
+            and the frames skipped for busy clients.
+        """
+        return {
+            "port": self.port,
+            "stream_clients": self.clients["stream"],
+            "events_clients": self.clients["events"],
+            "requests": self.requests,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "events_sent": self.events_sent,
+            "timeouts": self.timeouts,
+            "mbytes_sent": round(self.bytes_sent / 1e6, 1),
+        }
+
+    def join(self, timeout=None):
+        if self.loop is not None and self.ready.isSet():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        super(StreamServer, self).join(timeout)
@@ -0,0 +1,207 @@
+""" Lightweight multi-object tracker linking the SSD person boxes of
+    consecutive frames, so the PPE status of a person can be cached on their
+    track and Rekognition only asked about new or changed persons.
+"""
+from threading import Lock
+import time
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """ Intersection over union of every pair of boxes.
+        a - (n, 4) array of (xmin, ymin, xmax, ymax) boxes
+        b - (m, 4) array of (xmin, ymin, xmax, ymax) boxes
+        Returns an (n, m) array.
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    left = np.maximum(a[:, None, 0], b[None, :, 0])
+    top = np.maximum(a[:, None, 1], b[None, :, 1])
+    right = np.minimum(a[:, None, 2], b[None, :, 2])
+    bottom = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def greedy_match(iou, threshold):
+    """ Matches rows to columns by decreasing IoU, each row and column at
+        most once. Returns the list of (row, column) pairs above threshold.
+    """
+    iou = iou.copy()
+    pairs = []
+    for _ in range(min(iou.shape)):
+        row, column = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[row, column] < threshold:
+            break
+        pairs.append((int(row), int(column)))
+        iou[row, :] = -1
+        iou[:, column] = -1
+    return pairs
+
+
+class Track(object):
+    """ One person followed across frames, with the labels of the last
+        Rekognition analysis that covered them.
+    """
+
+    __slots__ = (
+        "track_id",
+        "box",
+        "hits",
+        "misses",
+        "labels",
+        "analysed_box",
+        "analysed_at",
+    )
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.hits = 1
+        self.misses = 0
+        self.labels = None
+        self.analysed_box = None
+        self.analysed_at = None
+
+
+class PersonTracker(object):
+    """ IoU tracker: person boxes are matched to the existing tracks by
+        greedy IoU matching, unmatched boxes start new tracks and tracks not
+        seen for max_misses frames are dropped. A track needs a Rekognition
+        analysis when it is new, when its box moved away from the box that
+        was analysed, or when its labels are older than ttl seconds.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=5, refresh_iou=0.5, ttl=10.0):
+        """ iou_threshold - Minimum IoU between a box and a track to match
+            max_misses - Frames a track survives without a matching box
+            refresh_iou - A track whose box has an IoU below this with the
+                          analysed box is analysed again
+            ttl - Maximum age in seconds of the labels of a track
+        """
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.refresh_iou = refresh_iou
+        self.ttl = ttl
+        self.tracks = []
+        self.next_id = 1
+        self.births = 0
+        self.deaths = 0
+        self.frames = 0
+        self.analyses = 0
+        self.started = time.time()
+        self._lock = Lock()
+
+    def update(self, boxes):
+        """ Links the person boxes of a new frame to the tracks.
+            boxes - List of pixel (xmin, ymin, xmax, ymax) person boxes
+            Returns the track of every box, in the order of the boxes.
+        """
+        with self._lock:
+            matched = [None] * len(boxes)
+            seen = set()
+            if self.tracks and boxes:
+                iou = iou_matrix([track.box for track in self.tracks], boxes)
+                for row, column in greedy_match(iou, self.iou_threshold):
+                    track = self.tracks[row]
+                    track.box = boxes[column]
+                    track.hits += 1
+                    track.misses = 0
+                    matched[column] = track
+                    seen.add(row)
+            for row, track in enumerate(self.tracks):
+                if row not in seen:
+                    track.misses += 1
+            alive = [track for track in self.tracks if track.misses <= self.max_misses]
+            self.deaths += len(self.tracks) - len(alive)
+            for column, box in enumerate(boxes):
+                if matched[column] is None:
+                    matched[column] = Track(self.next_id, box)
+                    self.next_id += 1
+                    self.births += 1
+                    alive.append(matched[column])
+            self.tracks = alive
+            if boxes:
+                self.frames += 1
+            return matched
+
+    def needs_analysis(self, track, now=None):
+        if track.labels is None:
+            return True
+        now = time.time() if now is None else now
+        if now - track.analysed_at > self.ttl:
+            return True
+        iou = iou_matrix([track.box], [track.analysed_box])[0, 0]
+        return iou < self.refresh_iou
+
+    def pending(self, tracks, now=None):
+        """ The tracks among the given ones that need an analysis. """
+        now = time.time() if now is None else now
+        return [track for track in tracks if self.needs_analysis(track, now)]
+
+    def assign(self, tracks, labels, frame_shape, now=None):
+        """ Stores the labels of an analysis on the tracks it covered. A
+            label goes to the track whose box contains its centre, the
+            smallest one when several do.
+            tracks - Tracks covered by the analysis
+            labels - Rekognition custom labels, relative to the frame
+            frame_shape - Shape of the frame, to convert the boxes to pixels
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self.analyses += 1
+            for track in tracks:
+                track.labels = []
+                track.analysed_box = track.box
+                track.analysed_at = now
+            if not tracks:
+                return
+            boxes = np.array([track.box for track in tracks], dtype=np.float64)
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            height, width = frame_shape[:2]
+            for label in labels:
+                if "Geometry" not in label:
+                    continue
+                box = label["Geometry"]["BoundingBox"]
+                cx = (box["Left"] + box["Width"] / 2.0) * width
+                cy = (box["Top"] + box["Height"] / 2.0) * height
+                inside = (
+                    (boxes[:, 0] <= cx)
+                    & (cx <= boxes[:, 2])
+                    & (boxes[:, 1] <= cy)
+                    & (cy <= boxes[:, 3])
+                )
+                if not inside.any():
+                    continue
+                index = np.nonzero(inside)[0][np.argmin(areas[inside])]
+                tracks[index].labels.append(label)
+
+    def labels(self, tracks):
+        """ The cached labels of the tracks, as one CustomLabels list. """
+        labels = []
+        for track in tracks:
+            if track.labels:
+                labels.extend(track.labels)
+        return labels
+
+    def stats(self):
+        """ Returns the track counts and the Rekognition calls per minute
+            against the calls a per-frame analysis would have made.
+        """
+        with self._lock:
+            minutes = max(time.time() - self.started, 1e-9) / 60.0
+            return {
+                "tracks": len(self.tracks),
+                "births": self.births,
+                "deaths": self.deaths,
+                "frames_with_persons": self.frames,
+                "analyses": self.analyses,
+                "calls_per_minute": round(self.analyses / minutes, 1),
+                "frames_per_minute": round(self.frames / minutes, 1),
+                "call_reduction": round(1.0 - float(self.analyses) / self.frames, 3)
+                if self.frames
+                else 0.0,
+            }
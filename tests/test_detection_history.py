@@ -0,0 +1,87 @@
+""" Histograms of DetectionHistory against the records it keeps. """
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+from detection_history import OTHER, DetectionHistory  # noqa: E402
+from detections import PERSON, PPE, Detections, find_label_id, label_id  # noqa: E402
+
+
+def frame(rng, count):
+    names = rng.choice([PERSON, PPE, "helmet"], count)
+    return Detections.from_rekognition(
+        [
+            {
+                "Name": str(name),
+                "Confidence": float(confidence),
+                "Geometry": {"BoundingBox": {"Left": 0.1, "Top": 0.1, "Width": 0.2, "Height": 0.2}},
+            }
+            for name, confidence in zip(names, rng.uniform(50, 100, count))
+        ]
+    )
+
+
+def histograms(history):
+    """ The histograms rebuilt from the stored records. """
+    records = history.query(-np.inf, np.inf)
+    expected = np.zeros_like(history._histograms)
+    np.add.at(
+        expected,
+        (
+            np.minimum(records["label_id"], history.max_labels - 1),
+            np.clip(np.rint(records["confidence"]), 0, 100).astype(np.int64),
+        ),
+        1,
+    )
+    return expected
+
+
+@pytest.mark.parametrize("capacity, labels", [(10, 8), (10, 3), (7, 10), (100, 8)])
+def test_histograms_follow_records(capacity, labels):
+    rng = np.random.RandomState(0)
+    history = DetectionHistory(capacity=capacity)
+    for index in range(20):
+        history.add(float(index), index, frame(rng, labels))
+        assert len(history) == min(capacity, (index + 1) * labels)
+        np.testing.assert_array_equal(history._histograms, histograms(history))
+
+
+def test_percentiles_by_name():
+    history = DetectionHistory()
+    history.add(0.0, 0, Detections.from_rekognition([{"Name": PPE, "Confidence": 80.0}]))
+    assert history.query(0, 1)["label_id"].tolist() == [label_id(PPE)]
+    assert history.percentiles(PPE) == {50: 80, 90: 80, 99: 80}
+    assert history.percentiles("never_seen") is None
+    assert list(history.stats()["confidence"]) == [PPE]
+
+
+def test_percentiles_do_not_intern():
+    history = DetectionHistory()
+    assert history.percentiles("asked_but_never_seen") is None
+    assert find_label_id("asked_but_never_seen") is None
+
+
+def test_labels_past_max_labels_are_other():
+    history = DetectionHistory(max_labels=3)
+    history.add(
+        0.0,
+        0,
+        Detections.from_rekognition(
+            [
+                {"Name": PPE, "Confidence": 80.0},
+                {"Name": "vest", "Confidence": 60.0},
+                {"Name": "gloves", "Confidence": 70.0},
+            ]
+        ),
+    )
+    assert history.percentiles(PPE) == {50: 80, 90: 80, 99: 80}
+    # Both share the last histogram, neither has percentiles of its own
+    assert history.percentiles("vest") is None
+    assert history.percentiles("gloves") is None
+    assert history.percentiles(OTHER) == {50: 60, 90: 70, 99: 70}
+    assert sorted(history.stats()["confidence"]) == sorted([PPE, OTHER])
@@ -0,0 +1,55 @@
+""" LocalPPEDetector on drawn scenes: a person against a background, with or
+    without a hard hat.
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+from fallback import HELMET_COLOURS, WHITE_HELMET, LocalPPEDetector  # noqa: E402
+
+BOX = (260, 80, 380, 460)
+
+
+def scene(background, hat=None):
+    """ A 640x480 frame with one person in BOX, wearing a hat of BGR colour
+        hat if given.
+    """
+    frame = np.full((480, 640, 3), background, dtype=np.uint8)
+    xmin, ymin, xmax, ymax = BOX
+    cv2.rectangle(frame, (xmin, ymin + 60), (xmax, ymax), (60, 50, 40), -1)
+    cx = (xmin + xmax) // 2
+    cv2.circle(frame, (cx, ymin + 35), 25, (120, 150, 190), -1)
+    if hat is not None:
+        cv2.ellipse(frame, (cx, ymin + 30), (30, 25), 0, 180, 360, hat, -1)
+    return frame
+
+
+def ppes(detector, frame):
+    labels = detector.detect(frame, [BOX])["CustomLabels"]
+    return [label for label in labels if label["Name"] == "PPE"]
+
+
+def test_bright_background_is_no_helmet():
+    detector = LocalPPEDetector()
+    for background in ((245, 245, 245), (250, 220, 200), (255, 255, 255)):
+        assert ppes(detector, scene(background)) == []
+    assert detector.stats() == {"frames": 3, "persons": 3, "ppes": 0}
+
+
+def test_coloured_helmets_are_found():
+    detector = LocalPPEDetector()
+    for hat in ((0, 220, 240), (0, 140, 255), (200, 90, 20)):
+        assert len(ppes(detector, scene((245, 245, 245), hat))) == 1
+    assert ppes(detector, scene((245, 245, 245))) == []
+
+
+def test_white_helmets_are_opt_in():
+    white = (245, 245, 245)
+    assert ppes(LocalPPEDetector(), scene((90, 90, 90), white)) == []
+    detector = LocalPPEDetector(colours=dict(HELMET_COLOURS, white=WHITE_HELMET))
+    assert len(ppes(detector, scene((90, 90, 90), white))) == 1
@@ -0,0 +1,60 @@
+""" The capture loop of frame_ring.py when the source changes resolution. """
+import os
+import sys
+import threading
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+import frame_ring  # noqa: E402
+from frame_ring import FrameRing, RingReader, fit_frame  # noqa: E402
+from frame_sources import FrameSource  # noqa: E402
+
+
+class ListSource(FrameSource):
+    """ Returns the frames given, then sets stop. """
+
+    def __init__(self, frames, stop):
+        super(ListSource, self).__init__("test")
+        self.frames = list(frames)
+        self.stop = stop
+
+    def read(self):
+        if not self.frames:
+            self.stop.set()
+            return False, None
+        return True, self.frames.pop(0)
+
+
+def test_fit_frame():
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    assert fit_frame(frame, (480, 640, 3), frame.dtype) is frame
+    assert fit_frame(np.zeros((720, 1280, 3), np.uint8), (480, 640, 3), frame.dtype).shape == (480, 640, 3)
+    assert fit_frame(np.zeros((480, 640), np.uint8), (480, 640, 3), frame.dtype) is None
+    assert fit_frame(np.zeros((480, 640, 3), np.float32), (480, 640, 3), frame.dtype) is None
+
+
+def test_capture_survives_a_resolution_change(monkeypatch):
+    ring = FrameRing.create(8, (48, 64, 3))
+    stop = threading.Event()
+    frames = [
+        np.full((48, 64, 3), 1, np.uint8),
+        np.full((96, 128, 3), 2, np.uint8),
+        np.full((96, 128), 3, np.uint8),
+        np.full((96, 128, 3), 4, np.uint8),
+    ]
+    monkeypatch.setattr(frame_ring, "open_source", lambda camera, location: ListSource(frames, stop))
+    try:
+        frame_ring.capture_loop("test", "list", ring.spec(), stop)
+        reader = RingReader(ring)
+        values = []
+        for _ in range(ring.head):
+            frame = reader.next(timeout=0)
+            assert frame.image.shape == (48, 64, 3)
+            values.append(int(frame.image[0, 0, 0]))
+        # The grey frame does not fit a colour ring and is skipped
+        assert values == [1, 2, 4]
+    finally:
+        ring.close()
@@ -0,0 +1,96 @@
+""" PersonGate alone and in the analyse stage, with the SSD model and the
+    Rekognition client replaced by the stand-ins of benchmarks/fakes.py.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import fakes  # noqa: E402
+from detections import Detections  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from person_gate import PersonGate  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+
+
+def ssd(*objects):
+    """ parseResult output of (label, prob) objects. """
+    return [
+        {"label": label, "prob": prob, "xmin": 10.0, "ymin": 10.0, "xmax": 60.0, "ymax": 200.0}
+        for label, prob in objects
+    ]
+
+
+@pytest.mark.parametrize("parse", [list, lambda results: Detections.from_ssd(results, 300, 300)])
+def test_threshold_and_class(parse):
+    gate = PersonGate(0.5)
+    assert gate.allow(parse(ssd((15, 0.9))))
+    # Below the threshold, or not a person
+    assert not gate.allow(parse(ssd((15, 0.4))))
+    assert not gate.allow(parse(ssd((7, 0.99), (9, 0.8))))
+    assert not gate.allow(parse([]))
+    assert gate.allow(parse(ssd((7, 0.99), (15, 0.51))))
+    assert gate.stats() == {"hits": 2, "skips": 3, "hit_ratio": 0.4}
+
+
+def test_persons_above_threshold():
+    gate = PersonGate(0.3)
+    persons = gate.persons(Detections.from_ssd(ssd((15, 0.2), (15, 0.35), (15, 0.8)), 300, 300))
+    assert len(persons) == 2
+
+
+def stages(person_rate):
+    return DetectionStages(
+        None,
+        fakes.FakeModel(persons=1, person_rate=person_rate, seed=0),
+        fakes.FakeRekognition(persons=1, seed=0),
+        None,
+        fakes.FakeIoTClient(),
+        "test/infer",
+        None,
+        "arn:test",
+        person_gate=PersonGate(0.25),
+        metrics=Metrics(),
+    )
+
+
+def analyse(stages, count):
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    jobs = []
+    for frame_id in range(count):
+        job = stages.infer({"frame_id": frame_id, "timestamp": 100.0 + frame_id, "frame": frame})
+        jobs.append(stages.analyse(job))
+    return jobs
+
+
+def test_frames_without_persons_skip_rekognition():
+    gated = stages(person_rate=0.0)
+    jobs = analyse(gated, 5)
+    assert gated.rekognition.calls == 0
+    assert all(job["response"] is DetectionStages.EMPTY_RESPONSE for job in jobs)
+    assert gated.person_gate.stats()["skips"] == 5
+    assert gated.metrics.snapshot()["counters"]["gate_skips"] == 5
+
+
+def test_frames_with_persons_pass():
+    gated = stages(person_rate=1.0)
+    jobs = analyse(gated, 3)
+    assert gated.rekognition.calls == 3
+    assert all(job["response"]["CustomLabels"] for job in jobs)
+    assert gated.person_gate.stats() == {"hits": 3, "skips": 0, "hit_ratio": 1.0}
+    assert "gate_skips" not in gated.metrics.snapshot()["counters"]
+
+
+def test_skips_are_counted_per_frame():
+    gated = stages(person_rate=0.5)
+    analyse(gated, 40)
+    stats = gated.person_gate.stats()
+    assert stats["hits"] + stats["skips"] == 40
+    assert gated.rekognition.calls == stats["hits"]
+    assert gated.metrics.snapshot()["counters"]["gate_skips"] == stats["skips"]
+    assert 0 < stats["skips"] < 40
@@ -0,0 +1,78 @@
+""" Error handling of ReplayWorker: which backend failures are retried,
+    which become the error of a frame and which end the replay.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import fakes  # noqa: E402
+import replay  # noqa: E402
+from replay import ReplayWorker  # noqa: E402
+
+
+class FailingBackend(object):
+    """ Raises the errors given, then answers like FakeRekognition. """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.rekognition = fakes.FakeRekognition(persons=1, seed=0)
+
+    def detect_custom_labels(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.rekognition.detect_custom_labels(**kwargs)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(replay.time, "sleep", lambda seconds: None)
+
+
+def process(backend, retries=3):
+    worker = ReplayWorker(backend, "arn:test", retries=retries)
+    return worker.process(("test.mp4", 0, 0.0, np.zeros((120, 160, 3), dtype=np.uint8)))
+
+
+def test_service_errors_are_retried():
+    backend = FailingBackend(
+        fakes.FakeClientError("ThrottlingException", "DetectCustomLabels"),
+        fakes.FakeClientError("InternalServerError", "DetectCustomLabels"),
+    )
+    result = process(backend)
+    assert backend.calls == 3
+    assert "error" not in result and result["persons"] == 1
+
+
+def test_service_errors_fail_the_frame_once_retries_run_out():
+    backend = FailingBackend(*[fakes.FakeClientError("ThrottlingException", "DetectCustomLabels")] * 3)
+    result = process(backend, retries=2)
+    assert backend.calls == 3
+    assert "ThrottlingException" in result["error"] and result["labels"] == []
+
+
+def test_rejected_calls_fail_the_frame_without_retry():
+    backend = FailingBackend(fakes.FakeClientError("AccessDeniedException", "DetectCustomLabels"))
+    result = process(backend)
+    assert backend.calls == 1
+    assert "AccessDeniedException" in result["error"]
+
+
+def test_bugs_end_the_replay():
+    backend = FailingBackend(KeyError("CustomLabels"))
+    with pytest.raises(KeyError):
+        process(backend)
+    assert backend.calls == 1
+
+
+def test_unreadable_images_fail_the_frame(tmp_path):
+    worker = ReplayWorker(FailingBackend(), "arn:test")
+    result = worker.process(("images", 0, None, str(tmp_path / "missing.jpg")))
+    assert result["error"].startswith("Cannot read image")
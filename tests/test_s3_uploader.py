@@ -0,0 +1,128 @@
+""" S3Uploader against the in-memory S3 of benchmarks/fakes.py: retries,
+    rejected uploads, the spool and its callbacks.
+"""
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import fakes  # noqa: E402
+from s3_uploader import S3Uploader, UploadSpool  # noqa: E402
+
+
+class FlakyS3(fakes.FakeS3):
+    """ FakeS3 failing with code while failures remain, or while down is
+        set, and recording the key of every attempt.
+    """
+
+    def __init__(self, failures=0, code="ServiceUnavailable"):
+        super(FlakyS3, self).__init__()
+        self.failures = failures
+        self.code = code
+        self.down = threading.Event()
+        self.attempts = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self._lock:
+            self.attempts.append(Key)
+            failed = self.failures > 0 or self.down.isSet()
+            if self.failures > 0:
+                self.failures -= 1
+        if failed:
+            raise fakes.FakeClientError(self.code, "PutObject")
+        return super(FlakyS3, self).put_object(Bucket, Key, Body, **kwargs)
+
+    def keys(self):
+        return [key for bucket, key in self.objects]
+
+
+def uploader(s3, tmp_path, **kwargs):
+    kwargs.setdefault("backoff", 0.001)
+    kwargs.setdefault("drain_interval", 0.05)
+    return S3Uploader(s3, "bucket", spool_dir=str(tmp_path / "spool"), **kwargs)
+
+
+def item(key):
+    return {"Key": key, "Body": key.encode("ascii")}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_service_errors_are_retried(tmp_path):
+    s3 = FlakyS3(failures=2)
+    assert uploader(s3, tmp_path, retries=3).upload(item("a.jpg")) is True
+    assert s3.attempts == ["a.jpg"] * 3
+    assert s3.keys() == ["a.jpg"]
+
+
+def test_rejected_uploads_are_dropped(tmp_path):
+    for code in ("AccessDenied", "NoSuchBucket", "InvalidRequest"):
+        s3 = FlakyS3(failures=1, code=code)
+        up = uploader(s3, tmp_path / code)
+        ran = []
+        up.start()
+        try:
+            up.submit(item("a.jpg"), callback=lambda item: ran.append(item))
+            wait_for(lambda: up.stats()["rejected"] == 1)
+            stats = up.stats()
+        finally:
+            up.join()
+        assert s3.attempts == ["a.jpg"]
+        assert ran == []
+        assert stats["online"] and stats["spool"]["files"] == 0 and stats["failed"] == 0
+
+
+def test_failed_uploads_are_spooled_and_drained_oldest_first(tmp_path):
+    s3 = FlakyS3()
+    s3.down.set()
+    up = uploader(s3, tmp_path, workers=1, retries=1)
+    up.start()
+    try:
+        up.submit(item("0.jpg"))
+        wait_for(lambda: up.stats()["spool"]["files"] == 1)
+        assert not up.stats()["online"]
+        # The uplink is known to be down: straight to the spool
+        for key in ("1.jpg", "2.jpg", "3.jpg"):
+            up.submit(item(key))
+        assert up.stats()["spool"]["files"] == 4
+        s3.down.clear()
+        wait_for(lambda: up.stats()["backlog"] == 0)
+    finally:
+        up.join()
+    assert s3.keys() == ["0.jpg", "1.jpg", "2.jpg", "3.jpg"]
+    assert up.stats()["online"]
+
+
+def test_spooled_callbacks_run_for_the_current_run_only(tmp_path):
+    # An upload spooled by an earlier run of the uploader
+    UploadSpool(str(tmp_path / "spool"), 1 << 20).put(item("old.jpg"), ["0badc0de", "seen", [0]])
+    s3 = FlakyS3()
+    s3.down.set()
+    up = uploader(s3, tmp_path, workers=1, retries=0)
+    seen = []
+    up.register("seen", lambda item, seq: seen.append((item["Key"], seq)))
+    plain = []
+    up.submit(item("1.jpg"), callback=("seen", (1,)))
+    up.submit(item("2.jpg"), callback=lambda item: plain.append(item["Key"]))
+    up.submit(item("3.jpg"), callback=("seen", (3,)))
+    up.start()
+    try:
+        wait_for(lambda: up.stats()["spool"]["files"] == 4)
+        assert seen == [] and plain == []
+        s3.down.clear()
+        wait_for(lambda: len(seen) == 2)
+    finally:
+        up.join()
+    assert s3.keys() == ["old.jpg", "1.jpg", "2.jpg", "3.jpg"]
+    # Only named callbacks are stored with the spooled upload
+    assert seen == [("1.jpg", 1), ("3.jpg", 3)]
+    assert plain == []
@@ -0,0 +1,159 @@
+""" Retries of CallScheduler.call against a stub Rekognition client. """
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+from scheduler import CallScheduler, service_error  # noqa: E402
+
+
+class StubError(Exception):
+    """ Like a botocore ClientError. """
+
+    def __init__(self, code, status=None):
+        super(StubError, self).__init__(code)
+        self.response = {"Error": {"Code": code}}
+        if status is not None:
+            self.response["ResponseMetadata"] = {"HTTPStatusCode": status}
+
+
+class StubClient(object):
+    """ Fails the first failures calls, then returns an empty response. """
+
+    def __init__(self, failures=0, code="InternalServerError"):
+        self.failures = failures
+        self.code = code
+        self.calls = 0
+
+    def detect_custom_labels(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise StubError(self.code)
+        return {"CustomLabels": []}
+
+
+def scheduler(retries):
+    return CallScheduler(retries=retries, sleep=lambda seconds: None, seed=0)
+
+
+@pytest.mark.parametrize("retries", [0, 1, 3])
+def test_succeeds_on_first_attempt(retries):
+    client = StubClient()
+    assert scheduler(retries).call(client.detect_custom_labels) == {"CustomLabels": []}
+    assert client.calls == 1
+
+
+@pytest.mark.parametrize("retries", [0, 1, 3])
+def test_succeeds_on_last_retry(retries):
+    client = StubClient(failures=retries)
+    calls = scheduler(retries)
+    assert calls.call(client.detect_custom_labels) == {"CustomLabels": []}
+    assert client.calls == retries + 1
+    assert calls.stats().get("retried", 0) == retries
+
+
+@pytest.mark.parametrize("retries", [0, 1, 3])
+def test_raises_when_retries_run_out(retries):
+    client = StubClient(failures=retries + 1)
+    with pytest.raises(StubError):
+        scheduler(retries).call(client.detect_custom_labels)
+    assert client.calls == retries + 1
+
+
+def test_bug_is_not_retried():
+    calls = []
+
+    def broken(**kwargs):
+        calls.append(kwargs)
+        return {}["CustomLabels"]
+
+    with pytest.raises(KeyError):
+        scheduler(3).call(broken)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        StubError("ThrottlingException"),
+        StubError("ProvisionedThroughputExceededException"),
+        StubError("InternalServerError"),
+        StubError("ServiceUnavailableException"),
+        StubError("SomeNewServerError", status=503),
+        StubError("TooManyRequests", status=429),
+        TimeoutError("read timed out"),
+        ConnectionResetError("reset by peer"),
+    ],
+)
+def test_service_errors(error):
+    assert service_error(error)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        StubError("ValidationException", status=400),
+        StubError("AccessDeniedException", status=403),
+        StubError("ResourceNotFoundException", status=404),
+        StubError("InvalidImageFormatException"),
+        KeyError("CustomLabels"),
+    ],
+)
+def test_caller_errors(error):
+    assert not service_error(error)
+
+
+@pytest.mark.parametrize("code", ["ValidationException", "AccessDeniedException"])
+def test_caller_error_is_not_retried(code):
+    client = StubClient(failures=1, code=code)
+    calls = scheduler(3)
+    with pytest.raises(StubError):
+        calls.call(client.detect_custom_labels)
+    assert client.calls == 1
+    assert "failed" not in calls.stats()
+
+
+class Clock(object):
+    """ Simulated clock. While a retry sleeps, another camera asks for a
+        call, as it would on its own thread.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.scheduler = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.scheduler.should_call(True)
+        self.now += seconds
+
+
+def test_retries_keep_the_budget_window_in_order():
+    clock = Clock()
+    calls = clock.scheduler = CallScheduler(
+        budget_per_minute=60,
+        active_interval=0,
+        idle_interval=0,
+        retries=2,
+        backoff=5.0,
+        clock=clock,
+        sleep=clock.sleep,
+        seed=0,
+    )
+    calls.call(StubClient(failures=2).detect_custom_labels)
+    window = list(calls._calls)
+    assert window == sorted(window) and len(window) == 4
+    # A minute after the last one, every call left the window
+    clock.now = window[-1] + 60.0
+    calls.should_call(True)
+    assert list(calls._calls) == [clock.now]
+
+
+def test_negative_retries_rejected():
+    with pytest.raises(Exception):
+        CallScheduler(retries=-1)
@@ -0,0 +1,198 @@
+""" The answers of DetectionStages.analyse with the person gate, tracks, label
+    cache and motion regions all enabled, as shipped.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import fakes  # noqa: E402
+from label_cache import LabelCache  # noqa: E402
+from manifest import DangerIndex, LatestManifest  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from mosaic import MosaicBuilder  # noqa: E402
+from motion import MotionDetector  # noqa: E402
+from person_gate import PersonGate  # noqa: E402
+from stages import DetectionStages  # noqa: E402
+from tracker import PersonTracker  # noqa: E402
+
+WIDTH, HEIGHT = 640, 480
+
+
+class StubModel(object):
+    """ SSD stand-in finding the person boxes given, in input coordinates. """
+
+    def __init__(self):
+        self.boxes = []
+
+    def doInference(self, frame):
+        return frame
+
+    def parseResult(self, model_type, result):
+        return {
+            model_type: [
+                {"label": 15, "prob": 0.9, "xmin": x0, "ymin": y0, "xmax": x1, "ymax": y1}
+                for x0, y0, x1, y1 in self.boxes
+            ]
+        }
+
+
+def background():
+    x = np.linspace(0, 200, WIDTH, dtype=np.float32)
+    y = np.linspace(0, 50, HEIGHT, dtype=np.float32)[:, None]
+    frame = np.dstack([x + 0 * y] * 3).astype(np.uint8)
+    frame[:, :, 1] += y.astype(np.uint8)
+    return frame
+
+
+@pytest.fixture
+def stages():
+    return DetectionStages(
+        None,
+        StubModel(),
+        fakes.FakeRekognition(persons=1, seed=0),
+        None,
+        fakes.FakeIoTClient(),
+        "test/infer",
+        None,
+        "arn:test",
+        person_gate=PersonGate(0.25),
+        label_cache=LabelCache(),
+        mosaic=MosaicBuilder(),
+        tracker=PersonTracker(ttl=1.0),
+        motion=MotionDetector(),
+        metrics=Metrics(),
+    )
+
+
+def analyse(stages, frame, boxes, timestamp):
+    stages.model.boxes = boxes
+    job = stages.infer({"frame_id": 0, "timestamp": timestamp, "frame": frame})
+    return stages.analyse(job)
+
+
+def counters(stages):
+    return stages.metrics.snapshot(reset=False)["counters"]
+
+
+def test_every_path_is_reachable(stages):
+    calls = lambda: stages.rekognition.calls  # noqa: E731
+    person = (20.0, 40.0, 80.0, 280.0)
+    frame = background()
+    # The tracker dates the labels with the clock
+    start = time.time()
+
+    # A new person: analysed, and the frame becomes the motion reference
+    job = analyse(stages, frame, [person], start)
+    assert calls() == 1 and job["analysed"]
+    assert stages.motion.analysed_at == start
+
+    # Nothing moved: the previous response is reused
+    analyse(stages, frame.copy(), [person], start + 0.5)
+    assert calls() == 1 and counters(stages)["motion_skips"] == 1
+
+    # A small change far from the person: same signature, served by the cache
+    changed = frame.copy()
+    changed[440:470, 600:630] = 255
+    job = analyse(stages, changed, [person], start + 1.0)
+    assert calls() == 1 and counters(stages)["cache_hits"] == 1
+    assert not job.get("analysed") and stages.motion.analysed_at == start
+
+    # A large change: the cache misses, the track still has recent labels
+    moved = frame.copy()
+    moved[:, WIDTH // 2 :] = 255 - moved[:, WIDTH // 2 :]
+    job = analyse(stages, moved, [person], start + 1.2)
+    assert calls() == 1 and counters(stages)["track_hits"] == 1
+    assert not job.get("analysed") and stages.motion.analysed_at == start
+
+    # A second person in the changed half, the labels of the first one are
+    # stale but it lies outside every region: only the newcomer is sent
+    track = stages.tracker.tracks[0]
+    track.analysed_at -= 5.0
+    newcomer = (220.0, 40.0, 280.0, 280.0)
+    job = analyse(stages, moved, [person, newcomer], start + 1.4)
+    assert calls() == 2 and counters(stages)["motion_partial"] == 1
+    assert job["analysed"] and stages.motion.analysed_at == start + 1.4
+    assert stages.tracker.tracks[0].analysed_at == track.analysed_at
+
+
+def test_gate_skips_before_any_path(stages):
+    job = analyse(stages, background(), [], 100.0)
+    assert job["response"] == DetectionStages.EMPTY_RESPONSE
+    assert stages.rekognition.calls == 0
+    assert counters(stages)["gate_skips"] == 1
+    assert stages.motion.analysed_at is None
+
+
+class RecordingUploader(object):
+    """ S3Uploader stand-in keeping the submitted keys. """
+
+    def __init__(self):
+        self.keys = []
+
+    def register(self, name, func):
+        pass
+
+    def submit(self, item, callback=None):
+        self.keys.append(item["Key"])
+
+
+def upload(stages, timestamp, violations=0):
+    frame = background()
+    job = {"frame_id": 0, "timestamp": timestamp, "frame": frame, "ssd": None}
+    job["response"] = DetectionStages.EMPTY_RESPONSE
+    job = stages.annotate(job)
+    job["association"] = dict(job["association"], violations=violations)
+    return stages.upload(job)
+
+
+def test_latest_frame_is_replaced_every_interval_and_on_alert():
+    uploader = RecordingUploader()
+    stages = DetectionStages(
+        None,
+        None,
+        None,
+        uploader,
+        None,
+        "test/infer",
+        None,
+        "arn:test",
+        manifest=LatestManifest(uploader),
+        danger_index=DangerIndex(alert_after=1),
+        latest_interval=5.0,
+    )
+    upload(stages, 100.0)
+    upload(stages, 102.0)
+    assert uploader.keys == ["latest.jpg"]
+    # The alert is raised
+    upload(stages, 103.0, violations=1)
+    upload(stages, 104.0, violations=1)
+    assert len(uploader.keys) == 2
+    upload(stages, 108.5, violations=1)
+    assert len(uploader.keys) == 3
+
+
+def test_frame_uploads_are_keyed_by_run():
+    uploader = RecordingUploader()
+    stages = DetectionStages(
+        None,
+        None,
+        None,
+        uploader,
+        None,
+        "test/infer",
+        None,
+        "arn:test",
+        frame_uploads=True,
+        run="3fa85f64",
+        camera="door",
+    )
+    upload(stages, 100.0)
+    upload(stages, 100.1)
+    assert uploader.keys == ["door/frameID: 3fa85f64-1.jpg", "door/frameID: 3fa85f64-2.jpg"]
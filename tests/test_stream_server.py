@@ -0,0 +1,66 @@
+""" Camera selection of the StreamServer endpoints. """
+import os
+import sys
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "labmda function"))
+
+from frame_encoder import EncodedFrame  # noqa: E402
+from stream_server import StreamServer  # noqa: E402
+
+JPEG = b"\xff\xd8door\xff\xd9"
+
+
+@pytest.fixture
+def server():
+    server = StreamServer(port=0)
+    server.start()
+    server.ready.wait(5.0)
+    yield server
+    server.join(5.0)
+
+
+def get(server, path):
+    """ Returns the status and body of a GET request. """
+    try:
+        with urlopen("http://127.0.0.1:{}{}".format(server.port, path), timeout=5.0) as response:
+            return response.status, response.read()
+    except HTTPError as ex:
+        return ex.code, ex.read()
+
+
+def publish(server, camera):
+    server.set_encoded_frame(EncodedFrame(np.frombuffer(JPEG, dtype=np.uint8), 90, (1, 1, 3)), camera)
+    deadline = time.time() + 5.0
+    while camera not in server.frames:
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_snapshot_of_the_cameras_that_published(server):
+    publish(server, "door")
+    assert get(server, "/snapshot.jpg?camera=door") == (200, JPEG)
+    # The first camera is the default one
+    assert get(server, "/snapshot.jpg") == (200, JPEG)
+
+
+def test_unknown_cameras_are_not_found(server):
+    publish(server, "door")
+    for path in ("/snapshot.jpg", "/stream.mjpeg", "/events"):
+        assert get(server, path + "?camera=yard") == (404, b"Unknown camera")
+    # No channel is created for them
+    assert list(server.frames) == ["door"] and list(server.states) == []
+
+
+def test_clients_before_the_first_frame_wait_for_the_default_camera(server):
+    assert get(server, "/snapshot.jpg") == (503, b"No frame yet")
+    assert get(server, "/snapshot.jpg?camera=door")[0] == 404
+    publish(server, "door")
+    assert get(server, "/snapshot.jpg") == (200, JPEG)
+    assert list(server.frames) == ["door"]